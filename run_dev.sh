@@ -34,10 +34,10 @@ echo "启动 Orchestrator Service (Celery Worker)"
 celery -A services.orchestrator.celery_app worker --loglevel=info -c 2 > orchestrator_worker.log 2>&1 &
 CELERY_WORKER_PID=$!
 
-# (可选) 启动 Celery Beat (用于周期性任务)
-# echo "启动 Celery Beat Scheduler"
-# celery -A services.orchestrator.celery_app beat --loglevel=info > celery_beat.log 2>&1 &
-# CELERY_BEAT_PID=$!
+# 启动 Celery Beat (用于周期性任务，如动态表的分区维护)
+echo "启动 Celery Beat Scheduler"
+celery -A services.orchestrator.celery_app beat --loglevel=info > celery_beat.log 2>&1 &
+CELERY_BEAT_PID=$!
 
 # 启动 Extractor 服务 (消费者)
 echo "启动 Extractor Service (Consumer)"
@@ -51,6 +51,7 @@ echo "服务日志文件:"
 echo "  - BFF Service:         bff_service.log"
 echo "  - Discovery Service:   discovery_service.log"
 echo "  - Orchestrator Worker: orchestrator_worker.log"
+echo "  - Celery Beat:         celery_beat.log"
 echo "  - Extractor Consumer:  extractor_consumer.log"
 echo "-------------------------------------------------"
 echo "前端开发提示:"
@@ -0,0 +1,97 @@
+"""
+测量各服务入口模块的导入耗时和内存占用，用于发现导入开销的回退。
+
+每个服务在独立的子进程中导入（不受其他服务已导入模块的影响），重复多次取中位数。
+还会检查禁止被加载的模块，例如 BFF 不应加载 Celery 应用。
+
+用法（在项目根目录执行）:
+    python scripts/measure_startup.py                # 打印表格
+    python scripts/measure_startup.py --json         # 输出JSON，便于在CI中保存和比较
+    python scripts/measure_startup.py --check        # 超出预算或加载了禁止的模块时以非零状态退出
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 服务名 -> (入口模块, 导入耗时预算 (秒), 不应被加载的模块)
+SERVICES = {
+    "bff": ("services.bff.main", 1.5, ["celery", "services.orchestrator.celery_app", "pika"]),
+    "analysis_svc": ("services.analysis_svc.main", 2.0, ["celery"]),
+    "discovery_svc": ("services.discovery_svc.main", 2.0, ["celery"]),
+    "extractor_svc": ("services.extractor_svc.consumer", 2.0, ["celery"]),
+    "orchestrator": ("services.orchestrator.tasks", 2.5, []),
+}
+
+# 在子进程中执行：导入模块，输出耗时、峰值内存和已加载的模块
+_PROBE = """
+import importlib, json, resource, sys, time
+start = time.perf_counter()
+importlib.import_module(sys.argv[1])
+elapsed = time.perf_counter() - start
+max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+# Linux 上 ru_maxrss 的单位是KB，macOS 上是字节
+rss_mb = max_rss / 1024 / 1024 if sys.platform == "darwin" else max_rss / 1024
+print(json.dumps({"seconds": elapsed, "rss_mb": rss_mb, "modules": sorted(sys.modules)}))
+"""
+
+def measure(module: str, runs: int) -> dict:
+    samples = []
+    env = {**os.environ, "PYTHONPATH": PROJECT_ROOT}
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", _PROBE, module],
+            cwd=PROJECT_ROOT, env=env, capture_output=True, text=True, check=True,
+        ).stdout
+        samples.append(json.loads(output.strip().splitlines()[-1]))
+    return {
+        "seconds": round(statistics.median(s["seconds"] for s in samples), 4),
+        "rss_mb": round(statistics.median(s["rss_mb"] for s in samples), 1),
+        "module_count": len(samples[-1]["modules"]),
+        "modules": set(samples[-1]["modules"]),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure import time and memory of each service entry point.")
+    parser.add_argument("--runs", type=int, default=5, help="number of fresh interpreter runs per service")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    parser.add_argument("--check", action="store_true", help="exit non-zero if a budget is exceeded or a forbidden module is loaded")
+    parser.add_argument("services", nargs="*", help="services to measure (default: all)")
+    args = parser.parse_args()
+
+    results = {}
+    failures = []
+    for name in args.services or SERVICES:
+        module, budget, forbidden = SERVICES[name]
+        try:
+            result = measure(module, args.runs)
+        except subprocess.CalledProcessError as e:
+            failures.append(f"{name}: import failed\n{e.stderr}")
+            continue
+        modules = result.pop("modules")
+        loaded_forbidden = [m for m in forbidden if m in modules]
+        result.update(budget_seconds=budget, forbidden_loaded=loaded_forbidden)
+        results[name] = result
+        if result["seconds"] > budget:
+            failures.append(f"{name}: import took {result['seconds']}s, budget is {budget}s")
+        if loaded_forbidden:
+            failures.append(f"{name}: loaded forbidden modules {loaded_forbidden}")
+
+    if args.json:
+        print(json.dumps({"results": results, "failures": failures}, indent=2))
+    else:
+        print(f"{'service':<16}{'import (s)':>12}{'budget (s)':>12}{'RSS (MB)':>10}{'modules':>9}")
+        for name, r in results.items():
+            print(f"{name:<16}{r['seconds']:>12}{r['budget_seconds']:>12}{r['rss_mb']:>10}{r['module_count']:>9}")
+        for failure in failures:
+            print(f"FAIL {failure}", file=sys.stderr)
+
+    if args.check and failures:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
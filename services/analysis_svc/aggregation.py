@@ -0,0 +1,191 @@
+import re
+from typing import Any, Dict, List, Optional
+
+from fastapi import HTTPException
+from pydantic import BaseModel
+from sqlalchemy import Integer, Numeric, Table, bindparam, distinct, func, literal_column, select
+
+from shared.config import settings
+from .report_query import FILTER_OPERATORS, ReportFilter, build_report_params, filter_condition, filter_shape, is_known_column
+from .schema_cache import statement_cache
+
+# --- Pydantic 模型 ---
+class AggregateMeasure(BaseModel):
+    function: str # e.g., "count", "count_distinct", "min", "max", "sum", "avg"
+    column: Optional[str] = None # count 可以省略列，表示 count(*)
+    alias: Optional[str] = None # 默认为 "<function>_<column>"
+
+class TimeBucket(BaseModel):
+    granularity: str # e.g., "hour", "day", "week", "month"
+    alias: str = "bucket"
+
+class HavingCondition(BaseModel):
+    measure: str # 引用某个度量的 alias
+    operator: str # e.g., "eq", "ne", "gt", "gte", "lt", "lte"
+    value: Any
+
+class OrderSpec(BaseModel):
+    field: str # 分组列、时间桶的 alias 或度量的 alias
+    direction: str = "asc" # "asc" 或 "desc"
+
+class AggregateRequest(BaseModel):
+    standard_dataset_id: int
+    group_by: List[str] = []
+    measures: List[AggregateMeasure]
+    time_bucket: Optional[TimeBucket] = None
+    filters: List[ReportFilter] = []
+    having: List[HavingCondition] = []
+    order_by: List[OrderSpec] = []
+    limit: Optional[int] = None
+
+# --- 编译 ---
+MEASURE_FUNCTIONS = {
+    "count": lambda col: func.count(col) if col is not None else func.count(),
+    "count_distinct": lambda col: func.count(distinct(col)),
+    "min": func.min,
+    "max": func.max,
+    "sum": func.sum,
+    "avg": func.avg,
+}
+# 只能作用于数值列的聚合函数
+NUMERIC_MEASURES = {"sum", "avg"}
+
+HAVING_OPERATORS = {
+    "eq": lambda expr, param: expr == param,
+    "ne": lambda expr, param: expr != param,
+    "gt": lambda expr, param: expr > param,
+    "gte": lambda expr, param: expr >= param,
+    "lt": lambda expr, param: expr < param,
+    "lte": lambda expr, param: expr <= param,
+}
+
+TIME_BUCKET_GRANULARITIES = {"minute", "hour", "day", "week", "month", "quarter", "year"}
+TIME_BUCKET_COLUMN = "extracted_at"
+
+_ALIAS_PATTERN = re.compile(r"^[A-Za-z_][A-Za-z0-9_]{0,62}$")
+
+def _measure_alias(measure: AggregateMeasure) -> str:
+    return measure.alias or f"{measure.function}_{measure.column or 'all'}"
+
+def validate_aggregate_request(dynamic_table: Table, request: AggregateRequest):
+    """
+    校验聚合请求：所有引用的列都必须真实存在于动态表中（与 generate-report 相同的列白名单），
+    函数、操作符和时间粒度都必须在支持的范围内，别名必须是合法且唯一的标识符。
+    """
+    table_name = dynamic_table.name
+
+    def require_column(col_name: str, usage: str):
+        if col_name not in dynamic_table.c:
+            raise HTTPException(status_code=400, detail=f"{usage} column '{col_name}' not found in table '{table_name}'.")
+
+    if not request.measures:
+        raise HTTPException(status_code=400, detail="At least one measure is required.")
+
+    for col_name in request.group_by:
+        require_column(col_name, "Group by")
+
+    for f in request.filters:
+        # 过滤条件与 generate-report 一样可以使用 extra_data 的键路径
+        if not is_known_column(dynamic_table, f.column):
+            raise HTTPException(status_code=400, detail=f"Filter column '{f.column}' not found in table '{table_name}'.")
+        if f.operator not in FILTER_OPERATORS:
+            raise HTTPException(status_code=400, detail=f"Unsupported filter operator: '{f.operator}'.")
+
+    output_names = list(request.group_by)
+    if request.time_bucket:
+        if request.time_bucket.granularity not in TIME_BUCKET_GRANULARITIES:
+            raise HTTPException(status_code=400, detail=f"Unsupported time bucket granularity: '{request.time_bucket.granularity}'.")
+        require_column(TIME_BUCKET_COLUMN, "Time bucket")
+        output_names.append(request.time_bucket.alias)
+
+    measure_aliases = set()
+    for measure in request.measures:
+        if measure.function not in MEASURE_FUNCTIONS:
+            raise HTTPException(status_code=400, detail=f"Unsupported measure function: '{measure.function}'.")
+        if measure.column is None:
+            if measure.function != "count":
+                raise HTTPException(status_code=400, detail=f"Measure '{measure.function}' requires a column.")
+        else:
+            require_column(measure.column, "Measure")
+            if measure.function in NUMERIC_MEASURES and not isinstance(dynamic_table.c[measure.column].type, (Integer, Numeric)):
+                raise HTTPException(status_code=400, detail=f"Measure '{measure.function}' requires a numeric column, got '{measure.column}'.")
+        alias = _measure_alias(measure)
+        measure_aliases.add(alias)
+        output_names.append(alias)
+
+    for name in output_names:
+        if not _ALIAS_PATTERN.match(name):
+            raise HTTPException(status_code=400, detail=f"Invalid output name: '{name}'.")
+    if len(set(output_names)) != len(output_names):
+        raise HTTPException(status_code=400, detail="Output names of group by columns, time bucket and measures must be unique.")
+
+    for condition in request.having:
+        if condition.measure not in measure_aliases:
+            raise HTTPException(status_code=400, detail=f"Having refers to unknown measure '{condition.measure}'.")
+        if condition.operator not in HAVING_OPERATORS:
+            raise HTTPException(status_code=400, detail=f"Unsupported having operator: '{condition.operator}'.")
+
+    for order in request.order_by:
+        if order.field not in output_names:
+            raise HTTPException(status_code=400, detail=f"Order by refers to unknown field '{order.field}'.")
+        if order.direction not in ("asc", "desc"):
+            raise HTTPException(status_code=400, detail=f"Unsupported order direction: '{order.direction}'.")
+
+    if request.limit is not None and (request.limit <= 0 or request.limit > settings.REPORT_MAX_PAGE_SIZE):
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {settings.REPORT_MAX_PAGE_SIZE}.")
+
+def build_aggregate_statement(dynamic_table: Table, request: AggregateRequest):
+    """
+    将聚合请求编译为针对动态表的单条 SELECT ... GROUP BY ... HAVING ... ORDER BY ... LIMIT 语句。
+    过滤值、HAVING 的比较值和 limit 都以绑定参数传入，因此语句可以按形状缓存复用；
+    时间粒度只能取白名单中的值，以字面量写入 date_trunc，保证 SELECT 与 GROUP BY 中的表达式完全一致。
+    """
+    shape = (
+        dynamic_table.name,
+        "aggregate",
+        tuple(request.group_by),
+        (request.time_bucket.granularity, request.time_bucket.alias) if request.time_bucket else None,
+        tuple((m.function, m.column, _measure_alias(m)) for m in request.measures),
+        tuple(filter_shape(f) for f in request.filters),
+        tuple((h.measure, h.operator) for h in request.having),
+        tuple((o.field, o.direction) for o in request.order_by),
+    )
+
+    def builder():
+        # 输出名 -> 可用于 ORDER BY 的表达式
+        output_exprs = {col_name: dynamic_table.c[col_name] for col_name in request.group_by}
+        group_exprs = list(output_exprs.values())
+        if request.time_bucket:
+            granularity = literal_column(f"'{request.time_bucket.granularity}'")
+            bucket = func.date_trunc(granularity, dynamic_table.c[TIME_BUCKET_COLUMN]).label(request.time_bucket.alias)
+            group_exprs.append(bucket)
+            output_exprs[request.time_bucket.alias] = bucket
+
+        measure_exprs = {}
+        for m in request.measures:
+            col = dynamic_table.c[m.column] if m.column else None
+            alias = _measure_alias(m)
+            measure_exprs[alias] = MEASURE_FUNCTIONS[m.function](col)
+            output_exprs[alias] = measure_exprs[alias].label(alias)
+
+        stmt = select(*output_exprs.values())
+        for i, f in enumerate(request.filters):
+            stmt = stmt.where(filter_condition(dynamic_table, i, f))
+        if group_exprs:
+            stmt = stmt.group_by(*group_exprs)
+        for i, h in enumerate(request.having):
+            stmt = stmt.having(HAVING_OPERATORS[h.operator](measure_exprs[h.measure], bindparam(f"having_{i}")))
+
+        for o in request.order_by:
+            order_expr = output_exprs[o.field]
+            stmt = stmt.order_by(order_expr.desc() if o.direction == "desc" else order_expr.asc())
+        return stmt.limit(bindparam("row_limit"))
+
+    return statement_cache.get_or_build(shape, builder)
+
+def build_aggregate_params(dynamic_table: Table, request: AggregateRequest) -> Dict[str, Any]:
+    """生成与 build_aggregate_statement 对应的绑定参数。"""
+    params = build_report_params(dynamic_table, request.filters)
+    params.update({f"having_{i}": h.value for i, h in enumerate(request.having)})
+    params["row_limit"] = request.limit or settings.REPORT_MAX_PAGE_SIZE
+    return params
@@ -0,0 +1,79 @@
+import logging
+import re
+
+from fastapi import HTTPException
+from pydantic import BaseModel
+from sqlalchemy import text
+
+# 导入共享模块
+from shared.db.async_session import async_engine
+from shared.db.fulltext import index_name
+from shared.db.partitions import create_index_concurrently
+from .report_query import EXTRA_DATA_COLUMN, NUMERIC_TEXT_PATTERN, PROMOTED_COLUMN_PREFIX
+from .schema_cache import schema_cache
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 可以被提升的键名：键名会成为列名的一部分并写入DDL，因此只接受简单的标识符
+_PROMOTABLE_KEY_PATTERN = re.compile(r"^[A-Za-z_][A-Za-z0-9_]{0,40}$")
+
+PROMOTION_TYPES = {"text", "numeric"}
+
+# --- Pydantic 模型 ---
+class PromoteExtraKeyRequest(BaseModel):
+    standard_dataset_id: int
+    key: str # extra_data 中的顶层键，如 "rating"
+    data_type: str = "text" # "text" 或 "numeric"
+
+def promoted_column_name(key: str) -> str:
+    return f"{PROMOTED_COLUMN_PREFIX}{key}"
+
+def validate_promotion(key: str, data_type: str):
+    if not _PROMOTABLE_KEY_PATTERN.match(key):
+        raise HTTPException(status_code=400, detail=f"Key '{key}' cannot be promoted: only simple identifiers are supported.")
+    if data_type not in PROMOTION_TYPES:
+        raise HTTPException(status_code=400, detail=f"Unsupported promotion data type: '{data_type}'.")
+
+def _generation_expression(key: str, data_type: str) -> str:
+    """
+    生成列的表达式。numeric 类型只转换看起来是数字的文本，其余值为 NULL，
+    因此个别不规范的值不会导致建列失败或后续写入失败。
+    键名已经过白名单校验，可以安全地写入字面量。
+    """
+    value = f"({EXTRA_DATA_COLUMN} ->> '{key}')"
+    if data_type == "numeric":
+        pattern = NUMERIC_TEXT_PATTERN.replace("'", "''")
+        return f"CASE WHEN {value} ~ '{pattern}' THEN {value}::numeric END"
+    return value
+
+async def promote_extra_key(table_name: str, key: str, data_type: str) -> str:
+    """
+    把 extra_data 中的某个键提升为带B-tree索引的 STORED 生成列 "extra__<key>"，返回列名。
+
+    之后对 "extra_data.<key>" 的过滤会自动改用该列（见 report_query.column_expression），从而可以使用索引；
+    提取器无需任何改动，生成列由数据库在写入时自动计算。
+    注意：添加 STORED 生成列会重写整张表并在此期间持有排他锁，大表应在低峰期执行。
+    """
+    validate_promotion(key, data_type)
+    if async_engine.dialect.name != "postgresql":
+        raise HTTPException(status_code=501, detail="Promoting extra_data keys requires PostgreSQL.")
+
+    column_name = promoted_column_name(key)
+    column_type = "numeric" if data_type == "numeric" else "text"
+    async with async_engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        preparer = conn.dialect.identifier_preparer
+        logger.info(f"开始将表 '{table_name}' 中 extra_data 的键 '{key}' 提升为生成列 '{column_name}'...")
+        await conn.execute(text(
+            f"ALTER TABLE {preparer.quote(table_name)} ADD COLUMN IF NOT EXISTS {preparer.quote(column_name)} "
+            f"{column_type} GENERATED ALWAYS AS ({_generation_expression(key, data_type)}) STORED"
+        ))
+        await create_index_concurrently(
+            conn, table_name, index_name(table_name, column_name), f"USING btree ({preparer.quote(column_name)})"
+        )
+
+    # 表结构已经变化，使缓存的表结构和查询语句失效
+    schema_cache.invalidate(table_name)
+    logger.info(f"键 '{key}' 已提升为列 '{column_name}'。")
+    return column_name
@@ -0,0 +1,226 @@
+import asyncio
+import logging
+from collections import Counter, defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import JSON, String, Table, text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+# 导入共享模块
+from shared.config import settings
+from shared.db.async_session import async_engine
+from shared.db.fulltext import index_name
+from shared.db.partitions import create_index_concurrently, drop_index
+from .extra_keys import promote_extra_key, promoted_column_name
+from .report_query import ReportFilter, filter_value_kind, parse_extra_path
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 索引类型：等值/范围过滤使用 B-tree，包含匹配 (LIKE '%x%') 使用 pg_trgm 的 GIN 索引
+BTREE = "btree"
+TRIGRAM = "trigram"
+
+# 查询某张表上已有的索引：索引名、访问方法、首列、大小以及是否有效（并发建索引失败会留下无效索引）
+_EXISTING_INDEXES_SQL = text("""
+    SELECT i.relname AS index_name,
+           am.amname AS method,
+           a.attname AS leading_column,
+           sizes.size_bytes,
+           pg_size_pretty(sizes.size_bytes) AS size,
+           ix.indisvalid AS is_valid,
+           pg_get_indexdef(i.oid) AS definition
+    FROM pg_index ix
+    JOIN pg_class t ON t.oid = ix.indrelid
+    JOIN pg_class i ON i.oid = ix.indexrelid
+    JOIN pg_am am ON am.oid = i.relam
+    LEFT JOIN pg_attribute a ON a.attrelid = t.oid AND a.attnum = ix.indkey[0]
+    -- 分区表上的索引本身不占空间，大小为各分区上对应索引之和
+    CROSS JOIN LATERAL (
+        SELECT sum(pg_relation_size(tree.relid))::bigint AS size_bytes FROM pg_partition_tree(i.oid) tree
+    ) sizes
+    WHERE t.relname = :table_name AND pg_table_is_visible(t.oid)
+    ORDER BY i.relname
+""")
+
+def index_method_for(dynamic_table: Table, f: ReportFilter) -> Optional[str]:
+    """判断某个过滤条件适合使用哪种索引；主键和JSON列不需要或无法建立索引，返回 None。"""
+    if parse_extra_path(f.column):
+        # extra_data 的键路径通过提升为生成列来建立索引，见 IndexAdvisor.record_filters
+        return None
+    column = dynamic_table.c[f.column]
+    if column.primary_key or isinstance(column.type, JSON):
+        return None
+    if f.operator == "like":
+        return TRIGRAM if isinstance(column.type, String) else None
+    if f.operator == "search":
+        # 全文检索使用建表时生成的 tsvector 列及其 GIN 索引
+        return None
+    return BTREE
+
+def index_name_for(table_name: str, column_name: str, method: str) -> str:
+    return index_name(table_name, column_name, "_trgm" if method == TRIGRAM else "")
+
+def _is_covered(existing_indexes: List[Dict[str, Any]], column_name: str, method: str) -> bool:
+    """已有的有效索引中是否已经有以该列为首列、且类型相同的索引。"""
+    for index in existing_indexes:
+        if not index["is_valid"] or index["leading_column"] != column_name:
+            continue
+        if method == BTREE and index["method"] == "btree":
+            return True
+        if method == TRIGRAM and index["method"] == "gin" and "gin_trgm_ops" in index["definition"]:
+            return True
+    return False
+
+
+class IndexAdvisor:
+    """
+    根据报告查询的过滤条件为动态表推荐并创建索引。
+
+    动态表除主键外没有任何索引，每个过滤条件都是全表扫描，查询延迟随采集历史线性增长。
+    顾问按 (表, 列, 索引类型) 统计过滤次数，达到 INDEX_ADVISOR_MIN_USAGE 后推荐建立索引，
+    开启 INDEX_ADVISOR_AUTO_CREATE 时在后台以 CREATE INDEX CONCURRENTLY 创建，不会阻塞对表的写入。
+    对 extra_data 键路径的过滤单独统计，开启 EXTRA_KEY_AUTO_PROMOTE 时把达到阈值的顶层键提升为带索引的生成列。
+    统计只保存在当前进程内，服务重启后重新累计。
+    """
+
+    def __init__(self, min_usage: int = settings.INDEX_ADVISOR_MIN_USAGE, auto_create: bool = settings.INDEX_ADVISOR_AUTO_CREATE):
+        self.min_usage = min_usage
+        self.auto_create = auto_create
+        # 表名 -> {(列名, 索引类型): 使用次数}
+        self._usage: Dict[str, Counter] = defaultdict(Counter)
+        # (表名, 列名, 索引类型) -> "creating" / "created" / "exists" / "failed"
+        self._status: Dict[Tuple[str, str, str], str] = {}
+        # 表名 -> {(extra_data 顶层键, 比较方式): 使用次数}
+        self._extra_key_usage: Dict[str, Counter] = defaultdict(Counter)
+        self._tasks: set = set()
+
+    def record_filters(self, dynamic_table: Table, filters: List[ReportFilter]):
+        """记录一次查询中使用的过滤条件，有列达到阈值时安排创建索引。"""
+        usage = self._usage[dynamic_table.name]
+        for f in filters:
+            path = parse_extra_path(f.column)
+            if path is not None:
+                if len(path) == 1:
+                    self._record_extra_key(dynamic_table, path[0], filter_value_kind(f))
+                continue
+
+            method = index_method_for(dynamic_table, f)
+            if method is None:
+                continue
+            usage[(f.column, method)] += 1
+            key = (dynamic_table.name, f.column, method)
+            if self.auto_create and usage[(f.column, method)] >= self.min_usage and key not in self._status:
+                self._status[key] = "creating"
+                self._schedule(self.create_index(dynamic_table.name, f.column, method))
+
+    def _record_extra_key(self, dynamic_table: Table, extra_key: str, kind: str):
+        usage = self._extra_key_usage[dynamic_table.name]
+        usage[(extra_key, kind)] += 1
+        key = (dynamic_table.name, extra_key, f"promote_{kind}")
+        if (
+            settings.EXTRA_KEY_AUTO_PROMOTE
+            and usage[(extra_key, kind)] >= self.min_usage
+            and key not in self._status
+            and promoted_column_name(extra_key) not in dynamic_table.c
+        ):
+            self._status[key] = "creating"
+            self._schedule(self._promote(key, dynamic_table.name, extra_key, kind))
+
+    def _schedule(self, coroutine):
+        task = asyncio.get_running_loop().create_task(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _promote(self, key: Tuple[str, str, str], table_name: str, extra_key: str, kind: str):
+        try:
+            await promote_extra_key(table_name, extra_key, kind)
+            self._status[key] = "created"
+        except Exception as e:
+            self._status[key] = "failed"
+            logger.error(f"提升表 '{table_name}' 中 extra_data 的键 '{extra_key}' 失败: {e}")
+
+    def extra_key_usage(self, dynamic_table: Table) -> List[Dict[str, Any]]:
+        """列出 extra_data 顶层键的过滤次数，以及是否已被提升为生成列。"""
+        return [
+            {
+                "key": extra_key,
+                "kind": kind,
+                "usage_count": count,
+                "promoted": promoted_column_name(extra_key) in dynamic_table.c,
+                "status": self._status.get((dynamic_table.name, extra_key, f"promote_{kind}")),
+            }
+            for (extra_key, kind), count in self._extra_key_usage[dynamic_table.name].most_common()
+        ]
+
+    def recommendations(self, table_name: str) -> List[Dict[str, Any]]:
+        """列出某张表上达到阈值的索引推荐及其创建状态。"""
+        return [
+            {
+                "column": column_name,
+                "method": method,
+                "index_name": index_name_for(table_name, column_name, method),
+                "usage_count": count,
+                "status": self._status.get((table_name, column_name, method), "recommended"),
+            }
+            for (column_name, method), count in self._usage[table_name].most_common()
+            if count >= self.min_usage
+        ]
+
+    def usage(self, table_name: str) -> List[Dict[str, Any]]:
+        return [
+            {"column": column_name, "method": method, "usage_count": count}
+            for (column_name, method), count in self._usage[table_name].most_common()
+        ]
+
+    @property
+    def tables(self) -> List[str]:
+        return list(dict.fromkeys([*self._usage, *self._extra_key_usage]))
+
+    async def create_index(self, table_name: str, column_name: str, method: str):
+        """
+        并发地创建索引。CREATE INDEX CONCURRENTLY 不能在事务中执行，因此使用自动提交的独立连接。
+        失败时删除可能残留的无效索引，避免它在每次写入时都被维护却无法被查询使用。
+        """
+        key = (table_name, column_name, method)
+        if async_engine.dialect.name != "postgresql":
+            self._status.pop(key, None)
+            return
+
+        name = index_name_for(table_name, column_name, method)
+        async with async_engine.connect() as conn:
+            conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+            preparer = conn.dialect.identifier_preparer
+            try:
+                if _is_covered(await fetch_existing_indexes(conn, table_name), column_name, method):
+                    self._status[key] = "exists"
+                    return
+
+                if method == TRIGRAM:
+                    await conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+                    using = f"USING gin ({preparer.quote(column_name)} gin_trgm_ops)"
+                else:
+                    using = f"USING btree ({preparer.quote(column_name)})"
+
+                logger.info(f"开始为表 '{table_name}' 的列 '{column_name}' 并发创建 {method} 索引 '{name}'...")
+                await create_index_concurrently(conn, table_name, name, using)
+                self._status[key] = "created"
+                logger.info(f"索引 '{name}' 创建完成。")
+            except Exception as e:
+                self._status[key] = "failed"
+                logger.error(f"创建索引 '{name}' 失败: {e}")
+                try:
+                    await drop_index(conn, table_name, name)
+                except Exception as drop_error:
+                    logger.error(f"清理无效索引 '{name}' 失败: {drop_error}")
+
+async def fetch_existing_indexes(conn: AsyncConnection, table_name: str) -> List[Dict[str, Any]]:
+    """查询表上已有的索引及其大小（仅支持PostgreSQL）。"""
+    if conn.dialect.name != "postgresql":
+        return []
+    rows = (await conn.execute(_EXISTING_INDEXES_SQL, {"table_name": table_name})).mappings().all()
+    return [dict(row) for row in rows]
+
+
+# 进程级的共享实例
+index_advisor = IndexAdvisor()
@@ -1,13 +1,50 @@
-from fastapi import FastAPI, Depends, HTTPException
-from pydantic import BaseModel
-from sqlalchemy.orm import Session
-from sqlalchemy import create_engine, Table, MetaData, select, text, column
-from typing import List, Dict, Any
+import csv
+import io
+import json
+from fastapi import FastAPI, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import String, Table
+from typing import List, Dict, Any, Optional
 
 # 导入共享模块
 from shared.config import settings
-from shared.db.session import get_db
+from shared.db.async_session import AsyncSessionLocal, get_async_db
+from shared.metrics import REPORT_QUERY_SECONDS, guard_label, metrics_router, observe_seconds
+from shared.redis_client import close_async_redis
+from shared.profiling import profile_requests, profiling_router
+from shared.tracing import trace_requests, tracer
 from shared.models.core_models import StandardDataset
+from .schema_cache import schema_cache
+from .extra_keys import PromoteExtraKeyRequest, promote_extra_key, validate_promotion
+from .index_advisor import fetch_existing_indexes, index_advisor
+from .result_cache import result_cache
+from .export import (
+    ExportRequest,
+    build_export_schema,
+    media_type_for,
+    require_pyarrow,
+    resolve_export_columns,
+    stream_export,
+)
+from .aggregation import (
+    AggregateRequest,
+    build_aggregate_params,
+    build_aggregate_statement,
+    validate_aggregate_request,
+)
+from .report_query import (
+    FILTER_OPERATORS,
+    ReportRequest,
+    base_column_name,
+    build_report_params,
+    build_report_statement,
+    decode_cursor,
+    encode_cursor,
+    is_known_column,
+    parse_extra_path,
+    search_output_columns,
+)
 
 # 创建FastAPI应用实例
 app = FastAPI(
@@ -16,82 +53,329 @@ app = FastAPI(
     version="1.0.0",
 )
 
-engine = create_engine(settings.DATABASE_URL)
+# 暴露 Prometheus 指标 (/metrics)
+app.include_router(metrics_router)
+tracer.set_service("analysis_svc")
+app.middleware("http")(trace_requests)
+# 开启性能剖析时每 N 个请求剖析一次，/admin/profiling 用于切换开关和下载汇总的调用栈
+app.middleware("http")(profile_requests)
+app.include_router(profiling_router)
+
+async def get_dynamic_table(db: AsyncSession, table_name: str, required_columns: List[str]) -> Table:
+    """
+    从缓存获取动态表结构。
+    如果请求引用了缓存中不存在的列，可能是表结构在缓存之后发生了变化，
+    此时重新反射一次再做校验。
+    """
+    dynamic_table = await schema_cache.get_table(db, table_name)
+    if any(base_column_name(col_name) not in dynamic_table.c for col_name in required_columns):
+        schema_cache.invalidate(table_name)
+        dynamic_table = await schema_cache.get_table(db, table_name)
+    return dynamic_table
+
+async def prepare_report_table(db: AsyncSession, request: ReportRequest) -> Table:
+    """
+    查找数据集对应的动态表，并校验请求中的列和过滤条件。
+    校验通过后返回动态表的 Table 对象。
+    """
+    # 1. 获取动态表名
+    dataset = await db.get(StandardDataset, request.standard_dataset_id)
+    if not dataset:
+        raise HTTPException(status_code=404, detail="StandardDataset not found.")
+
+    table_name = dataset.table_name
+
+    # 2. 安全地引用表和列（表结构来自进程内缓存）
+    dynamic_table = await get_dynamic_table(
+        db, table_name, request.columns + [f.column for f in request.filters]
+    )
+
+    # 验证请求的列是否存在于表中
+    for col_name in request.columns:
+        if not is_known_column(dynamic_table, col_name):
+            raise HTTPException(status_code=400, detail=f"Column '{col_name}' not found in table '{table_name}'.")
+
+    # 验证过滤条件
+    for f in request.filters:
+        if not is_known_column(dynamic_table, f.column):
+            raise HTTPException(status_code=400, detail=f"Filter column '{f.column}' not found in table '{table_name}'.")
+        if f.operator not in FILTER_OPERATORS:
+            raise HTTPException(status_code=400, detail=f"Unsupported filter operator: '{f.operator}'.")
+        if f.operator == "search" and (parse_extra_path(f.column) or not isinstance(dynamic_table.c[f.column].type, String)):
+            raise HTTPException(status_code=400, detail=f"Operator 'search' requires a text column, got '{f.column}'.")
 
-# --- Pydantic 模型 ---
-class ReportFilter(BaseModel):
-    column: str
-    operator: str # e.g., "eq", "gt", "lt", "like"
-    value: Any
+    # 记录过滤条件的使用情况，供索引顾问推荐索引
+    index_advisor.record_filters(dynamic_table, request.filters)
+    return dynamic_table
 
-class ReportRequest(BaseModel):
-    standard_dataset_id: int
-    columns: List[str]
-    filters: List[ReportFilter] = []
+async def execute_report_query(db: AsyncSession, dynamic_table: Table, request: ReportRequest) -> Dict[str, Any]:
+    """执行报告查询并构建响应，指定 limit 时按 id 键集分页。"""
+    # 使用SQLAlchemy Core Expression Language构建查询（按形状复用已构建的语句）
+    paginated = request.limit is not None
+    stmt = build_report_statement(
+        dynamic_table, request.columns, request.filters, paginated=paginated, search=request.search
+    )
+    params = build_report_params(dynamic_table, request.filters)
+    if paginated:
+        if request.limit <= 0 or request.limit > settings.REPORT_MAX_PAGE_SIZE:
+            raise HTTPException(
+                status_code=400,
+                detail=f"limit must be between 1 and {settings.REPORT_MAX_PAGE_SIZE}.",
+            )
+        params["cursor_id"] = decode_cursor(request.cursor)
+        params["page_limit"] = request.limit
+
+    # 执行查询，过滤值通过绑定参数安全地传入
+    rows = (await db.execute(stmt, params)).mappings().all()
+
+    next_cursor = None
+    if paginated:
+        if len(rows) == request.limit:
+            next_cursor = encode_cursor(rows[-1]["id"])
+        if "id" not in request.columns:
+            rows = [{k: v for k, v in row.items() if k != "id"} for row in rows]
+
+    # 在真实场景中，这里会将结果发送给LLM进行分析和报告生成。
+    # 目前，我们只返回查询到的原始数据。
+    response = {
+        "message": "Data successfully queried. Report generation would proceed from here.",
+        "data": rows
+    }
+    if paginated:
+        response["next_cursor"] = next_cursor
+    return response
+
+@app.on_event("shutdown")
+async def shutdown():
+    await close_async_redis()
 
 # --- API 端点 ---
 @app.post("/generate-report", summary="根据动态条件查询数据并生成报告")
 async def generate_report(
     request: ReportRequest,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     根据指定的数据集、列和过滤器，安全地动态查询数据。
     本端点的实现严格遵循安全准则，避免使用f-string拼接SQL。
+
+    指定 limit 时按 id 键集分页返回，响应中的 next_cursor 用于请求下一页（为 null 表示没有更多数据）。
+    大数据量的完整导出请使用 /generate-report/stream。
     """
-    # 1. 获取动态表名
-    dataset = db.query(StandardDataset).filter(StandardDataset.id == request.standard_dataset_id).first()
+    try:
+        dynamic_table = await prepare_report_table(db, request)
+
+        # 3. 看板等场景会反复执行相同的查询，表没有新数据时直接返回缓存的结果
+        async def run_query():
+            return await execute_report_query(db, dynamic_table, request)
+
+        with observe_seconds(REPORT_QUERY_SECONDS, endpoint="report", standard_dataset_id=guard_label("standard_dataset_id", request.standard_dataset_id)):
+            return await result_cache.get_or_compute("report", dynamic_table.name, request.dict(), run_query)
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        # 处理表不存在等数据库错误
+        raise HTTPException(status_code=500, detail=f"An error occurred while querying data: {str(e)}")
+
+
+async def stream_report_rows(stmt, params: Dict[str, Any], output_format: str, columns: List[str]):
+    """
+    通过服务端游标分批读取查询结果，并逐批编码为NDJSON或CSV数据块。
+    内存中最多只保留一个批次的数据，因此内存占用与表的大小无关。
+    流式响应在请求处理函数返回之后才开始发送，此时请求级的会话可能已经关闭，
+    因此这里自行创建并持有一个独立的数据库会话。
+    """
+    async with AsyncSessionLocal() as db:
+        result = await db.stream(
+            stmt.execution_options(yield_per=settings.REPORT_STREAM_BATCH_SIZE), params
+        )
+
+        if output_format == "csv":
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(columns)
+            yield buffer.getvalue()
+
+        async for partition in result.mappings().partitions():
+            if output_format == "csv":
+                buffer = io.StringIO()
+                writer = csv.writer(buffer)
+                writer.writerows([[row[col] for col in columns] for row in partition])
+                yield buffer.getvalue()
+            else:
+                yield "".join(json.dumps(dict(row), ensure_ascii=False, default=str) + "\n" for row in partition)
+
+
+@app.post("/generate-report/stream", summary="以流式方式导出查询结果")
+async def stream_report(
+    request: ReportRequest,
+    output_format: str = Query("ndjson", alias="format", regex="^(ndjson|csv)$"),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    使用服务端游标流式导出满足条件的全部数据，适用于大数据量的导出。
+    支持 NDJSON（每行一个JSON对象）和 CSV 两种格式，请求体中的 limit/cursor 参数在此端点中被忽略。
+    """
+    dynamic_table = await prepare_report_table(db, request)
+    stmt = build_report_statement(dynamic_table, request.columns, request.filters, search=request.search)
+    params = build_report_params(dynamic_table, request.filters)
+    output_columns = request.columns + search_output_columns(request.filters, request.search)
+
+    media_type = "text/csv" if output_format == "csv" else "application/x-ndjson"
+    return StreamingResponse(
+        stream_report_rows(stmt, params, output_format, output_columns),
+        media_type=media_type,
+    )
+
+
+@app.post("/aggregate", summary="在数据库中执行声明式聚合查询")
+async def aggregate(
+    request: AggregateRequest,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    将声明式的聚合请求（分组、度量、按 extracted_at 的时间分桶、HAVING、排序和 limit）
+    编译为针对动态表的单条SQL语句，在数据库中完成汇总计算，只返回聚合后的结果。
+    所有引用的列都必须真实存在于动态表中。
+    """
+    dataset = await db.get(StandardDataset, request.standard_dataset_id)
     if not dataset:
         raise HTTPException(status_code=404, detail="StandardDataset not found.")
 
-    table_name = dataset.table_name
-    metadata = MetaData()
-
     try:
-        # 2. 安全地引用表和列
-        dynamic_table = Table(table_name, metadata, autoload_with=engine)
-
-        # 验证请求的列是否存在于表中
-        selectable_columns = []
-        for col_name in request.columns:
-            if col_name not in dynamic_table.c:
-                raise HTTPException(status_code=400, detail=f"Column '{col_name}' not found in table '{table_name}'.")
-            selectable_columns.append(column(col_name))
-
-        # 3. 使用SQLAlchemy Core Expression Language构建查询
-        stmt = select(*selectable_columns)
-
-        # 4. 安全地应用过滤器
-        for f in request.filters:
-            if f.column not in dynamic_table.c:
-                raise HTTPException(status_code=400, detail=f"Filter column '{f.column}' not found in table '{table_name}'.")
-
-            table_column = dynamic_table.c[f.column]
-
-            if f.operator == "eq":
-                stmt = stmt.where(table_column == f.value)
-            elif f.operator == "gt":
-                stmt = stmt.where(table_column > f.value)
-            elif f.operator == "lt":
-                stmt = stmt.where(table_column < f.value)
-            elif f.operator == "like":
-                stmt = stmt.where(table_column.like(f"%{f.value}%"))
-            else:
-                raise HTTPException(status_code=400, detail=f"Unsupported filter operator: '{f.operator}'.")
+        referenced_columns = (
+            request.group_by
+            + [m.column for m in request.measures if m.column]
+            + [f.column for f in request.filters]
+        )
+        dynamic_table = await get_dynamic_table(db, dataset.table_name, referenced_columns)
+        validate_aggregate_request(dynamic_table, request)
+        index_advisor.record_filters(dynamic_table, request.filters)
+
+        stmt = build_aggregate_statement(dynamic_table, request)
 
-        # 5. 执行查询
-        result = db.execute(stmt).mappings().all()
+        async def run_query():
+            rows = (await db.execute(stmt, build_aggregate_params(dynamic_table, request))).mappings().all()
+            return {"data": rows}
 
-        # 在真实场景中，这里会将结果发送给LLM进行分析和报告生成。
-        # 目前，我们只返回查询到的原始数据。
-        return {
-            "message": "Data successfully queried. Report generation would proceed from here.",
-            "data": result
-        }
+        with observe_seconds(REPORT_QUERY_SECONDS, endpoint="aggregate", standard_dataset_id=guard_label("standard_dataset_id", request.standard_dataset_id)):
+            return await result_cache.get_or_compute("aggregate", dynamic_table.name, request.dict(), run_query)
 
+    except HTTPException:
+        raise
     except Exception as e:
-        # 处理表不存在等数据库错误
-        raise HTTPException(status_code=500, detail=f"An error occurred while querying data: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"An error occurred while aggregating data: {str(e)}")
+
+
+@app.post("/export", summary="将数据集导出为 Parquet 或 Arrow IPC 文件")
+async def export_dataset(
+    request: ExportRequest,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    以行组为单位流式导出动态数据集（可带过滤条件），适用于下游分析系统批量拉取整表数据。
+    列类型由 StandardField.data_type 映射而来，extra_data 中的指定键可以展开为独立列。
+    """
+    require_pyarrow()
+    dataset = await db.get(StandardDataset, request.standard_dataset_id)
+    if not dataset:
+        raise HTTPException(status_code=404, detail="StandardDataset not found.")
+
+    dynamic_table = await get_dynamic_table(
+        db, dataset.table_name, (request.columns or []) + [f.column for f in request.filters]
+    )
+    columns = resolve_export_columns(dynamic_table, dataset, request)
+    index_advisor.record_filters(dynamic_table, request.filters)
+    schema = build_export_schema(dataset, columns, request)
+    stmt = build_report_statement(dynamic_table, columns, request.filters)
+
+    extension = "parquet" if request.format == "parquet" else "arrows"
+    return StreamingResponse(
+        stream_export(stmt, build_report_params(dynamic_table, request.filters), schema, request),
+        media_type=media_type_for(request.format),
+        headers={"Content-Disposition": f'attachment; filename="{dataset.table_name}.{extension}"'},
+    )
+
+
+@app.post("/schema-cache/invalidate", summary="使动态表结构缓存失效", tags=["Maintenance"])
+async def invalidate_schema_cache(
+    standard_dataset_id: Optional[int] = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    使动态表的结构缓存及相关的查询语句缓存失效。
+    动态表结构发生变化（例如新增了标准字段）后应调用此端点；不指定数据集时清空全部缓存。
+    """
+    if standard_dataset_id is None:
+        schema_cache.invalidate()
+        return {"message": "All cached table schemas have been invalidated."}
+
+    dataset = await db.get(StandardDataset, standard_dataset_id)
+    if not dataset:
+        raise HTTPException(status_code=404, detail="StandardDataset not found.")
+    schema_cache.invalidate(dataset.table_name)
+    return {"message": f"Cached schema for table '{dataset.table_name}' has been invalidated."}
+
+
+@app.get("/index-advisor", summary="查看动态表的索引推荐", tags=["Maintenance"])
+async def list_index_recommendations(
+    standard_dataset_id: Optional[int] = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    列出索引顾问统计到的过滤列使用情况、达到阈值的索引推荐及其创建状态，以及表上现有的索引和大小。
+    不指定数据集时返回本进程内记录过查询的所有表。
+    """
+    if standard_dataset_id is not None:
+        dataset = await db.get(StandardDataset, standard_dataset_id)
+        if not dataset:
+            raise HTTPException(status_code=404, detail="StandardDataset not found.")
+        table_names = [dataset.table_name]
+    else:
+        table_names = index_advisor.tables
+
+    conn = await db.connection()
+    return {
+        "min_usage": index_advisor.min_usage,
+        "auto_create": index_advisor.auto_create,
+        "extra_key_auto_promote": settings.EXTRA_KEY_AUTO_PROMOTE,
+        "tables": [
+            {
+                "table_name": table_name,
+                "usage": index_advisor.usage(table_name),
+                "recommendations": index_advisor.recommendations(table_name),
+                "extra_keys": index_advisor.extra_key_usage(await get_dynamic_table(db, table_name, [])),
+                "indexes": await fetch_existing_indexes(conn, table_name),
+            }
+            for table_name in table_names
+        ],
+    }
+
+
+@app.post("/extra-keys/promote", summary="将 extra_data 中的键提升为带索引的列", tags=["Maintenance"])
+async def promote_extra_data_key(
+    request: PromoteExtraKeyRequest,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    把 extra_data 的某个顶层键提升为 STORED 生成列 "extra__<key>" 并建立B-tree索引。
+    之后对 "extra_data.<key>" 的同类型过滤会自动使用该列。添加生成列会重写整张表，大表请在低峰期执行。
+    """
+    dataset = await db.get(StandardDataset, request.standard_dataset_id)
+    if not dataset:
+        raise HTTPException(status_code=404, detail="StandardDataset not found.")
+    validate_promotion(request.key, request.data_type)
+    table_name = dataset.table_name
+    # 结束当前会话的事务，避免它持有的锁阻塞 ALTER TABLE（回滚后 dataset 的属性会过期，因此先取出表名）
+    await db.rollback()
+    column_name = await promote_extra_key(table_name, request.key, request.data_type)
+    return {"message": f"Key '{request.key}' has been promoted to column '{column_name}'.", "column": column_name}
+
+
+@app.get("/result-cache/stats", summary="查看报告结果缓存的命中统计", tags=["Monitoring"])
+def result_cache_stats():
+    return result_cache.snapshot()
 
 
 @app.get("/health", summary="健康检查", tags=["Monitoring"])
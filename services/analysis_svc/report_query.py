@@ -0,0 +1,277 @@
+import base64
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+from pydantic import BaseModel
+from sqlalchemy import Boolean, Date, DateTime, Integer, JSON, Numeric, String, Table, bindparam, case, cast, func, literal_column, select
+from sqlalchemy.dialects.postgresql import JSONB
+
+from shared.coercion import CoercionError, coerce_value
+from shared.db.fulltext import search_text_config, search_vector_column_name
+from .schema_cache import statement_cache
+
+# --- Pydantic 模型 ---
+class ReportFilter(BaseModel):
+    column: str # 表中的列名，或 extra_data 中的键路径，如 "extra_data.rating"、"extra_data.seller.name"
+    operator: str # e.g., "eq", "gt", "lt", "like", "search"
+    value: Any
+
+class SearchOptions(BaseModel):
+    """search 过滤条件的附加输出。"""
+    # 附加 search_rank 列（各 search 条件相关度之和）；非分页查询按相关度降序排序
+    rank: bool = False
+    # 为每个 search 条件的列附加 "<列名>_highlight"，内容为带 <b> 标记的匹配片段
+    highlight: bool = False
+
+class ReportRequest(BaseModel):
+    standard_dataset_id: int
+    columns: List[str] # 同样可以包含 extra_data 的键路径，结果中以路径作为字段名
+    filters: List[ReportFilter] = []
+    search: Optional[SearchOptions] = None
+    # 分页参数（可选）：指定 limit 时按 id 进行键集分页，cursor 为上一页返回的 next_cursor
+    limit: Optional[int] = None
+    cursor: Optional[str] = None
+
+# --- extra_data 键路径 ---
+EXTRA_DATA_COLUMN = "extra_data"
+# 被提升为生成列的 extra_data 键对应的列名前缀，如 "extra__rating"
+PROMOTED_COLUMN_PREFIX = "extra__"
+# 可以安全地转换为 numeric 的文本
+NUMERIC_TEXT_PATTERN = r"^\s*-?[0-9]+(\.[0-9]+)?\s*$"
+
+def parse_extra_path(name: str) -> Optional[Tuple[str, ...]]:
+    """解析 "extra_data.a.b" 形式的键路径，返回 ("a", "b")；不是键路径时返回 None。"""
+    prefix = f"{EXTRA_DATA_COLUMN}."
+    if not name.startswith(prefix):
+        return None
+    keys = tuple(name[len(prefix):].split("."))
+    if not all(keys):
+        raise HTTPException(status_code=400, detail=f"Invalid extra_data key path: '{name}'.")
+    return keys
+
+def base_column_name(name: str) -> str:
+    """键路径对应的真实列为 extra_data，其余名称即列名本身。"""
+    return EXTRA_DATA_COLUMN if parse_extra_path(name) else name
+
+def is_known_column(dynamic_table: Table, name: str) -> bool:
+    return base_column_name(name) in dynamic_table.c
+
+def filter_value_kind(f: ReportFilter) -> str:
+    """
+    键路径过滤时JSON中的值按什么类型比较：由过滤值本身的JSON类型决定，
+    例如 {"value": 4} 按数值比较，{"value": "4"} 按文本比较；like/search 总是按文本比较，
+    布尔值按 "true"/"false" 文本比较。
+    """
+    if isinstance(f.value, (int, float)) and not isinstance(f.value, bool) and f.operator not in ("like", "search"):
+        return "numeric"
+    return "text"
+
+def _promoted_column(dynamic_table: Table, path: Tuple[str, ...], kind: str):
+    """单层的键如果已被提升为生成列，且列类型与比较方式一致，则直接使用该列（可以使用其上的索引）。"""
+    if len(path) != 1:
+        return None
+    column = dynamic_table.c.get(f"{PROMOTED_COLUMN_PREFIX}{path[0]}")
+    if column is None:
+        return None
+    if kind == "numeric" and isinstance(column.type, Numeric):
+        return column
+    if kind == "text" and isinstance(column.type, String):
+        return column
+    return None
+
+def column_expression(dynamic_table: Table, name: str, kind: Optional[str] = None):
+    """
+    将列名或键路径解析为查询表达式。
+    kind 为 None 时（用于选取列）返回JSON值本身；否则按 kind 提取为文本、数值或布尔值用于比较。
+    """
+    path = parse_extra_path(name)
+    if path is None:
+        return dynamic_table.c[name]
+    if kind is not None:
+        promoted = _promoted_column(dynamic_table, path, kind)
+        if promoted is not None:
+            return promoted
+    element = dynamic_table.c[EXTRA_DATA_COLUMN][path if len(path) > 1 else path[0]]
+    if kind is None:
+        return element
+    # 提取到的特有字段都是文本，数值比较前先确认文本是数字，避免无法转换的值使整个查询报错
+    text_value = element.as_string()
+    if kind == "numeric":
+        return case((text_value.regexp_match(NUMERIC_TEXT_PATTERN), cast(text_value, Numeric)))
+    return text_value
+
+def uses_containment(dynamic_table: Table, f: ReportFilter) -> bool:
+    """
+    键路径上按文本的等值过滤在 JSONB 列上改写为包含查询 extra_data @> {"a": {"b": "值"}}，
+    可以使用 extra_data 上的 GIN 索引（->> 提取文本后比较无法使用该索引）。
+    提取到的特有字段都以JSON字符串保存，两种写法的结果一致；数值比较需要先转换类型，仍然逐行计算。
+    """
+    path = parse_extra_path(f.column)
+    return (
+        path is not None
+        and f.operator == "eq"
+        and filter_value_kind(f) == "text"
+        and isinstance(dynamic_table.c[EXTRA_DATA_COLUMN].type, JSONB)
+        and _promoted_column(dynamic_table, path, "text") is None
+    )
+
+def filter_condition(dynamic_table: Table, i: int, f: ReportFilter):
+    """第 i 个过滤条件对应的 WHERE 表达式，过滤值为绑定参数 filter_i。"""
+    if uses_containment(dynamic_table, f):
+        return dynamic_table.c[EXTRA_DATA_COLUMN].contains(bindparam(f"filter_{i}", type_=JSONB))
+    column = column_expression(dynamic_table, f.column, filter_value_kind(f) if parse_extra_path(f.column) else None)
+    return FILTER_OPERATORS[f.operator](column, bindparam(f"filter_{i}"))
+
+def filter_shape(f: ReportFilter) -> Tuple[str, str, Optional[str]]:
+    """过滤条件在语句缓存键中的形状：键路径的比较方式会影响生成的SQL，因此也计入形状。"""
+    return (f.column, f.operator, filter_value_kind(f) if parse_extra_path(f.column) else None)
+
+# --- 全文检索 ---
+SEARCH_RANK_COLUMN = "search_rank"
+HIGHLIGHT_SUFFIX = "_highlight"
+_HEADLINE_OPTIONS = "MaxWords=35, MinWords=15, MaxFragments=3"
+
+def _regconfig():
+    # 配置名已经过白名单校验，以字面量写入，使表达式与生成列的定义一致，从而可以使用其上的GIN索引
+    return literal_column(f"'{search_text_config()}'::regconfig")
+
+def _search_vector(col):
+    """优先使用建表时生成的 tsvector 列；没有该列的旧表退化为现场计算（无法使用索引）。"""
+    vector = col.table.c.get(search_vector_column_name(col.name))
+    if vector is not None:
+        return vector
+    return func.to_tsvector(_regconfig(), func.coalesce(col, ""))
+
+def _search_query(param):
+    # websearch_to_tsquery 接受用户输入的自然语法（引号短语、OR、-排除），不会因语法错误而报错
+    return func.websearch_to_tsquery(_regconfig(), param)
+
+def search_output_columns(filters: List[ReportFilter], search: Optional[SearchOptions]) -> List[str]:
+    """search 选项在结果中附加的列名。"""
+    if not search or not any(f.operator == "search" for f in filters):
+        return []
+    names = [SEARCH_RANK_COLUMN] if search.rank else []
+    if search.highlight:
+        names += [f"{f.column}{HIGHLIGHT_SUFFIX}" for f in filters if f.operator == "search"]
+    return names
+
+# --- 查询构建 ---
+# 支持的过滤操作符。过滤值一律以绑定参数传入，保证相同形状的查询生成完全相同的SQL。
+FILTER_OPERATORS = {
+    "eq": lambda col, param: col == param,
+    "gt": lambda col, param: col > param,
+    "lt": lambda col, param: col < param,
+    "like": lambda col, param: col.like(param),
+    "search": lambda col, param: _search_vector(col).op("@@")(_search_query(param)),
+}
+
+def build_report_statement(
+    dynamic_table: Table,
+    columns: List[str],
+    filters: List[ReportFilter],
+    paginated: bool = False,
+    search: Optional[SearchOptions] = None,
+):
+    """
+    构建（或从缓存中取出）报告查询语句。
+    第 i 个过滤条件的值对应名为 filter_i 的绑定参数，由 build_report_params 生成。
+    paginated 为 True 时，查询按 id 进行键集分页：WHERE id > :cursor_id ORDER BY id LIMIT :page_limit，
+    并且总是选取 id 列以便生成下一页的游标；此时 search.rank 只附加相关度列，不改变排序。
+    """
+    search_shape = (search.rank, search.highlight) if search else None
+    shape = (dynamic_table.name, tuple(columns), tuple(filter_shape(f) for f in filters), paginated, search_shape)
+
+    def builder():
+        selected = [
+            column_expression(dynamic_table, col_name).label(col_name) if parse_extra_path(col_name) else dynamic_table.c[col_name]
+            for col_name in columns
+        ]
+        if paginated and "id" not in columns:
+            selected.append(dynamic_table.c.id)
+
+        search_filters = [(i, f) for i, f in enumerate(filters) if f.operator == "search"]
+        rank = None
+        if search and search_filters:
+            if search.rank:
+                ranks = [
+                    func.ts_rank_cd(_search_vector(dynamic_table.c[f.column]), _search_query(bindparam(f"filter_{i}")))
+                    for i, f in search_filters
+                ]
+                rank = sum(ranks[1:], ranks[0]).label(SEARCH_RANK_COLUMN)
+                selected.append(rank)
+            if search.highlight:
+                for i, f in search_filters:
+                    headline = func.ts_headline(
+                        _regconfig(), dynamic_table.c[f.column], _search_query(bindparam(f"filter_{i}")), _HEADLINE_OPTIONS
+                    )
+                    selected.append(headline.label(f"{f.column}{HIGHLIGHT_SUFFIX}"))
+
+        stmt = select(*selected)
+        for i, f in enumerate(filters):
+            stmt = stmt.where(filter_condition(dynamic_table, i, f))
+        if paginated:
+            stmt = (
+                stmt.where(dynamic_table.c.id > bindparam("cursor_id"))
+                .order_by(dynamic_table.c.id)
+                .limit(bindparam("page_limit"))
+            )
+        elif rank is not None:
+            stmt = stmt.order_by(rank.desc())
+        return stmt
+
+    return statement_cache.get_or_build(shape, builder)
+
+# 列类型 -> coerce_value 使用的数据类型名称。DateTime 需要排在 Date 之前检查。
+_COLUMN_DATA_TYPES = (
+    (Boolean, "Boolean"),
+    (DateTime, "DateTime"),
+    (Date, "Date"),
+    (Integer, "Integer"),
+    (Numeric, "Numeric"),
+    (JSON, "JSON"),
+)
+
+def _filter_value(dynamic_table: Table, f: ReportFilter) -> Any:
+    """
+    把过滤值转换为列的类型，这样 "2024-01-01" 或 "1,000" 这样的值也能用于范围过滤，
+    并且 asyncpg 不会因为参数类型与列类型不一致而拒绝执行。
+    """
+    if f.operator == "like":
+        return f"%{f.value}%"
+    path = parse_extra_path(f.column)
+    if path:
+        # 键路径的比较类型由过滤值本身决定，见 filter_value_kind
+        if filter_value_kind(f) == "numeric":
+            return f.value
+        value = json.dumps(f.value) if isinstance(f.value, bool) else str(f.value)
+        if uses_containment(dynamic_table, f):
+            # 包含查询的参数是嵌套到键路径上的JSON文档
+            for key in reversed(path):
+                value = {key: value}
+        return value
+    column_type = dynamic_table.c[f.column].type
+    for type_class, data_type in _COLUMN_DATA_TYPES:
+        if isinstance(column_type, type_class):
+            try:
+                return coerce_value(f.value, data_type)
+            except CoercionError as e:
+                raise HTTPException(status_code=400, detail=f"Invalid value for filter on column '{f.column}': {e}")
+    return f.value
+
+def build_report_params(dynamic_table: Table, filters: List[ReportFilter]) -> Dict[str, Any]:
+    """生成与 build_report_statement 对应的绑定参数，过滤值按列类型进行转换。"""
+    return {f"filter_{i}": _filter_value(dynamic_table, f) for i, f in enumerate(filters)}
+
+def encode_cursor(last_id: int) -> str:
+    """将上一页最后一行的 id 编码为不透明的游标字符串。"""
+    return base64.urlsafe_b64encode(json.dumps({"id": last_id}).encode()).decode()
+
+def decode_cursor(cursor: Optional[str]) -> int:
+    """解析游标字符串，未提供游标时从头开始。"""
+    if not cursor:
+        return 0
+    try:
+        return int(json.loads(base64.urlsafe_b64decode(cursor.encode()))["id"])
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid pagination cursor.")
@@ -0,0 +1,161 @@
+import hashlib
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+import redis
+from fastapi.encoders import jsonable_encoder
+
+# 导入共享模块
+from shared.config import settings
+from shared.dataset_versions import get_table_version
+from shared.redis_client import get_async_redis
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# Redis 出错后暂停使用 Redis 的时长（秒），避免每个请求都等待连接超时
+REDIS_RETRY_INTERVAL = 30
+
+def normalize_request(payload: Dict[str, Any]) -> str:
+    """
+    把请求规范化为稳定的字符串：键按字母排序，过滤条件之间的顺序不影响结果，因此也排序。
+    选取的列保持原有顺序，因为它决定了结果中字段的顺序。
+    """
+    normalized = dict(payload)
+    if "filters" in normalized:
+        normalized["filters"] = sorted(
+            normalized["filters"], key=lambda f: json.dumps(f, sort_keys=True, default=str)
+        )
+    return json.dumps(normalized, sort_keys=True, default=str, ensure_ascii=False)
+
+
+class _LocalLRU:
+    """Redis 不可用时使用的进程内LRU缓存，条目带过期时间。"""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[float, bytes]]" = OrderedDict()
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[bytes]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: bytes, ttl: int):
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class ReportResultCache:
+    """
+    报告查询结果的缓存。
+
+    看板会每隔几秒重复执行同样的查询，而数据集只在抓取结果写入时才会变化。
+    缓存键由表的数据版本号（见 shared/dataset_versions.py）和规范化后的请求组成：
+    表没有新数据时直接返回缓存的结果，提取器写入数据后版本号递增，旧结果不再被命中，
+    并在 REPORT_RESULT_CACHE_TTL 后由 Redis 自动清除（Redis 服务端应配置 allkeys-lru 淘汰策略）。
+
+    Redis 不可用时退化为进程内的LRU缓存。此时无法得知表是否被写入，
+    因此结果只保留 REPORT_RESULT_CACHE_FALLBACK_TTL 秒。
+    """
+
+    def __init__(self):
+        self.enabled = settings.REPORT_RESULT_CACHE_ENABLED
+        self._local = _LocalLRU(settings.REPORT_RESULT_CACHE_MAX_ENTRIES)
+        self._redis_retry_at = 0.0
+        self.stats = {"hits": 0, "misses": 0, "skipped_too_large": 0, "redis_errors": 0}
+
+    def _redis_available(self) -> bool:
+        return time.monotonic() >= self._redis_retry_at
+
+    def _on_redis_error(self, e: Exception):
+        self.stats["redis_errors"] += 1
+        self._redis_retry_at = time.monotonic() + REDIS_RETRY_INTERVAL
+        logger.warning(f"结果缓存访问Redis失败，{REDIS_RETRY_INTERVAL} 秒内改用进程内缓存: {e}")
+
+    async def _cache_key(self, kind: str, table_name: str, payload: Dict[str, Any]) -> Tuple[str, bool]:
+        """返回 (缓存键, 是否使用Redis)。"""
+        digest = hashlib.sha256(normalize_request(payload).encode()).hexdigest()
+        if self._redis_available():
+            try:
+                version = await get_table_version(table_name)
+                return f"intelliscrape:report:{table_name}:v{version}:{kind}:{digest}", True
+            except redis.RedisError as e:
+                self._on_redis_error(e)
+        return f"{table_name}:{kind}:{digest}", False
+
+    async def get_or_compute(
+        self,
+        kind: str,
+        table_name: str,
+        payload: Dict[str, Any],
+        compute: Callable[[], Awaitable[Any]],
+    ) -> Any:
+        """
+        返回缓存的结果，未命中时调用 compute 计算并写入缓存。
+        结果先经过 jsonable_encoder 转换，保证命中与未命中时返回的JSON完全一致。
+        """
+        if not self.enabled:
+            return await compute()
+
+        key, use_redis = await self._cache_key(kind, table_name, payload)
+        cached = None
+        if use_redis:
+            try:
+                cached = await get_async_redis().get(key)
+            except redis.RedisError as e:
+                self._on_redis_error(e)
+                use_redis = False
+        else:
+            cached = self._local.get(key)
+
+        if cached is not None:
+            self.stats["hits"] += 1
+            return json.loads(cached)
+
+        self.stats["misses"] += 1
+        result = jsonable_encoder(await compute())
+        value = json.dumps(result, ensure_ascii=False).encode()
+        if len(value) > settings.REPORT_RESULT_CACHE_MAX_ITEM_BYTES:
+            self.stats["skipped_too_large"] += 1
+            return result
+
+        if use_redis:
+            try:
+                await get_async_redis().set(key, value, ex=settings.REPORT_RESULT_CACHE_TTL)
+            except redis.RedisError as e:
+                self._on_redis_error(e)
+        else:
+            self._local.set(key, value, settings.REPORT_RESULT_CACHE_FALLBACK_TTL)
+        return result
+
+    def snapshot(self) -> Dict[str, Any]:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            "enabled": self.enabled,
+            **self.stats,
+            "hit_ratio": round(self.stats["hits"] / lookups, 4) if lookups else 0.0,
+            "local_entries": len(self._local),
+            "local_evictions": self._local.evictions,
+            "using_redis": self._redis_available(),
+        }
+
+
+# 进程级的共享实例
+result_cache = ReportResultCache()
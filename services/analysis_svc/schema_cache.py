@@ -0,0 +1,102 @@
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, Optional
+
+from sqlalchemy import MetaData, Table
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql import Select
+
+# 导入共享配置
+from shared.config import settings
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+
+class TableSchemaCache:
+    """
+    动态表反射结果的进程内缓存，按表名索引。
+
+    反射一张表需要多次查询PostgreSQL的系统目录，如果每个请求都重新反射，
+    报告接口的延迟主要花在目录查询上而不是真正的数据查询上。
+    动态表的结构只在标准化或建表时变化，因此缓存后需要显式失效。
+    """
+
+    def __init__(self):
+        self._tables: Dict[str, Table] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._invalidation_listeners: list[Callable[[Optional[str]], None]] = []
+
+    async def get_table(self, db: AsyncSession, table_name: str) -> Table:
+        """获取表结构，未缓存时在当前会话的连接上反射一次。"""
+        table = self._tables.get(table_name)
+        if table is not None:
+            return table
+
+        # 同一张表的并发请求只反射一次
+        lock = self._locks.setdefault(table_name, asyncio.Lock())
+        async with lock:
+            table = self._tables.get(table_name)
+            if table is None:
+                # 表反射是同步API，通过 run_sync 在异步会话所持有的连接上执行
+                table = await db.run_sync(
+                    lambda sync_session: Table(table_name, MetaData(), autoload_with=sync_session.connection())
+                )
+                self._tables[table_name] = table
+                logger.info(f"已反射并缓存表 '{table_name}' 的结构。")
+        return table
+
+    def invalidate(self, table_name: Optional[str] = None):
+        """使指定表（或全部表）的缓存失效，并通知依赖表结构的其他缓存。"""
+        if table_name is None:
+            self._tables.clear()
+        else:
+            self._tables.pop(table_name, None)
+        for listener in self._invalidation_listeners:
+            listener(table_name)
+        logger.info(f"表结构缓存已失效: {table_name or '全部'}")
+
+    def add_invalidation_listener(self, listener: Callable[[Optional[str]], None]):
+        self._invalidation_listeners.append(listener)
+
+
+class StatementCache:
+    """
+    按查询“形状”缓存已构建的查询语句的LRU缓存。
+
+    形状由表名、选取的列以及过滤条件的 (列, 操作符) 组成，过滤值全部以绑定参数传入。
+    这样重复形状的请求可以直接复用同一个语句对象：省去表达式构建的开销，
+    命中SQLAlchemy的编译缓存，并且生成的SQL文本完全相同，
+    asyncpg 可以在同一连接上复用已准备好的服务端预编译语句。
+    """
+
+    def __init__(self, max_size: int = settings.REPORT_STATEMENT_CACHE_SIZE):
+        self.max_size = max_size
+        self._statements: "OrderedDict[Hashable, Select]" = OrderedDict()
+
+    def get_or_build(self, key: Hashable, builder: Callable[[], Select]) -> Select:
+        stmt = self._statements.get(key)
+        if stmt is not None:
+            self._statements.move_to_end(key)
+            return stmt
+
+        stmt = builder()
+        self._statements[key] = stmt
+        if len(self._statements) > self.max_size:
+            self._statements.popitem(last=False)
+        return stmt
+
+    def invalidate(self, table_name: Optional[str] = None):
+        """清除指定表（或全部表）相关的语句。缓存键的第一个元素总是表名。"""
+        if table_name is None:
+            self._statements.clear()
+            return
+        for key in [k for k in self._statements if k[0] == table_name]:
+            del self._statements[key]
+
+
+# 进程级的共享缓存实例：表结构失效时，依赖该表的语句缓存也随之失效
+schema_cache = TableSchemaCache()
+statement_cache = StatementCache()
+schema_cache.add_invalidation_listener(statement_cache.invalidate)
@@ -1,12 +1,28 @@
+import asyncio
+import csv
 import logging
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
 from pydantic import BaseModel
-from sqlalchemy.orm import Session
-from typing import List
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Any, Dict, List, Optional, Tuple
 
 # 导入共享模块
-from shared.db.session import get_db
+from shared.db.async_session import get_async_db
+from shared.db.dialect_insert import dialect_insert
 from shared.models.core_models import DataSource
+from shared.task_publisher import task_publisher
+from ..data_source_import import (
+    ALREADY_EXISTS,
+    CREATED,
+    DUPLICATE_IN_UPLOAD,
+    INVALID,
+    ImportRowError,
+    detect_format,
+    iter_rows,
+    prepare_import,
+)
+from ..pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, etag_matches, finish_page, keyset_page, list_etag, not_modified
 
 # 配置日志
 logger = logging.getLogger(__name__)
@@ -35,18 +51,31 @@ class DataSourceInDB(DataSourceBase):
     class Config:
         orm_mode = True
 
+class DataSourceImportResult(BaseModel):
+    """批量导入的结果报告，rows 中按上传顺序列出每一行的处理结果。"""
+    total: int
+    created: int
+    already_exists: int
+    duplicate_in_upload: int
+    invalid: int
+    discovery_triggered: int = 0
+    discovery_error: Optional[str] = None
+    rows: List[Dict[str, Any]]
+
 # --- API 端点实现 ---
 @router.post("/", response_model=DataSourceInDB, status_code=201)
-def create_data_source(
+async def create_data_source(
     *,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     source_in: DataSourceCreate
 ):
     """
     创建一个新的数据源。
     """
     # 检查site_key是否已存在
-    existing_source = db.query(DataSource).filter(DataSource.site_key == source_in.site_key).first()
+    existing_source = (await db.execute(
+        select(DataSource).where(DataSource.site_key == source_in.site_key)
+    )).scalars().first()
     if existing_source:
         raise HTTPException(
             status_code=400,
@@ -55,47 +84,151 @@ def create_data_source(
 
     db_source = DataSource(**source_in.dict())
     db.add(db_source)
-    db.commit()
-    db.refresh(db_source)
+    await db.commit()
+    await db.refresh(db_source)
     return db_source
 
+def trigger_discovery(source_ids: List[int], theme_name: str) -> Tuple[int, Optional[Exception]]:
+    """（同步）逐个发布模式发现任务，返回成功发布的数量，以及中断发布的异常（全部成功时为 None）。"""
+    triggered = 0
+    for source_id in source_ids:
+        try:
+            task_publisher.send_task("orchestrator.trigger_site_analysis", args=[source_id, theme_name])
+        except Exception as e:
+            return triggered, e
+        triggered += 1
+    return triggered, None
+
+@router.post("/import", response_model=DataSourceImportResult)
+async def import_data_sources(
+    request: Request,
+    db: AsyncSession = Depends(get_async_db),
+    format: Optional[str] = None,
+    theme_name: Optional[str] = None
+):
+    """
+    批量导入数据源。请求体为 CSV（带表头 site_key,name,url,description）或 NDJSON（每行一个JSON对象），
+    格式由 Content-Type 或 ?format=csv|ndjson 指定。只有 url 是必填的：
+    URL 会被校验和规范化，缺省的 site_key 取自主机名，缺省的 name 与 site_key 相同。
+
+    上传内容内部按 site_key 去重，再用一条查询排除已存在的 site_key，剩余记录通过一条批量 INSERT 写入。
+    单行无效不影响其他行，每行的处理结果见响应中的 rows。
+    传入 theme_name 时，为新建的数据源批量触发该主题的模式发现。
+    """
+    try:
+        body = (await request.body()).decode("utf-8-sig")
+        upload_format = detect_format(request.headers.get("content-type"), format)
+        candidates, report = prepare_import(iter_rows(body, upload_format))
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="Upload must be UTF-8 encoded.")
+    except (ImportRowError, csv.Error) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    try:
+        # 1. 一次查询出上传内容中已经存在的 site_key
+        site_keys = [c["site_key"] for c in candidates]
+        existing_keys = set((await db.execute(
+            select(DataSource.site_key).where(DataSource.site_key.in_(site_keys))
+        )).scalars().all()) if site_keys else set()
+
+        # 2. 批量写入新数据源；ON CONFLICT DO NOTHING 处理与并发导入之间的竞争，RETURNING 取回新记录的ID
+        new_rows = [
+            {key: value for key, value in c.items() if key != "line"}
+            for c in candidates if c["site_key"] not in existing_keys
+        ]
+        created_ids: Dict[str, int] = {}
+        if new_rows:
+            insert_stmt = dialect_insert(db.get_bind().dialect.name)(DataSource)
+            result = await db.execute(
+                insert_stmt.on_conflict_do_nothing(index_elements=[DataSource.site_key])
+                .returning(DataSource.site_key, DataSource.id),
+                new_rows,
+            )
+            created_ids = dict(result.all())
+        await db.commit()
+    except Exception as e:
+        await db.rollback()
+        logger.error(f"批量导入数据源失败: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to import data sources: {e}")
+
+    for row in report:
+        if row["status"] is not None:
+            continue
+        if row["site_key"] in created_ids:
+            row.update(status=CREATED, id=created_ids[row["site_key"]])
+        else:
+            row["status"] = ALREADY_EXISTS
+
+    summary = DataSourceImportResult(
+        total=len(report),
+        created=len(created_ids),
+        already_exists=sum(1 for row in report if row["status"] == ALREADY_EXISTS),
+        duplicate_in_upload=sum(1 for row in report if row["status"] == DUPLICATE_IN_UPLOAD),
+        invalid=sum(1 for row in report if row["status"] == INVALID),
+        rows=report,
+    )
+    logger.info(f"批量导入数据源完成: 共 {summary.total} 行，新建 {summary.created} 个。")
+
+    # 3. (可选) 为新数据源批量触发模式发现。数据源已经提交，触发失败只在报告中说明。
+    # 发布是阻塞的网络IO（最多 MAX_IMPORT_ROWS 条），在线程中进行，不阻塞事件循环上的其他请求和SSE连接
+    if theme_name and created_ids:
+        summary.discovery_triggered, error = await asyncio.to_thread(
+            trigger_discovery, list(created_ids.values()), theme_name
+        )
+        if error:
+            logger.error(f"为导入的数据源触发模式发现失败: {error}")
+            summary.discovery_error = f"Could not connect to the message broker: {error}"
+    return summary
+
 @router.get("/", response_model=List[DataSourceInDB])
-def list_data_sources(
-    db: Session = Depends(get_db),
-    skip: int = 0,
-    limit: int = 100
+async def list_data_sources(
+    request: Request,
+    response: Response,
+    db: AsyncSession = Depends(get_async_db),
+    cursor: Optional[int] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    name: Optional[str] = None
 ):
     """
-    列出所有数据源。
+    按 id 分页列出数据源，可按名称（包含匹配，不区分大小写）过滤。
+    下一页的游标在响应头 X-Next-Cursor 中；列表没有变化时，携带 If-None-Match 的请求返回 304。
     """
-    sources = db.query(DataSource).offset(skip).limit(limit).all()
-    return sources
+    conditions = []
+    if name:
+        conditions.append(DataSource.name.ilike(f"%{name}%"))
+
+    etag = await list_etag(db, DataSource, conditions, cursor, limit, name)
+    if etag_matches(request, etag):
+        return not_modified(etag)
+
+    sources = (await db.execute(keyset_page(select(DataSource), DataSource, conditions, cursor, limit))).scalars().all()
+    return finish_page(sources, limit, response, etag)
 
 @router.get("/{source_id}", response_model=DataSourceInDB)
-def get_data_source(
+async def get_data_source(
     *,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     source_id: int
 ):
     """
     获取单个数据源的详细信息。
     """
-    source = db.query(DataSource).filter(DataSource.id == source_id).first()
+    source = await db.get(DataSource, source_id)
     if not source:
         raise HTTPException(status_code=404, detail="Data source not found.")
     return source
 
 @router.put("/{source_id}", response_model=DataSourceInDB)
-def update_data_source(
+async def update_data_source(
     *,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     source_id: int,
     source_in: DataSourceUpdate
 ):
     """
     更新一个已存在的数据源。
     """
-    source = db.query(DataSource).filter(DataSource.id == source_id).first()
+    source = await db.get(DataSource, source_id)
     if not source:
         raise HTTPException(status_code=404, detail="Data source not found.")
 
@@ -104,23 +237,23 @@ def update_data_source(
         setattr(source, field, value)
 
     db.add(source)
-    db.commit()
-    db.refresh(source)
+    await db.commit()
+    await db.refresh(source)
     return source
 
 @router.delete("/{source_id}", response_model=DataSourceInDB)
-def delete_data_source(
+async def delete_data_source(
     *,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     source_id: int
 ):
     """
     删除一个数据源。
     """
-    source = db.query(DataSource).filter(DataSource.id == source_id).first()
+    source = await db.get(DataSource, source_id)
     if not source:
         raise HTTPException(status_code=404, detail="Data source not found.")
 
-    db.delete(source)
-    db.commit()
+    await db.delete(source)
+    await db.commit()
     return source
@@ -0,0 +1,56 @@
+import asyncio
+import json
+from typing import Optional
+
+from fastapi import APIRouter, Request
+from fastapi.responses import StreamingResponse
+
+# 导入共享模块
+from shared.events import RESYNC, event_broker
+
+router = APIRouter(
+    prefix="/events",
+    tags=["Events"],
+)
+
+# 没有事件时发送心跳注释的间隔（秒），防止代理因连接空闲而断开
+HEARTBEAT_INTERVAL = 15
+
+def _matches(event: dict, theme_name: Optional[str], crawl_task_id: Optional[int]) -> bool:
+    """按订阅条件过滤事件；resync 总是发送，没有相应字段的事件不受该条件限制。"""
+    if event.get("type") == RESYNC:
+        return True
+    if theme_name is not None and "theme_name" in event and event["theme_name"] != theme_name:
+        return False
+    if crawl_task_id is not None and "crawl_task_id" in event and event["crawl_task_id"] != crawl_task_id:
+        return False
+    return True
+
+async def _event_stream(request: Request, theme_name: Optional[str], crawl_task_id: Optional[int]):
+    queue = event_broker.subscribe()
+    try:
+        # 告诉浏览器断线后3秒重连
+        yield "retry: 3000\n\n"
+        while not await request.is_disconnected():
+            try:
+                event = await asyncio.wait_for(queue.get(), timeout=HEARTBEAT_INTERVAL)
+            except asyncio.TimeoutError:
+                yield ": heartbeat\n\n"
+                continue
+            if _matches(event, theme_name, crawl_task_id):
+                yield f"event: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+    finally:
+        event_broker.unsubscribe(queue)
+
+@router.get("/stream")
+async def stream_events(request: Request, theme_name: Optional[str] = None, crawl_task_id: Optional[int] = None):
+    """
+    以 Server-Sent Events 推送分析任务和抓取任务的状态变化，可按主题或抓取任务过滤。
+    事件类型: analysis_status, crawl_task_status, extraction_status, resync。
+    收到 resync 时客户端应重新请求一次完整状态（例如 /themes/analysis_status），因为期间可能有事件丢失。
+    """
+    return StreamingResponse(
+        _event_stream(request, theme_name, crawl_task_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
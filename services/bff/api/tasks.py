@@ -1,13 +1,16 @@
 import logging
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
 from pydantic import BaseModel
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List, Optional
 
-# 导入共享模块和Celery应用
-from shared.db.session import get_db
+# 导入共享模块和任务发布客户端
+from shared.db.async_session import get_async_db
+from shared.events import CRAWL_TASK_STATUS, publish_event_async
 from shared.models.core_models import CrawlTask
-from services.orchestrator.celery_app import celery_app
+from shared.task_publisher import task_publisher
+from ..pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, etag_matches, finish_page, keyset_page, list_etag, not_modified
 
 # 配置日志
 logger = logging.getLogger(__name__)
@@ -38,7 +41,7 @@ class CrawlTaskResponse(CrawlTaskBase):
 @router.post("/", response_model=CrawlTaskResponse, status_code=201)
 async def create_crawl_task(
     task_in: CrawlTaskCreate,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     创建一个新的数据抓取任务。
@@ -50,20 +53,21 @@ async def create_crawl_task(
         status="pending" # 初始状态
     )
     db.add(new_task)
-    db.commit()
-    db.refresh(new_task)
+    await db.commit()
+    await db.refresh(new_task)
 
     # 如果是一次性任务，立即触发
     if not new_task.schedule_cron:
         try:
-            celery_app.send_task(
+            task_publisher.send_task(
                 "orchestrator.execute_crawl_task",
                 args=[new_task.id]
             )
             # 更新任务状态
             new_task.status = "in_progress"
-            db.commit()
-            db.refresh(new_task)
+            await db.commit()
+            await db.refresh(new_task)
+            await publish_event_async(CRAWL_TASK_STATUS, crawl_task_id=new_task.id, status=new_task.status)
         except Exception as e:
             # 如果Broker连接失败，任务状态将保持pending
             logger.error(f"Failed to trigger crawl task {new_task.id}: {e}")
@@ -72,30 +76,52 @@ async def create_crawl_task(
     return new_task
 
 @router.get("/", response_model=List[CrawlTaskResponse])
-async def list_crawl_tasks(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+async def list_crawl_tasks(
+    request: Request,
+    response: Response,
+    cursor: Optional[int] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    name: Optional[str] = None,
+    status: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db)
+):
     """
-    列出所有已创建的数据抓取任务。
+    按 id 分页列出抓取任务，可按名称（包含匹配，不区分大小写）和状态过滤。
+    下一页的游标在响应头 X-Next-Cursor 中；列表没有变化时，携带 If-None-Match 的请求返回 304。
     """
-    tasks = db.query(CrawlTask).offset(skip).limit(limit).all()
-    return tasks
+    conditions = []
+    if name:
+        conditions.append(CrawlTask.name.ilike(f"%{name}%"))
+    if status:
+        conditions.append(CrawlTask.status == status)
+
+    etag = await list_etag(db, CrawlTask, conditions, cursor, limit, name, status)
+    if etag_matches(request, etag):
+        return not_modified(etag)
+
+    tasks = (await db.execute(keyset_page(select(CrawlTask), CrawlTask, conditions, cursor, limit))).scalars().all()
+    return finish_page(tasks, limit, response, etag)
 
 @router.post("/{task_id}/execute", status_code=202)
-async def execute_task_manually(task_id: int, db: Session = Depends(get_db)):
+async def execute_task_manually(task_id: int, from_archive: bool = False, db: AsyncSession = Depends(get_async_db)):
     """
     手动触发一个已创建的抓取任务立即执行。
+    from_archive=true 时在页面存档上重新提取（例如重新标准化之后），没有存档的页面照常访问。
     """
-    task = db.query(CrawlTask).filter(CrawlTask.id == task_id).first()
+    task = await db.get(CrawlTask, task_id)
     if not task:
         raise HTTPException(status_code=404, detail="Crawl task not found.")
 
     try:
-        celery_app.send_task(
+        task_publisher.send_task(
             "orchestrator.execute_crawl_task",
-            args=[task.id]
+            args=[task.id],
+            kwargs={"from_archive": True} if from_archive else None,
         )
         # 更新任务状态
         task.status = "in_progress"
-        db.commit()
+        await db.commit()
+        await publish_event_async(CRAWL_TASK_STATUS, crawl_task_id=task.id, status=task.status)
     except Exception as e:
         logger.error(f"Failed to manually trigger crawl task {task.id}: {e}")
         raise HTTPException(
@@ -1,14 +1,19 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Query, Request, Response
 from pydantic import BaseModel, Field
-from sqlalchemy.orm import Session
-from typing import List, Dict, Any
+from sqlalchemy import func, insert, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import datetime, timedelta
+from typing import List, Dict, Any, Optional
 
 # 导入共享模块和数据库模型
-from shared.db.session import get_db
-from shared.models.core_models import StandardDataset, StandardField, RawAnalysisResult, CrawlConfig
+from shared.db.async_session import get_async_db
+from shared.models.core_models import StandardDataset, StandardField, RawAnalysisResult, CrawlConfig, WorkbenchStat
+from shared.workbench_stats import SUMMARY_KEY, list_analyzed_themes, rebuild_workbench_stats
+from ..pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, etag_matches, finish_page, keyset_page, list_etag, not_modified
 
-# 导入Orchestrator的Celery应用实例以发送任务
-from services.orchestrator.celery_app import celery_app
+# 导入轻量级的任务发布客户端，按名称向Orchestrator发送任务（不加载Celery应用）
+from shared.task_publisher import task_publisher
 
 router = APIRouter(
     prefix="/themes",
@@ -25,7 +30,8 @@ class WorkbenchField(BaseModel):
     name: str
     count: int
     sources_count: int
-    selectors: Dict[str, int] # selector: count
+    selectors: Dict[str, int] # selector: count，按实测命中率从高到低排列
+    selector_hit_rates: Dict[str, float] = {} # selector: 在页面中实际命中元素的分析占比
 
 class WorkbenchResponse(BaseModel):
     """GET /workbench 的响应模型"""
@@ -36,11 +42,12 @@ class WorkbenchResponse(BaseModel):
 class StandardizeField(BaseModel):
     field_name: str
     description: str = ""
-    data_type: str # e.g., "String", "Integer", "Text"
+    data_type: str # e.g., "String", "Text", "Integer", "Numeric", "Boolean", "Date", "DateTime", "JSON"
 
 class FieldNameMapping(BaseModel):
     field_name: str
     selector: str
+    locale: Optional[str] = None # 解析数字和日期时使用的语言区域，如 "de_DE"，默认为 EXTRACTOR_DEFAULT_LOCALE
 
 class SourceConfigPayload(BaseModel):
     data_source_id: int
@@ -51,6 +58,7 @@ class SourceConfigPayload(BaseModel):
 class StandardizeRequest(BaseModel):
     theme_name: str
     description: str = ""
+    retention_days: Optional[int] = Field(None, ge=1) # 数据保留天数（至少 1 天），为空表示永久保留
     fields_to_standardize: List[StandardizeField]
     source_configs: List[SourceConfigPayload]
 
@@ -60,165 +68,222 @@ class AnalysisStatus(BaseModel):
     data_source_id: int
     status: str
     error_message: str | None = None
+    updated_at: datetime | None = None
 
-@router.get("/analysis_status", response_model=List[AnalysisStatus])
-async def get_analysis_status(theme_name: str, db: Session = Depends(get_db)):
+def latest_analysis_status_query(theme_name: str, dialect_name: str):
     """
-    根据主题名称查询所有相关分析任务的最新状态。
+    构造查询每个数据源最新一条分析记录的语句。
+    PostgreSQL 上使用 DISTINCT ON，可以沿 (theme_name, data_source_id, created_at) 索引反向扫描，
+    每个数据源只读取最新的一条；其他数据库使用 ROW_NUMBER() 窗口函数。
     """
-    results = db.query(
+    columns = (
         RawAnalysisResult.data_source_id,
         RawAnalysisResult.status,
-        RawAnalysisResult.error_message
-    ).filter(RawAnalysisResult.theme_name == theme_name).all()
+        RawAnalysisResult.error_message,
+        RawAnalysisResult.updated_at,
+    )
+    newest_first = (
+        RawAnalysisResult.data_source_id.desc(),
+        RawAnalysisResult.created_at.desc(),
+        RawAnalysisResult.id.desc(),
+    )
+    if dialect_name == "postgresql":
+        return (
+            select(*columns)
+            .where(RawAnalysisResult.theme_name == theme_name)
+            .distinct(RawAnalysisResult.data_source_id)
+            .order_by(*newest_first)
+        ).subquery()
+
+    ranked = select(
+        *columns,
+        func.row_number().over(partition_by=RawAnalysisResult.data_source_id, order_by=newest_first[1:]).label("rank"),
+    ).where(RawAnalysisResult.theme_name == theme_name).subquery()
+    return select(*(ranked.c[c.key] for c in columns)).where(ranked.c.rank == 1).subquery()
+
+# 增量轮询时向前多取的时间：updated_at 在写入时生成，提交可能稍晚，
+# 时间戳更早的记录可能在轮询方已经越过该时间之后才变得可见
+ANALYSIS_STATUS_SINCE_OVERLAP = timedelta(seconds=5)
 
-    if not results:
-        return []
+@router.get("/analysis_status", response_model=List[AnalysisStatus])
+async def get_analysis_status(theme_name: str, since: Optional[datetime] = None, db: AsyncSession = Depends(get_async_db)):
+    """
+    根据主题名称查询每个数据源最新一次分析任务的状态。
+    传入 since（上次响应中最大的 updated_at）时只返回此后有变化的数据源，供前端增量轮询。
+    since 之前 ANALYSIS_STATUS_SINCE_OVERLAP 内的记录会重复返回，保证不会漏掉时间戳相同或稍后才提交的更新。
+    """
+    latest = latest_analysis_status_query(theme_name, db.get_bind().dialect.name)
+    query = select(latest)
+    if since is not None:
+        query = query.where(latest.c.updated_at >= since - ANALYSIS_STATUS_SINCE_OVERLAP)
 
-    # 返回每个数据源的最新状态
-    # 注意：如果同一数据源有多个分析记录，这里可以增加逻辑来返回最新的一个
+    results = (await db.execute(query.order_by(latest.c.data_source_id))).all()
     return [AnalysisStatus(
         data_source_id=r.data_source_id,
         status=r.status,
-        error_message=r.error_message
+        error_message=r.error_message,
+        updated_at=r.updated_at,
     ) for r in results]
 
 
 @router.post("/standardize", status_code=201)
-async def standardize_theme(request: StandardizeRequest, db: Session = Depends(get_db)):
+async def standardize_theme(request: StandardizeRequest, db: AsyncSession = Depends(get_async_db)):
     """
     接收标准化的最终配置，并在一个原子事务中更新所有相关的数据库表。
     """
     try:
         # 1. 查找或创建 StandardDataset
-        dataset = db.query(StandardDataset).filter(StandardDataset.name == request.theme_name).first()
+        dataset = (await db.execute(
+            select(StandardDataset).where(StandardDataset.name == request.theme_name)
+        )).scalars().first()
         if not dataset:
             # table_name 应该是一个安全、唯一的名称，这里用 theme_name 清理后的版本
             table_name = f"data_{request.theme_name.lower().replace(' ', '_')}"
             dataset = StandardDataset(
                 name=request.theme_name,
                 description=request.description,
-                table_name=table_name
+                table_name=table_name,
+                retention_days=request.retention_days
             )
             db.add(dataset)
-            db.flush()  # 在提交前将更改同步到数据库，以获取新生成的dataset.id
-
-        # 2. 创建新的 StandardField
-        for field_data in request.fields_to_standardize:
-            # 检查字段是否已存在，避免重复创建
-            existing_field = db.query(StandardField).filter(
-                StandardField.dataset_id == dataset.id,
-                StandardField.field_name == field_data.field_name
-            ).first()
-            if not existing_field:
+            await db.flush()  # 在提交前将更改同步到数据库，以获取新生成的dataset.id
+        elif request.retention_days is not None:
+            dataset.retention_days = request.retention_days
+
+        # 2. 一次查询出已存在的字段，批量插入新字段
+        requested_fields = {f.field_name: f for f in request.fields_to_standardize}
+        name_to_id_map = dict((await db.execute(
+            select(StandardField.field_name, StandardField.id).where(StandardField.dataset_id == dataset.id)
+        )).all())
+        new_fields = [
+            {
+                "dataset_id": dataset.id,
+                "field_name": field_data.field_name,
+                "description": field_data.description,
+                "data_type": field_data.data_type,
                 # column_name 同样需要清理
-                column_name = field_data.field_name.lower().replace(' ', '_')
-                new_field = StandardField(
-                    dataset_id=dataset.id,
-                    field_name=field_data.field_name,
-                    description=field_data.description,
-                    data_type=field_data.data_type,
-                    column_name=column_name
-                )
-                db.add(new_field)
-
-        # 3. 创建一个 field_name -> field_id 的映射
-        db.flush() # 确保所有新创建的StandardField都有ID
-        all_fields_in_dataset = db.query(StandardField).filter(StandardField.dataset_id == dataset.id).all()
-        name_to_id_map = {f.field_name: f.id for f in all_fields_in_dataset}
-
-        # 4. 为每个数据源创建 CrawlConfig
-        for source_config in request.source_configs:
-            # (可选) 停用旧配置
-            db.query(CrawlConfig).filter(
-                CrawlConfig.data_source_id == source_config.data_source_id,
-                CrawlConfig.standard_dataset_id == dataset.id
-            ).update({"status": "inactive"})
-
-            # 构建将要存储到数据库的 field_selectors_json
-            # 它需要使用 standard_field_id
-            db_mappings = []
-            for mapping in source_config.mappings:
-                field_id = name_to_id_map.get(mapping.field_name)
-                if field_id:
-                    db_mappings.append({
-                        "standard_field_id": field_id,
-                        "selector": mapping.selector
-                    })
-
-            final_selectors_json = {
-                "mappings": db_mappings,
-                "extra_fields": source_config.extra_fields
+                "column_name": field_data.field_name.lower().replace(' ', '_'),
             }
-
-            # 创建新配置
-            new_crawl_config = CrawlConfig(
-                data_source_id=source_config.data_source_id,
-                standard_dataset_id=dataset.id,
-                field_selectors_json=final_selectors_json,
-                status="active",
-                version=1 # 简化处理，版本管理可后续增强
+            for field_data in requested_fields.values()
+            if field_data.field_name not in name_to_id_map
+        ]
+        if new_fields:
+            # 3. 批量插入并通过 RETURNING 取回新字段的ID，补全 field_name -> field_id 的映射
+            inserted = await db.execute(
+                insert(StandardField).returning(StandardField.field_name, StandardField.id), new_fields
+            )
+            name_to_id_map.update(dict(inserted.all()))
+
+        # 4. 为每个数据源创建新版本的 CrawlConfig
+        # 同一数据源在请求中出现多次时以最后一次为准
+        source_configs = {c.data_source_id: c for c in request.source_configs}
+        if source_configs:
+            source_ids = list(source_configs)
+            # 一次查询各数据源当前的最大版本号，新配置的版本号在此基础上加一
+            latest_versions = dict((await db.execute(
+                select(CrawlConfig.data_source_id, func.max(CrawlConfig.version)).where(
+                    CrawlConfig.standard_dataset_id == dataset.id,
+                    CrawlConfig.data_source_id.in_(source_ids)
+                ).group_by(CrawlConfig.data_source_id)
+            )).all())
+
+            # 用一条语句停用这些数据源的所有旧配置
+            await db.execute(
+                update(CrawlConfig).where(
+                    CrawlConfig.standard_dataset_id == dataset.id,
+                    CrawlConfig.data_source_id.in_(source_ids),
+                    CrawlConfig.status == "active"
+                ).values(status="inactive")
             )
-            db.add(new_crawl_config)
 
-        db.commit()
+            new_configs = []
+            for source_config in source_configs.values():
+                # 构建将要存储到数据库的 field_selectors_json
+                # 它需要使用 standard_field_id
+                db_mappings = []
+                for mapping in source_config.mappings:
+                    field_id = name_to_id_map.get(mapping.field_name)
+                    if field_id:
+                        db_mapping = {
+                            "standard_field_id": field_id,
+                            "selector": mapping.selector
+                        }
+                        if mapping.locale:
+                            db_mapping["locale"] = mapping.locale
+                        db_mappings.append(db_mapping)
+
+                new_configs.append({
+                    "data_source_id": source_config.data_source_id,
+                    "standard_dataset_id": dataset.id,
+                    "field_selectors_json": {
+                        "mappings": db_mappings,
+                        "extra_fields": source_config.extra_fields
+                    },
+                    "status": "active",
+                    # 版本号递增后，提取器中按版本缓存的抓取计划随之失效 (见 extractor_svc/extraction_plan.py)
+                    "version": latest_versions.get(source_config.data_source_id, 0) + 1,
+                })
+            await db.execute(insert(CrawlConfig), new_configs)
+
+        await db.commit()
         return {"message": f"Theme '{request.theme_name}' has been successfully standardized."}
 
+    except IntegrityError as e:
+        # 并发的标准化请求为同一数据源写入了相同的版本号
+        await db.rollback()
+        raise HTTPException(status_code=409, detail=f"Conflicting concurrent standardization, please retry: {e.orig}")
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=f"An error occurred during standardization: {e}")
 
 
+async def _load_workbench_stats(db: AsyncSession, theme_name: str) -> List[WorkbenchStat]:
+    return (await db.execute(
+        select(WorkbenchStat)
+        .where(WorkbenchStat.theme_name == theme_name)
+        .order_by(WorkbenchStat.field_name, WorkbenchStat.selector)
+    )).scalars().all()
+
 @router.get("/{theme_name}/workbench", response_model=WorkbenchResponse)
-async def get_workbench_data(theme_name: str, db: Session = Depends(get_db)):
+async def get_workbench_data(theme_name: str, db: AsyncSession = Depends(get_async_db)):
     """
     为“标准化工作台”提供数据。
-    它会聚合所有原始分析结果，并提供标准化建议。
+    它读取所有原始分析结果的聚合统计，并提供标准化建议。
     """
     # 1. 查询现有的标准数据集和字段
-    dataset = db.query(StandardDataset).filter(StandardDataset.name == theme_name).first()
+    dataset = (await db.execute(
+        select(StandardDataset).where(StandardDataset.name == theme_name)
+    )).scalars().first()
     existing_fields = []
     if dataset:
         existing_fields = [f.field_name for f in dataset.standard_fields]
 
-    # 2. 查询所有已完成的原始分析结果
-    results = db.query(RawAnalysisResult).filter(
-        RawAnalysisResult.theme_name == theme_name,
-        RawAnalysisResult.status == "completed"
-    ).all()
+    # 2. 读取该主题的物化统计（分析结果完成时增量维护，见 shared/workbench_stats.py）
+    stats = await _load_workbench_stats(db, theme_name)
 
-    if not results:
+    summary = next((s for s in stats if s.field_name == SUMMARY_KEY), None)
+    if summary is None or summary.count == 0:
         return WorkbenchResponse(
             existing_standard_fields=existing_fields,
             discovered_fields=[],
             recommendations=[]
         )
 
-    # 3. 聚合所有来源的字段
+    # 3. 把统计行整理为按字段分组的结构
     aggregated_fields: Dict[str, Dict[str, Any]] = {}
-    sources_count = len(results)
+    sources_count = summary.count
 
-    for result in results:
-        if not result.raw_fields_json or "fields" not in result.raw_fields_json:
+    for stat in stats:
+        if stat.field_name == SUMMARY_KEY:
             continue
-
-        # 使用set来确保每个来源只对一个字段名计数一次
-        seen_fields_in_source = set()
-        for field in result.raw_fields_json["fields"]:
-            field_name = field.get("field_name")
-            selector = field.get("selector")
-            if not field_name or not selector:
-                continue
-
-            if field_name not in aggregated_fields:
-                aggregated_fields[field_name] = {"count": 0, "selectors": {}}
-
-            # 更新选择器计数
-            aggregated_fields[field_name]["selectors"][selector] = aggregated_fields[field_name]["selectors"].get(selector, 0) + 1
-
-            if field_name not in seen_fields_in_source:
-                aggregated_fields[field_name]["count"] += 1
-                seen_fields_in_source.add(field_name)
+        data = aggregated_fields.setdefault(stat.field_name, {"count": 0, "selectors": {}, "validated": {}, "hits": {}})
+        if stat.selector == SUMMARY_KEY:
+            data["count"] = stat.count
+            continue
+        data["selectors"][stat.selector] = stat.count
+        if stat.validated_count:
+            data["validated"][stat.selector] = stat.validated_count
+            data["hits"][stat.selector] = stat.hit_count
 
     # 4. 格式化输出并生成推荐
     discovered_list = []
@@ -228,11 +293,23 @@ async def get_workbench_data(theme_name: str, db: Session = Depends(get_db)):
         if name in existing_fields:
             continue
 
+        hit_rates = {
+            selector: round(data["hits"].get(selector, 0) / validated_count, 4)
+            for selector, validated_count in data["validated"].items()
+        }
+        # 按实测命中率排序，命中率相同（或未经校验）时再按LLM投票数排序
+        ranked_selectors = sorted(
+            data["selectors"].items(),
+            key=lambda item: (hit_rates.get(item[0], -1.0), item[1]),
+            reverse=True,
+        )
+
         discovered_list.append(WorkbenchField(
             name=name,
             count=data["count"],
             sources_count=sources_count,
-            selectors=data["selectors"]
+            selectors=dict(ranked_selectors),
+            selector_hit_rates=hit_rates,
         ))
         # 推荐逻辑：如果一个字段在超过一半的数据源中出现，则推荐
         if data["count"] > sources_count / 2:
@@ -245,15 +322,47 @@ async def get_workbench_data(theme_name: str, db: Session = Depends(get_db)):
     )
 
 
+@router.post("/workbench/rebuild")
+async def rebuild_all_workbenches(db: AsyncSession = Depends(get_async_db)):
+    """
+    重新计算所有主题的工作台统计，每个主题在单独的事务中完成。
+    统计表上线前完成的分析结果不会被增量统计计入，部署后需要调用一次进行回填。
+    """
+    rebuilt = {}
+    for theme_name in await list_analyzed_themes(db):
+        try:
+            rebuilt[theme_name] = await rebuild_workbench_stats(db, theme_name)
+            await db.commit()
+        except Exception as e:
+            await db.rollback()
+            raise HTTPException(status_code=500, detail=f"Failed to rebuild workbench statistics for theme '{theme_name}': {e}")
+    return {"message": f"Workbench statistics rebuilt for {len(rebuilt)} themes.", "sources_count": rebuilt}
+
+
+@router.post("/{theme_name}/workbench/rebuild")
+async def rebuild_workbench(theme_name: str, db: AsyncSession = Depends(get_async_db)):
+    """
+    根据所有已完成的原始分析结果重新计算该主题的工作台统计。
+    正常情况下统计是增量维护的，只有在手工修改过分析结果或统计出现偏差时才需要调用。
+    """
+    try:
+        sources_count = await rebuild_workbench_stats(db, theme_name)
+        await db.commit()
+        return {"message": f"Workbench statistics for theme '{theme_name}' rebuilt.", "sources_count": sources_count}
+    except Exception as e:
+        await db.rollback()
+        raise HTTPException(status_code=500, detail=f"Failed to rebuild workbench statistics: {e}")
+
+
 @router.post("/analyze", status_code=202)
 async def trigger_analysis(request: AnalyzeRequest):
     """
     接收一个数据源ID和主题名称，并触发一个后台分析任务。
     """
     try:
-        # 使用Celery实例按名称发送任务到队列
+        # 按名称发送任务到队列，由Orchestrator的Celery worker执行
         # 这是一种服务间解耦的推荐做法
-        celery_app.send_task(
+        task_publisher.send_task(
             "orchestrator.trigger_site_analysis",
             args=[request.data_source_id, request.theme_name]
         )
@@ -275,9 +384,27 @@ class StandardDatasetResponse(BaseModel):
         orm_mode = True
 
 @router.get("/", response_model=List[StandardDatasetResponse])
-async def list_standard_datasets(db: Session = Depends(get_db)):
+async def list_standard_datasets(
+    request: Request,
+    response: Response,
+    cursor: Optional[int] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    name: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db)
+):
     """
-    列出所有已创建的标准数据集。
+    按 id 分页列出已创建的标准数据集，可按名称（包含匹配，不区分大小写）过滤。
+    下一页的游标在响应头 X-Next-Cursor 中；列表没有变化时，携带 If-None-Match 的请求返回 304。
     """
-    datasets = db.query(StandardDataset).all()
-    return datasets
+    conditions = []
+    if name:
+        conditions.append(StandardDataset.name.ilike(f"%{name}%"))
+
+    etag = await list_etag(db, StandardDataset, conditions, cursor, limit, name)
+    if etag_matches(request, etag):
+        return not_modified(etag)
+
+    datasets = (await db.execute(
+        keyset_page(select(StandardDataset), StandardDataset, conditions, cursor, limit)
+    )).scalars().all()
+    return finish_page(datasets, limit, response, etag)
@@ -0,0 +1,137 @@
+import csv
+import io
+import json
+import re
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import urlsplit, urlunsplit
+
+# 单次导入的最大行数。站点标识通过一条 IN 查询去重，需要控制在数据库驱动的参数个数上限以内
+MAX_IMPORT_ROWS = 20000
+
+CSV_CONTENT_TYPES = {"text/csv", "application/csv"}
+NDJSON_CONTENT_TYPES = {"application/x-ndjson", "application/ndjson", "application/jsonl"}
+
+# 每行导入结果的状态
+CREATED = "created"
+INVALID = "invalid"
+DUPLICATE_IN_UPLOAD = "duplicate_in_upload"
+ALREADY_EXISTS = "already_exists"
+
+_SITE_KEY_PATTERN = re.compile(r"^[a-z0-9][a-z0-9._-]{0,254}$")
+_DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+class ImportRowError(ValueError):
+    """导入的某一行无效。"""
+
+
+def detect_format(content_type: Optional[str], requested: Optional[str]) -> str:
+    """确定上传内容的格式：优先使用显式指定的 format，否则按 Content-Type 判断。"""
+    if requested:
+        if requested not in ("csv", "ndjson"):
+            raise ImportRowError(f"Unsupported format '{requested}', expected 'csv' or 'ndjson'.")
+        return requested
+    media_type = (content_type or "").split(";")[0].strip().lower()
+    if media_type in CSV_CONTENT_TYPES:
+        return "csv"
+    if media_type in NDJSON_CONTENT_TYPES:
+        return "ndjson"
+    raise ImportRowError("Cannot determine upload format, set Content-Type to text/csv or application/x-ndjson, or pass ?format=.")
+
+def iter_rows(body: str, upload_format: str) -> Iterator[Tuple[int, Any]]:
+    """逐行解析上传内容，产出 (行号, 原始记录)；无法解析的行产出 ImportRowError 而不是中断整个导入。"""
+    if upload_format == "csv":
+        # 行号从2开始，第1行是表头
+        for line_number, record in enumerate(csv.DictReader(io.StringIO(body)), start=2):
+            yield line_number, record
+        return
+
+    for line_number, line in enumerate(body.splitlines(), start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError as e:
+            yield line_number, ImportRowError(f"invalid JSON: {e}")
+            continue
+        yield line_number, record if isinstance(record, dict) else ImportRowError("each line must be a JSON object")
+
+def normalize_url(raw: str) -> str:
+    """
+    规范化URL：补全缺省的 https://，协议和主机名小写，去掉默认端口和片段 (#...)，空路径补为 "/"。
+    只接受 http/https 协议。
+    """
+    value = (raw or "").strip()
+    if not value:
+        raise ImportRowError("url is required")
+    if "://" not in value:
+        value = f"https://{value}"
+
+    parts = urlsplit(value)
+    scheme = parts.scheme.lower()
+    if scheme not in _DEFAULT_PORTS:
+        raise ImportRowError(f"unsupported URL scheme '{parts.scheme}'")
+    try:
+        hostname, port = parts.hostname, parts.port
+    except ValueError as e:
+        raise ImportRowError(f"invalid URL: {e}")
+    if not hostname or ("." not in hostname and hostname != "localhost"):
+        raise ImportRowError(f"invalid host in URL '{raw}'")
+
+    try:
+        # 国际化域名统一转换为 punycode
+        netloc = hostname if hostname.isascii() else hostname.encode("idna").decode("ascii")
+    except UnicodeError as e:
+        raise ImportRowError(f"invalid host in URL '{raw}': {e}")
+    if port and port != _DEFAULT_PORTS[scheme]:
+        netloc = f"{netloc}:{port}"
+    return urlunsplit((scheme, netloc, parts.path or "/", parts.query, ""))
+
+def default_site_key(url: str) -> str:
+    """未提供 site_key 时，使用去掉 "www." 前缀的主机名。"""
+    host = urlsplit(url).hostname or ""
+    return host[4:] if host.startswith("www.") else host
+
+def normalize_row(record: Dict[str, Any]) -> Dict[str, Any]:
+    """校验并规范化一条记录，返回可直接写入 data_sources 的字段。"""
+    url = normalize_url(str(record.get("url") or ""))
+    site_key = str(record.get("site_key") or "").strip().lower() or default_site_key(url)
+    if not _SITE_KEY_PATTERN.match(site_key):
+        raise ImportRowError(f"invalid site_key '{site_key}'")
+    name = str(record.get("name") or "").strip() or site_key
+    description = str(record.get("description") or "").strip() or None
+    return {"site_key": site_key, "name": name[:255], "url": url, "description": description}
+
+def prepare_import(rows: Iterator[Tuple[int, Any]]) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """
+    校验、规范化上传的记录并在上传内容内部按 site_key 去重（保留第一次出现的记录）。
+    返回 (待写入的记录, 每行的结果报告)；待写入的记录带有 "line" 键，对应报告中的行。
+    """
+    candidates: List[Dict[str, Any]] = []
+    report: List[Dict[str, Any]] = []
+    first_line_by_key: Dict[str, int] = {}
+
+    for line_number, record in rows:
+        if len(report) >= MAX_IMPORT_ROWS:
+            raise ImportRowError(f"Too many rows, at most {MAX_IMPORT_ROWS} rows can be imported at once.")
+        try:
+            if isinstance(record, ImportRowError):
+                raise record
+            values = normalize_row(record)
+        except ImportRowError as e:
+            report.append({"line": line_number, "status": INVALID, "error": str(e)})
+            continue
+
+        site_key = values["site_key"]
+        if site_key in first_line_by_key:
+            report.append({
+                "line": line_number,
+                "site_key": site_key,
+                "status": DUPLICATE_IN_UPLOAD,
+                "error": f"same site_key as line {first_line_by_key[site_key]}",
+            })
+            continue
+        first_line_by_key[site_key] = line_number
+        candidates.append({"line": line_number, **values})
+        report.append({"line": line_number, "site_key": site_key, "status": None})
+    return candidates, report
@@ -1,5 +1,15 @@
 from fastapi import FastAPI
-from .api import themes, tasks, data_sources
+from fastapi.middleware.cors import CORSMiddleware
+from .api import themes, tasks, data_sources, events
+from .pagination import NEXT_CURSOR_HEADER
+
+# 导入共享模块
+from shared.config import settings
+from shared.events import event_broker
+from shared.metrics import metrics_router
+from shared.profiling import profile_requests, profiling_router
+from shared.tracing import TRACE_ID_RESPONSE_HEADER, trace_requests, tracer
+from shared.redis_client import close_async_redis
 
 # 创建BFF服务的FastAPI应用实例
 app = FastAPI(
@@ -8,11 +18,36 @@ app = FastAPI(
     version="1.0.0",
 )
 
+# 每个请求记录一个 span，没有上游追踪上下文时在这里新建 trace，并随 Celery 任务传到下游
+tracer.set_service("bff")
+app.middleware("http")(trace_requests)
+# 开启性能剖析时每 N 个请求剖析一次
+app.middleware("http")(profile_requests)
+# 前端与 BFF 不同源：跨域响应中只有显式暴露的响应头才能被前端读取（列表分页依赖 X-Next-Cursor）
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=[origin.strip() for origin in settings.BFF_CORS_ORIGINS.split(",") if origin.strip()],
+    allow_methods=["*"],
+    allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER, TRACE_ID_RESPONSE_HEADER, "ETag"],
+)
+
 # --- 挂载路由 ---
 # 将来自不同模块的路由挂载到主应用上
 app.include_router(themes.router, prefix="/api/v1")
 app.include_router(tasks.router, prefix="/api/v1")
 app.include_router(data_sources.router, prefix="/api/v1")
+app.include_router(events.router, prefix="/api/v1")
+# Prometheus 指标不加 API 前缀，与 /health 一样供监控系统直接抓取
+app.include_router(metrics_router)
+app.include_router(profiling_router)
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    """关闭事件订阅和Redis连接。"""
+    await event_broker.close()
+    await close_async_redis()
 
 
 @app.get("/health", summary="健康检查", tags=["Monitoring"])
@@ -0,0 +1,54 @@
+import hashlib
+from typing import Any, List, Optional, Sequence
+
+from fastapi import Request, Response
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql import Select
+
+# 列表接口每页的默认和最大条数
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+def keyset_page(query: Select, model, conditions: Sequence[Any], cursor: Optional[int], limit: int) -> Select:
+    """
+    按 id 的键集分页：取 id 大于游标的下一页。与 OFFSET 不同，翻到很深的页也只需沿主键索引定位，不需要跳过前面的行。
+    多取一行用于判断是否还有下一页。
+    """
+    query = query.where(*conditions)
+    if cursor is not None:
+        query = query.where(model.id > cursor)
+    return query.order_by(model.id).limit(limit + 1)
+
+async def list_etag(db: AsyncSession, model, conditions: Sequence[Any], *params: Any) -> str:
+    """
+    以过滤后集合的 (行数, 最大 updated_at, 最大 id) 作为列表的指纹，并与请求参数一起生成弱 ETag。
+    新增、修改、删除都会改变其中至少一项；这条聚合查询比取出整页数据便宜得多。
+    """
+    updated_at = func.coalesce(model.updated_at, model.created_at)
+    count, last_updated, last_id = (await db.execute(
+        select(func.count(), func.max(updated_at), func.max(model.id)).select_from(model).where(*conditions)
+    )).one()
+    fingerprint = f"{model.__tablename__}|{count}|{last_updated}|{last_id}|{params}"
+    return f'W/"{hashlib.sha1(fingerprint.encode()).hexdigest()}"'
+
+def etag_matches(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    return if_none_match.strip() == "*" or etag in [tag.strip() for tag in if_none_match.split(",")]
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+
+def finish_page(rows: List[Any], limit: int, response: Response, etag: str) -> List[Any]:
+    """去掉多取的一行，设置 ETag 和下一页游标 (X-Next-Cursor，没有下一页时不设置)。"""
+    response.headers["ETag"] = etag
+    # 要求浏览器每次都携带 If-None-Match 重新验证，列表没有变化时得到 304
+    response.headers["Cache-Control"] = "no-cache"
+    if len(rows) > limit:
+        rows = rows[:limit]
+        response.headers[NEXT_CURSOR_HEADER] = str(rows[-1].id)
+    return rows
@@ -1,13 +1,26 @@
 import asyncio
 import logging
+import httpx
 from fastapi import FastAPI, Depends, BackgroundTasks, HTTPException
 from pydantic import BaseModel
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from playwright.async_api import async_playwright
 
 # 导入共享模块
-from shared.db.session import get_db
+from shared.config import settings
+from shared.db.async_session import AsyncSessionLocal, get_async_db
+from shared.llm.client import build_page_outline, get_llm_client
 from shared.models.core_models import DataSource, RawAnalysisResult
+from shared.page_archive import page_archive
+from shared.events import ANALYSIS_STATUS, publish_event_async
+from shared.metrics import (
+    BROWSER_POOL_SIZE, IN_FLIGHT_PAGES, PAGE_NAVIGATION_SECONDS, SELECTOR_EVALUATION_SECONDS,
+    metrics_router, observe_seconds, source_labels, track_in_progress,
+)
+from shared.profiling import profile_requests, profiling_router
+from shared.tracing import trace_requests, tracer
+from shared.redis_client import close_async_redis
+from shared.workbench_stats import apply_workbench_increments, build_workbench_increments
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
@@ -20,6 +33,15 @@ app = FastAPI(
     version="1.0.0",
 )
 
+# 暴露 Prometheus 指标 (/metrics)
+app.include_router(metrics_router)
+# 沿用 Orchestrator 请求头中的追踪上下文
+tracer.set_service("discovery_svc")
+app.middleware("http")(trace_requests)
+# 开启性能剖析时每 N 个请求剖析一次，/admin/profiling 用于切换开关和下载汇总的调用栈
+app.middleware("http")(profile_requests)
+app.include_router(profiling_router)
+
 # --- Pydantic 模型 ---
 class DiscoveryRequest(BaseModel):
     """/discover 端点的请求体模型"""
@@ -50,16 +72,165 @@ async def mock_llm_analyze(html_content: str) -> dict:
     logger.info("模拟LLM分析完成。")
     return mocked_result
 
+async def analyze_with_llm(theme_name: str, html_content: str) -> dict:
+    """
+    对页面内容进行LLM分析。
+    配置了 LLM_BASE_URL 时，将精简后的页面大纲发送给真实的LLM（经过限流、并发控制和重试）；
+    否则退回到模拟实现，便于本地开发。
+    """
+    if not settings.LLM_BASE_URL:
+        return await mock_llm_analyze(html_content)
+    outline = build_page_outline(html_content)
+    return await get_llm_client().analyze_page(theme_name, outline)
+
+# --- 选择器校验 ---
+# 在浏览器中一次性评估所有候选选择器的脚本。
+# 所有选择器通过一次 page.evaluate 调用完成校验，避免逐个选择器往返浏览器。
+SELECTOR_EVALUATION_SCRIPT = """
+(args) => {
+    const results = {};
+    for (const selector of args.selectors) {
+        try {
+            const nodes = document.querySelectorAll(selector);
+            const samples = [];
+            let textLength = 0;
+            nodes.forEach((node) => {
+                const text = (node.innerText || node.textContent || "").trim();
+                textLength += text.length;
+                if (text && samples.length < args.sampleSize) {
+                    samples.push(text.slice(0, args.sampleMaxChars));
+                }
+            });
+            results[selector] = {match_count: nodes.length, text_length: textLength, samples: samples};
+        } catch (e) {
+            // 非法的CSS选择器会在这里抛出 SyntaxError
+            results[selector] = {match_count: 0, text_length: 0, samples: [], error: String(e)};
+        }
+    }
+    return results;
+}
+"""
+
+def llm_selectors(llm_output: dict) -> list:
+    """LLM给出的所有不重复的选择器。"""
+    return list({f["selector"] for f in llm_output.get("fields") or [] if f.get("selector")})
+
+def selector_evaluation_params() -> str:
+    """影响选择器校验结果的参数，作为页面存档中校验结果缓存的键的一部分。"""
+    return f"samples={settings.SELECTOR_SAMPLE_SIZE},chars={settings.SELECTOR_SAMPLE_MAX_CHARS}"
+
+async def evaluate_selectors(page, selectors: list) -> dict:
+    """在已渲染的页面上通过一次 page.evaluate 计算所有选择器的匹配数量、文本长度和样例值。"""
+    if not selectors:
+        return {}
+    return await page.evaluate(SELECTOR_EVALUATION_SCRIPT, {
+        "selectors": selectors,
+        "sampleSize": settings.SELECTOR_SAMPLE_SIZE,
+        "sampleMaxChars": settings.SELECTOR_SAMPLE_MAX_CHARS,
+    })
+
+async def evaluate_selectors_on_html(html_content: str, selectors: list) -> dict:
+    """在浏览器中载入存档的HTML后计算选择器（禁用脚本，不访问网络）。"""
+    async with async_playwright() as p:
+        browser = await p.chromium.launch()
+        try:
+            with track_in_progress(BROWSER_POOL_SIZE), track_in_progress(IN_FLIGHT_PAGES):
+                page = await browser.new_page(java_script_enabled=False)
+                await page.set_content(html_content)
+                return await evaluate_selectors(page, selectors)
+        finally:
+            await browser.close()
+
+async def page_unchanged(url: str, archived: dict) -> bool:
+    """
+    用存档时主文档的 ETag / Last-Modified 发送条件请求，服务器返回 304 时认为页面未变化。
+    存档没有这两个响应头、请求出错或超时时都视为已变化，由调用方重新访问页面。
+    """
+    headers = {}
+    if archived.get("etag"):
+        headers["If-None-Match"] = archived["etag"]
+    if archived.get("last_modified"):
+        headers["If-Modified-Since"] = archived["last_modified"]
+    if not headers:
+        return False
+    try:
+        async with httpx.AsyncClient(timeout=settings.PAGE_ARCHIVE_REVALIDATE_TIMEOUT, follow_redirects=True) as client:
+            response = await client.get(url, headers=headers)
+    except httpx.HTTPError as e:
+        logger.info(f"确认 URL: {url} 是否变化失败，重新访问页面: {e}")
+        return False
+    return response.status_code == 304
+
+def apply_selector_validation(llm_output: dict, evaluations: dict) -> dict:
+    """
+    把选择器的计算结果写回LLM的输出。
+
+    为每个字段记录匹配数量、文本总长度和样例值（写入字段的 "validation" 键），
+    并通过 "valid" 标记该选择器是否命中了至少一个元素。
+    未命中任何元素的字段会被标记为无效，或在配置要求时直接丢弃。
+    """
+    fields = llm_output.get("fields") or []
+    if not llm_selectors(llm_output):
+        return llm_output
+
+    validated_fields = []
+    dropped_fields = []
+    for field in fields:
+        selector = field.get("selector")
+        validation = evaluations.get(selector) if selector else None
+        if validation is None:
+            validation = {"match_count": 0, "text_length": 0, "samples": []}
+        field["validation"] = validation
+        field["valid"] = validation["match_count"] > 0
+
+        if not field["valid"] and settings.DISCOVERY_DROP_UNMATCHED_SELECTORS:
+            dropped_fields.append(field)
+            continue
+        validated_fields.append(field)
+
+    matched_count = sum(1 for f in fields if f["valid"])
+    llm_output["fields"] = validated_fields
+    llm_output["selector_validation"] = {
+        "total": len(fields),
+        "matched": matched_count,
+        "hit_rate": round(matched_count / len(fields), 4) if fields else 0.0,
+        "dropped": [f.get("field_name") for f in dropped_fields],
+    }
+    logger.info(f"选择器校验完成：{matched_count}/{len(fields)} 个选择器在页面中命中。")
+    return llm_output
+
 # --- 核心工作流 ---
-async def run_discovery_workflow(request: DiscoveryRequest, db: Session):
+async def run_discovery_workflow(request: DiscoveryRequest):
     """
     执行模式发现的完整工作流。
     这个函数被设计为在后台任务中运行。
+    后台任务在响应返回之后才执行，此时请求级别的会话已经关闭，
+    因此这里自行创建并持有一个独立的数据库会话。
     """
+    async with AsyncSessionLocal() as db:
+        await _run_discovery_workflow(request, db)
+
+async def _publish_analysis_status(db: AsyncSession, analysis_result: RawAnalysisResult):
+    """推送分析记录的状态变化事件，BFF 会把它转发给订阅了该主题的前端。"""
+    # updated_at 由数据库在更新时生成，提交后需要重新读取。
+    # 读取会开启新的事务，立即结束它，避免在之后的页面访问和LLM调用期间一直持有一个空闲事务
+    await db.refresh(analysis_result, ["updated_at"])
+    await db.commit()
+    await publish_event_async(
+        ANALYSIS_STATUS,
+        theme_name=analysis_result.theme_name,
+        data_source_id=analysis_result.data_source_id,
+        status=analysis_result.status,
+        error_message=analysis_result.error_message,
+        updated_at=analysis_result.updated_at,
+    )
+
+async def _run_discovery_workflow(request: DiscoveryRequest, db: AsyncSession):
+    """在给定的会话中执行模式发现工作流。"""
     logger.info(f"开始处理 data_source_id: {request.data_source_id} 的发现任务。")
 
     # 1. 从数据库获取数据源信息
-    data_source = db.query(DataSource).filter(DataSource.id == request.data_source_id).first()
+    data_source = await db.get(DataSource, request.data_source_id)
     if not data_source:
         logger.error(f"未找到 ID 为 {request.data_source_id} 的数据源。")
         # 在后台任务中，我们不能直接返回HTTPException，只能记录日志。
@@ -73,40 +244,94 @@ async def run_discovery_workflow(request: DiscoveryRequest, db: Session):
         status="processing"
     )
     db.add(analysis_result)
-    db.commit()
-    db.refresh(analysis_result)
+    await db.commit()
+    await db.refresh(analysis_result)
     logger.info(f"为 data_source_id: {request.data_source_id} 创建了 ID 为 {analysis_result.id} 的分析记录。")
+    await _publish_analysis_status(db, analysis_result)
 
     try:
-        # 3. 使用 Playwright 访问目标URL，获取完整渲染后的HTML
-        logger.info(f"正在使用 Playwright 访问 URL: {data_source.url}")
-        async with async_playwright() as p:
-            browser = await p.chromium.launch()
-            page = await browser.new_page()
-            await page.goto(data_source.url, wait_until="networkidle")
-            html_content = await page.content()
-            await browser.close()
-        logger.info(f"成功获取 URL: {data_source.url} 的HTML内容。")
+        metric_labels = source_labels(data_source.id, None)
+        archived = None
+        if settings.PAGE_ARCHIVE_REUSE_SECONDS:
+            archived = await asyncio.to_thread(page_archive.latest, data_source.url, settings.PAGE_ARCHIVE_REUSE_SECONDS)
+            if archived and not await page_unchanged(data_source.url, archived):
+                archived = None
+
+        if archived:
+            # 3. 页面在 PAGE_ARCHIVE_REUSE_SECONDS 内渲染过且服务器确认未变化：直接使用存档，不启动浏览器
+            logger.info(f"URL: {data_source.url} 未变化，使用 {archived['fetched_at']:.0f} 时的页面存档。")
+            html_content, content_hash = archived["html"], archived["content_hash"]
+
+            # 4. 调用LLM进行分析
+            llm_output = await analyze_with_llm(request.theme_name, html_content)
+
+            # 5. 同一份页面内容上校验过的选择器直接复用结果，其余的在存档的HTML上校验
+            selectors = llm_selectors(llm_output)
+            evaluations = await asyncio.to_thread(
+                page_archive.get_selector_evaluations, content_hash, selector_evaluation_params(), selectors
+            )
+            missing = [selector for selector in selectors if selector not in evaluations]
+            if missing:
+                with observe_seconds(SELECTOR_EVALUATION_SECONDS, **metric_labels):
+                    evaluations.update(await evaluate_selectors_on_html(html_content, missing))
+        else:
+            # 3. 使用 Playwright 访问目标URL，获取完整渲染后的HTML并存档
+            logger.info(f"正在使用 Playwright 访问 URL: {data_source.url}")
+            async with async_playwright() as p:
+                browser = await p.chromium.launch()
+                try:
+                    with track_in_progress(BROWSER_POOL_SIZE), track_in_progress(IN_FLIGHT_PAGES):
+                        page = await browser.new_page()
+                        with observe_seconds(PAGE_NAVIGATION_SECONDS, **metric_labels):
+                            response = await page.goto(data_source.url, wait_until="networkidle")
+                        html_content = await page.content()
+                        logger.info(f"成功获取 URL: {data_source.url} 的HTML内容。")
+                        content_hash = await asyncio.to_thread(
+                            page_archive.put, data_source.url, html_content, "discovery", response.headers if response else None,
+                        )
 
-        # 4. 调用LLM进行分析
-        llm_output = await mock_llm_analyze(html_content)
+                        # 4. 调用LLM进行分析
+                        llm_output = await analyze_with_llm(request.theme_name, html_content)
 
-        # 5. 将LLM返回的原始JSON结果更新到记录中
+                        # 5. 在同一个已渲染的页面上批量校验LLM给出的选择器
+                        missing = llm_selectors(llm_output)
+                        with observe_seconds(SELECTOR_EVALUATION_SECONDS, **metric_labels):
+                            evaluations = await evaluate_selectors(page, missing)
+                finally:
+                    await browser.close()
+
+        if content_hash and missing:
+            await asyncio.to_thread(
+                page_archive.save_selector_evaluations, content_hash, selector_evaluation_params(),
+                {selector: evaluations[selector] for selector in missing if selector in evaluations},
+            )
+        llm_output = apply_selector_validation(llm_output, evaluations)
+
+        # 6. 将LLM返回的JSON结果（附带校验信息）更新到记录中
         analysis_result.raw_fields_json = llm_output
         analysis_result.status = "completed"
         logger.info(f"分析成功完成，ID: {analysis_result.id}")
 
+        # 7. 把本次结果累加到工作台统计中，与状态更新在同一个事务里提交。
+        # 使用保存点：统计更新失败不影响分析结果本身，之后可以通过重建接口修正统计。
+        try:
+            async with db.begin_nested():
+                await apply_workbench_increments(db, build_workbench_increments(request.theme_name, llm_output))
+        except Exception as e:
+            logger.warning(f"更新主题 '{request.theme_name}' 的工作台统计失败，请稍后重建统计: {e}")
+
     except Exception as e:
-        # 6. 如果过程中出现任何异常，记录错误信息并更新状态
+        # 8. 如果过程中出现任何异常，记录错误信息并更新状态
         error_msg = f"处理过程中发生错误: {str(e)}"
         logger.error(error_msg)
         analysis_result.status = "failed"
         analysis_result.error_message = error_msg
 
     finally:
-        # 7. 提交所有变更到数据库
-        db.commit()
+        # 9. 提交所有变更到数据库
+        await db.commit()
         logger.info(f"已提交对分析记录 ID: {analysis_result.id} 的最终状态更新。")
+        await _publish_analysis_status(db, analysis_result)
 
 
 # --- FastAPI 端点 ---
@@ -114,7 +339,7 @@ async def run_discovery_workflow(request: DiscoveryRequest, db: Session):
 async def discover(
     request: DiscoveryRequest,
     background_tasks: BackgroundTasks,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     接收一个数据源ID和主题名称，启动一个后台任务来分析该网站。
@@ -123,15 +348,22 @@ async def discover(
     - **后台处理**: 实际的分析（包括访问网站、调用LLM）在后台异步执行。
     """
     # 快速检查数据源是否存在，以便立即给用户反馈
-    data_source = db.query(DataSource).filter(DataSource.id == request.data_source_id).first()
+    data_source = await db.get(DataSource, request.data_source_id)
     if not data_source:
         raise HTTPException(status_code=404, detail=f"Data source with id {request.data_source_id} not found.")
 
-    # 将耗时的任务添加到后台
-    background_tasks.add_task(run_discovery_workflow, request, db)
+    # 将耗时的任务添加到后台（后台任务自行管理数据库会话）
+    background_tasks.add_task(run_discovery_workflow, request)
 
     return {"message": "Discovery process has been started in the background."}
 
+@app.on_event("shutdown")
+async def close_llm_client():
+    """服务关闭时释放LLM客户端的连接池和Redis连接。"""
+    if settings.LLM_BASE_URL:
+        await get_llm_client().aclose()
+    await close_async_redis()
+
 @app.get("/health", summary="健康检查", tags=["Monitoring"])
 def health_check():
     """
@@ -4,19 +4,37 @@ import pika
 from pika.exceptions import AMQPConnectionError
 import time
 from sqlalchemy import (
-    create_engine, Table, MetaData, inspect, Column, Integer, String, Text, JSON, orm
+    create_engine, Table, MetaData, inspect, Column, Integer, String, Text, JSON, DateTime, Date, Numeric, Boolean, Index, func, orm, text
 )
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import sessionmaker, Session
-from playwright.sync_api import sync_playwright
+from playwright.sync_api import Page, sync_playwright
 
 # 导入共享模块
 from shared.config import settings
-from shared.models.core_models import CrawlConfig, StandardDataset, StandardField
+from shared.coercion import CoercionError, coerce_value
+from shared.dataset_versions import bump_table_version
+from shared.events import EXTRACTION_STATUS, publish_event
+from shared.metrics import (
+    BROWSER_POOL_SIZE, COERCION_FAILURES_TOTAL, EXTRACTION_MESSAGES_TOTAL, IN_FLIGHT_PAGES, INSERT_SECONDS, PAGE_NAVIGATION_SECONDS,
+    QUEUE_WAIT_SECONDS, SELECTOR_EVALUATION_SECONDS, observe_seconds, source_labels, start_metrics_server,
+    track_in_progress,
+)
+from shared.page_archive import page_archive
+from shared.profiling import profiler
+from shared.tracing import TRACEPARENT_HEADER, tracer
+from shared.db.fulltext import add_search_indexes, index_name, search_vector_column
+from shared.db.partitions import PARTITION_KEY, ensure_partitions
+from shared.models.core_models import CrawlConfig, StandardDataset
+from services.extractor_svc.extraction_plan import extraction_plans
 
 # 配置日志
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+tracer.set_service("extractor")
+EXTRACTION_QUEUE = "extraction_queue"
+
 # --- 数据库设置 ---
 engine = create_engine(settings.DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
@@ -28,6 +46,11 @@ def get_sqlalchemy_type(type_string: str):
         "String": String,
         "Text": Text,
         "Integer": Integer,
+        "Numeric": Numeric(24, 6),
+        "Boolean": Boolean,
+        "Date": Date,
+        "DateTime": DateTime(timezone=True),
+        "JSON": JSON,
     }
     return mapping.get(type_string, String) # 默认为String
 
@@ -48,19 +71,48 @@ def create_dynamic_table_if_not_exists(dataset: StandardDataset) -> Table:
     logger.info(f"表 '{table_name}' 不存在，开始创建...")
 
     # 定义表结构
+    # 索引相关的附加结构只在 PostgreSQL 上创建
+    is_postgresql = engine.dialect.name == "postgresql"
     columns = [
         Column('id', Integer, primary_key=True, autoincrement=True),
-        Column('extra_data', JSON)
+        # PostgreSQL 上 extra_data 使用 JSONB 并建立 GIN 索引，使各数据源特有的字段也可以按键等值过滤
+        Column('extra_data', JSONB if is_postgresql else JSON),
+        # 数据的采集时间，用于按时间范围过滤和按时间分桶聚合。
+        # PostgreSQL 上表按该列分区，分区键必须包含在主键中，因此主键为 (id, extracted_at)
+        Column(
+            'extracted_at', DateTime(timezone=True), server_default=func.now(), nullable=False, index=True,
+            primary_key=is_postgresql,
+        ),
     ]
     for field in dataset.standard_fields:
         col_type = get_sqlalchemy_type(field.data_type)
         columns.append(Column(field.column_name, col_type, nullable=True))
 
-    dynamic_table = Table(table_name, metadata, *columns)
+    # Text 字段额外生成 tsvector 列并建立全文检索和子串匹配索引
+    text_columns = [f.column_name for f in dataset.standard_fields if f.data_type == "Text"]
+    if is_postgresql:
+        columns += [search_vector_column(column_name) for column_name in text_columns]
+
+    table_options = {"postgresql_partition_by": f"RANGE ({PARTITION_KEY})"} if is_postgresql else {}
+    dynamic_table = Table(table_name, metadata, *columns, **table_options)
+    if is_postgresql:
+        # 报告查询把键路径上的等值过滤编译为包含查询 (@>)，jsonb_path_ops 只支持 @>，但比默认的 jsonb_ops 更小、写入代价更低
+        Index(
+            index_name(table_name, "extra_data"), dynamic_table.c.extra_data,
+            postgresql_using="gin", postgresql_ops={"extra_data": "jsonb_path_ops"},
+        )
+        add_search_indexes(dynamic_table, text_columns)
 
     # 执行DDL创建表
     try:
+        if is_postgresql and text_columns:
+            with engine.begin() as conn:
+                conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
         metadata.create_all(engine)
+        if is_postgresql:
+            # 创建当前月及之后几个月的分区和默认分区，之后由 Celery 维护任务定期补充
+            with engine.begin() as conn:
+                ensure_partitions(conn, table_name)
         logger.info(f"成功创建表 '{table_name}'。")
         return dynamic_table
     except Exception as e:
@@ -68,47 +120,94 @@ def create_dynamic_table_if_not_exists(dataset: StandardDataset) -> Table:
         raise
 
 # --- 核心提取逻辑 ---
-def extract_data(db: Session, crawl_config: CrawlConfig):
-    """根据抓取配置，使用Playwright提取数据。"""
-    # ... (此函数内容保持不变) ...
-    logger.info(f"正在使用 Playwright 访问 URL: {crawl_config.data_source.url} (基于 config_id: {crawl_config.id})")
+def fetch_page(page: Page, url: str):
+    """在给定的 Playwright 页面中打开URL，等待网络空闲（JS渲染的内容已加载），返回主文档的响应。"""
+    return page.goto(url, wait_until="networkidle")
+
+def extract_from_page(page: Page, plan: dict) -> dict:
+    """按抓取计划从已加载的页面中读取各字段的文本。"""
     data = {}
+    for field in plan["fields"]:
+        try:
+            content = page.locator(field["selector"]).inner_text()
+            data[field["column_name"]] = content.strip()
+        except Exception:
+            logger.warning(f"未能使用选择器 '{field['selector']}' 提取字段 '{field['field_name']}'。")
+
+    extra_data = {}
+    for extra_field in plan["extra_fields"]:
+        try:
+            content = page.locator(extra_field["selector"]).inner_text()
+            extra_data[extra_field["field_name"]] = content.strip()
+        except Exception:
+            logger.warning(f"未能使用选择器 '{extra_field['selector']}' 提取特有字段 '{extra_field['field_name']}'。")
+
+    if extra_data:
+        data['extra_data'] = extra_data
+    return data
+
+def extract_data(crawl_config: CrawlConfig, from_archive: bool = False):
+    """
+    根据抓取配置，使用Playwright提取数据。访问页面后把渲染结果写入页面存档。
+    from_archive 为真时优先在存档的最新HTML上提取（禁用脚本，不访问网络），用于选择器变化后重新提取；
+    该URL没有存档时照常访问页面。
+    """
+    url = crawl_config.data_source.url
+    archived = page_archive.latest(url) if from_archive else None
+    logger.info(f"正在使用 Playwright {'读取存档的' if archived else '访问'} URL: {url} (基于 config_id: {crawl_config.id})")
+    metric_labels = source_labels(crawl_config.data_source_id, crawl_config.standard_dataset_id)
     with sync_playwright() as p:
         browser = p.chromium.launch()
-        page = browser.new_page()
-        page.goto(crawl_config.data_source.url, wait_until="networkidle")
-
-        selectors = crawl_config.field_selectors_json
-
-        for mapping in selectors.get("mappings", []):
-            field_id = mapping["standard_field_id"]
-            selector = mapping["selector"]
-            field_obj = db.query(StandardField).filter(StandardField.id == field_id).first()
-            if field_obj and selector:
-                try:
-                    content = page.locator(selector).inner_text()
-                    data[field_obj.column_name] = content.strip()
-                except Exception:
-                    logger.warning(f"未能使用选择器 '{selector}' 提取字段 '{field_obj.field_name}'。")
-
-        extra_data = {}
-        for extra_field in selectors.get("extra_fields", []):
-            field_name = extra_field["field_name"]
-            selector = extra_field["selector"]
-            if field_name and selector:
-                try:
-                    content = page.locator(selector).inner_text()
-                    extra_data[field_name] = content.strip()
-                except Exception:
-                    logger.warning(f"未能使用选择器 '{selector}' 提取特有字段 '{field_name}'。")
-
-        if extra_data:
-            data['extra_data'] = extra_data
-
-        browser.close()
+        try:
+            with track_in_progress(BROWSER_POOL_SIZE), track_in_progress(IN_FLIGHT_PAGES):
+                if archived:
+                    page = browser.new_page(java_script_enabled=False)
+                    with tracer.span("extractor.archive_load", url=url, content_hash=archived["content_hash"]):
+                        page.set_content(archived["html"])
+                else:
+                    page = browser.new_page()
+                    with tracer.span("extractor.navigation", url=url), observe_seconds(PAGE_NAVIGATION_SECONDS, **metric_labels):
+                        response = fetch_page(page, url)
+                    if page_archive.enabled:
+                        page_archive.put(url, page.content(), "extractor", response.headers if response else None)
+                with tracer.span("extractor.selectors"), observe_seconds(SELECTOR_EVALUATION_SECONDS, **metric_labels):
+                    data = extract_from_page(page, extraction_plans.get(crawl_config))
+        finally:
+            browser.close()
     logger.info(f"数据提取完成。提取到 {len(data)} 个字段。")
     return data
 
+# --- 类型转换 ---
+def coerce_extracted_data(crawl_config: CrawlConfig, data: dict) -> int:
+    """
+    按标准字段声明的数据类型，就地把提取到的原始文本转换为对应的Python值。
+    语言区域优先取字段映射中的 "locale"，否则使用 EXTRACTOR_DEFAULT_LOCALE。
+    无法解析的字段不写入对应列，原始文本保存在 extra_data["_coercion_errors"] 中，返回失败的字段数。
+    """
+    field_types = {f.column_name: f.data_type for f in crawl_config.standard_dataset.standard_fields}
+    field_locales = {
+        field["column_name"]: field["locale"]
+        for field in extraction_plans.get(crawl_config)["fields"]
+        if field["locale"]
+    }
+
+    errors = {}
+    for column_name, raw in list(data.items()):
+        data_type = field_types.get(column_name)
+        if data_type is None:
+            continue
+        try:
+            data[column_name] = coerce_value(raw, data_type, field_locales.get(column_name))
+        except CoercionError as e:
+            logger.warning(f"字段 '{column_name}' 的值 {raw!r} 无法转换为 {data_type}: {e}")
+            errors[column_name] = raw
+            del data[column_name]
+
+    if errors:
+        data.setdefault("extra_data", {})["_coercion_errors"] = errors
+        logger.warning(f"共有 {len(errors)} 个字段类型转换失败，原始值已保存在 extra_data 中。")
+    return len(errors)
+
 
 def save_data_to_dynamic_table(db: Session, dynamic_table: Table, data: dict):
     """将提取的数据保存到动态创建的数据表中。"""
@@ -122,6 +221,8 @@ def save_data_to_dynamic_table(db: Session, dynamic_table: Table, data: dict):
         stmt = dynamic_table.insert().values(**valid_data)
         db.execute(stmt)
         db.commit()
+        # 提交后递增表的版本号，使分析服务中该表的缓存结果失效
+        bump_table_version(dynamic_table.name)
         logger.info(f"成功将一条记录存入表 '{dynamic_table.name}'。")
     except Exception as e:
         db.rollback()
@@ -130,16 +231,40 @@ def save_data_to_dynamic_table(db: Session, dynamic_table: Table, data: dict):
 
 # --- RabbitMQ 消费者回调 ---
 def callback(ch, method, properties, body):
-    """处理从RabbitMQ接收到的消息。"""
+    """
+    处理从RabbitMQ接收到的消息。
+    编排器在消息属性的 headers 中附加了追踪上下文和发布时间，据此记录排队等待时间，
+    并把本条消息的处理过程记录在同一个 trace 下。
+    """
+    headers = getattr(properties, "headers", None) or {}
+    traceparent = headers.get(TRACEPARENT_HEADER)
+    wait_seconds = tracer.record_queue_wait(f"{EXTRACTION_QUEUE}.queue_wait", headers.get("published_at"), parent=traceparent)
+    if wait_seconds is not None:
+        QUEUE_WAIT_SECONDS.labels(queue=EXTRACTION_QUEUE).observe(wait_seconds)
+    with tracer.span("extractor.process_message", parent=traceparent):
+        # 开启性能剖析时每 N 条消息剖析一次，抓取配置ID和URL在 process_message 中补充
+        profiler.refresh()
+        if profiler.should_sample():
+            with profiler.profile("message", delivery_tag=getattr(method, "delivery_tag", None), trace_id=tracer.current_trace_id()):
+                process_message(ch, method, body)
+        else:
+            process_message(ch, method, body)
+
+def process_message(ch, method, body):
+    """提取一条抓取子任务的数据并写入动态表，完成后确认消息，失败时拒绝消息（不重新入队）。"""
     logger.info("接收到一条新消息...")
     db = SessionLocal()
     dynamic_table = None
+    progress = {}
+    # 配置加载之前无法确定数据源和数据集，指标标签记为 "unknown"
+    metric_labels = source_labels(None, None)
     try:
         payload = json.loads(body)
         config_id = payload.get("crawl_config_id")
         if not config_id:
             logger.error("消息格式错误，缺少 'crawl_config_id'。")
             ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
+            EXTRACTION_MESSAGES_TOTAL.labels(outcome="dead_lettered", **metric_labels).inc()
             return
 
         logger.info(f"正在处理 crawl_config_id: {config_id}")
@@ -152,25 +277,50 @@ def callback(ch, method, properties, body):
         if not crawl_config:
             logger.error(f"未找到 ID 为 {config_id} 的抓取配置。")
             ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
+            EXTRACTION_MESSAGES_TOTAL.labels(outcome="dead_lettered", **metric_labels).inc()
             return
 
+        metric_labels = source_labels(crawl_config.data_source_id, crawl_config.standard_dataset_id)
+        profiler.annotate(crawl_config_id=crawl_config.id, url=crawl_config.data_source.url)
+
+        # 进度事件的公共字段 (见 shared/events.py)
+        progress = {
+            "crawl_task_id": payload.get("crawl_task_id"),
+            "crawl_config_id": crawl_config.id,
+            "data_source_id": crawl_config.data_source_id,
+            "standard_dataset_id": crawl_config.standard_dataset_id,
+        }
+        publish_event(EXTRACTION_STATUS, status="running", **progress)
+
         # 1. 确保动态表和ORM模型存在 (关键步骤提前)
         dynamic_table = create_dynamic_table_if_not_exists(crawl_config.standard_dataset)
 
         # 2. 提取数据
-        extracted_data = extract_data(db, crawl_config)
+        extracted_data = extract_data(crawl_config, from_archive=bool(payload.get("from_archive")))
+
+        # 3. 按声明的数据类型转换字段值
+        coercion_failures = coerce_extracted_data(crawl_config, extracted_data) if extracted_data else 0
+        if coercion_failures:
+            COERCION_FAILURES_TOTAL.labels(**metric_labels).inc(coercion_failures)
 
-        # 3. 存储数据
+        # 4. 存储数据
         if extracted_data and dynamic_table is not None:
-            save_data_to_dynamic_table(db, dynamic_table, extracted_data)
+            with tracer.span("extractor.insert", table=dynamic_table.name), observe_seconds(INSERT_SECONDS, **metric_labels):
+                save_data_to_dynamic_table(db, dynamic_table, extracted_data)
 
-        # 4. 确认消息
+        # 5. 确认消息
         ch.basic_ack(delivery_tag=method.delivery_tag)
+        EXTRACTION_MESSAGES_TOTAL.labels(outcome="acked", **metric_labels).inc()
         logger.info(f"消息处理完成并已确认。")
+        publish_event(EXTRACTION_STATUS, status="completed", fields_extracted=len(extracted_data),
+                      coercion_failures=coercion_failures, **progress)
 
     except Exception as e:
         logger.error(f"处理消息时发生未知错误: {e}")
         ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
+        EXTRACTION_MESSAGES_TOTAL.labels(outcome="dead_lettered", **metric_labels).inc()
+        if progress:
+            publish_event(EXTRACTION_STATUS, status="failed", error_message=str(e), **progress)
     finally:
         db.close()
 
@@ -178,13 +328,14 @@ def callback(ch, method, properties, body):
 def main():
     """主函数，设置并启动RabbitMQ消费者。"""
     # ... (此函数内容保持不变) ...
+    start_metrics_server(settings.EXTRACTOR_METRICS_PORT)
     while True:
         try:
             logger.info("正在连接到 RabbitMQ...")
             connection = pika.BlockingConnection(pika.URLParameters(settings.RABBITMQ_URL))
             channel = connection.channel()
 
-            queue_name = "extraction_queue"
+            queue_name = EXTRACTION_QUEUE
             channel.queue_declare(queue=queue_name, durable=True)
             channel.basic_qos(prefetch_count=1)
             channel.basic_consume(queue=queue_name, on_message_callback=callback)
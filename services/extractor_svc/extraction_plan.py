@@ -0,0 +1,76 @@
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Tuple
+
+# 导入共享模块
+from shared.models.core_models import CrawlConfig
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 缓存的抓取计划数量上限
+MAX_PLANS = 1024
+
+def compile_extraction_plan(crawl_config: CrawlConfig) -> Dict[str, Any]:
+    """
+    把抓取配置编译为提取时直接使用的计划：把映射中的 standard_field_id 解析为列名、字段名和数据类型，
+    丢弃引用了不存在字段或没有选择器的映射。crawl_config 需已预加载 standard_dataset.standard_fields。
+    """
+    fields_by_id = {f.id: f for f in crawl_config.standard_dataset.standard_fields}
+    selectors = crawl_config.field_selectors_json or {}
+
+    fields = []
+    for mapping in selectors.get("mappings", []):
+        field_obj = fields_by_id.get(mapping.get("standard_field_id"))
+        if field_obj and mapping.get("selector"):
+            fields.append({
+                "column_name": field_obj.column_name,
+                "field_name": field_obj.field_name,
+                "data_type": field_obj.data_type,
+                "selector": mapping["selector"],
+                "locale": mapping.get("locale"),
+            })
+
+    extra_fields = [
+        {"field_name": extra["field_name"], "selector": extra["selector"]}
+        for extra in selectors.get("extra_fields", [])
+        if extra.get("field_name") and extra.get("selector")
+    ]
+    return {"fields": fields, "extra_fields": extra_fields}
+
+
+class ExtractionPlanCache:
+    """
+    抓取计划的进程内缓存，键为 (数据源ID, 标准数据集ID)，条目记录编译时的配置ID和版本号。
+
+    每次标准化都会停用旧配置并写入版本号递增的新配置，因此缓存以版本号判断是否过期：
+    取到的配置与缓存条目的 (配置ID, 版本号) 不一致时重新编译并替换旧条目，不需要跨进程通知。
+    """
+
+    def __init__(self, max_plans: int = MAX_PLANS):
+        self.max_plans = max_plans
+        self._plans: "OrderedDict[Tuple[int, int], Tuple[int, int, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, crawl_config: CrawlConfig) -> Dict[str, Any]:
+        key = (crawl_config.data_source_id, crawl_config.standard_dataset_id)
+        with self._lock:
+            entry = self._plans.get(key)
+            if entry is not None and entry[:2] == (crawl_config.id, crawl_config.version):
+                self._plans.move_to_end(key)
+                return entry[2]
+
+        plan = compile_extraction_plan(crawl_config)
+        with self._lock:
+            if entry is not None:
+                logger.info(f"数据源 {key[0]} 的抓取配置已更新为版本 {crawl_config.version}，重新编译抓取计划。")
+            self._plans[key] = (crawl_config.id, crawl_config.version, plan)
+            self._plans.move_to_end(key)
+            while len(self._plans) > self.max_plans:
+                self._plans.popitem(last=False)
+        return plan
+
+
+# 进程级的共享实例
+extraction_plans = ExtractionPlanCache()
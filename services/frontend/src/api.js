@@ -59,8 +59,50 @@ export const standardizeTheme = (payload) => {
   return apiClient.post('/themes/standardize', payload);
 };
 
-export const getAnalysisStatus = (themeName) => {
-  return apiClient.get('/themes/analysis_status', { params: { theme_name: themeName } });
+export const getAnalysisStatus = (themeName, since = null) => {
+  const params = { theme_name: themeName };
+  if (since) {
+    params.since = since;
+  }
+  return apiClient.get('/themes/analysis_status', { params });
+};
+
+
+// --- Server-Sent Events ---
+
+// Subscribe to status events pushed by the BFF. `handlers` maps event types
+// (analysis_status, crawl_task_status, extraction_status, resync) to callbacks;
+// `onConnectionChange(connected)` lets callers fall back to polling while disconnected.
+// Returns the EventSource; call close() on it to unsubscribe.
+export const subscribeEvents = (params, handlers, onConnectionChange = () => {}) => {
+  const query = new URLSearchParams(params).toString();
+  const source = new EventSource(`${apiClient.defaults.baseURL}/events/stream${query ? `?${query}` : ''}`);
+  Object.entries(handlers).forEach(([type, handler]) => {
+    source.addEventListener(type, (message) => handler(JSON.parse(message.data)));
+  });
+  source.onopen = () => onConnectionChange(true);
+  // EventSource reconnects on its own; report the gap so callers can poll meanwhile
+  source.onerror = () => onConnectionChange(false);
+  return source;
+};
+
+
+// --- Pagination ---
+
+// Largest page the BFF list endpoints accept (MAX_PAGE_SIZE in services/bff/pagination.py)
+const MAX_PAGE_SIZE = 500;
+
+// Follow the X-Next-Cursor header of a paginated list endpoint until the last page.
+// Resolves to { data } with every row, so callers can use it like a single response.
+const fetchAllPages = async (listPage, params = {}) => {
+  const rows = [];
+  let cursor = null;
+  do {
+    const response = await listPage({ ...params, limit: MAX_PAGE_SIZE, ...(cursor ? { cursor } : {}) });
+    rows.push(...response.data);
+    cursor = response.headers['x-next-cursor'];
+  } while (cursor);
+  return { data: rows };
 };
 
 
@@ -70,23 +112,42 @@ export const createCrawlTask = (taskData) => {
   return apiClient.post('/crawl-tasks/', taskData);
 };
 
-export const listCrawlTasks = () => {
-  return apiClient.get('/crawl-tasks/');
+// List endpoints accept { cursor, limit, name, status }; the next page's cursor is in the X-Next-Cursor header
+export const listCrawlTasks = (params = {}) => {
+  return apiClient.get('/crawl-tasks/', { params });
 };
 
-export const executeCrawlTask = (taskId) => {
-  return apiClient.post(`/crawl-tasks/${taskId}/execute`);
+export const listAllCrawlTasks = (params = {}) => fetchAllPages(listCrawlTasks, params);
+
+// fromArchive: re-extract from the archived pages (e.g. after re-standardizing) instead of re-crawling the sites
+export const executeCrawlTask = (taskId, fromArchive = false) => {
+  return apiClient.post(`/crawl-tasks/${taskId}/execute`, null, { params: fromArchive ? { from_archive: true } : {} });
 };
 
-export const listStandardDatasets = () => {
-  return apiClient.get('/themes/'); // The endpoint is on the themes router
+export const listStandardDatasets = (params = {}) => {
+  return apiClient.get('/themes/', { params }); // The endpoint is on the themes router
 };
 
+export const listAllStandardDatasets = (params = {}) => fetchAllPages(listStandardDatasets, params);
+
 
 // --- Data Source Management API Calls ---
 
-export const listDataSources = () => {
-  return apiClient.get('/data-sources/');
+export const listDataSources = (params = {}) => {
+  return apiClient.get('/data-sources/', { params });
+};
+
+export const listAllDataSources = (params = {}) => fetchAllPages(listDataSources, params);
+
+// Bulk import from a CSV (site_key,name,url,description) or NDJSON File/Blob.
+// Pass themeName to trigger discovery for the newly created sources.
+export const importDataSources = (file, themeName = null) => {
+  const isCsv = file.name ? file.name.toLowerCase().endsWith('.csv') : file.type === 'text/csv';
+  const params = themeName ? { theme_name: themeName } : {};
+  return apiClient.post('/data-sources/import', file, {
+    params,
+    headers: { 'Content-Type': isCsv ? 'text/csv' : 'application/x-ndjson' },
+  });
 };
 
 export const createDataSource = (dataSourceData) => {
@@ -1,5 +1,6 @@
 # 导入Celery类
 from celery import Celery
+from celery.schedules import crontab
 # 导入我们的共享配置
 from shared.config import settings
 
@@ -20,6 +21,14 @@ celery_app = Celery(
 celery_app.conf.update(
     timezone='Asia/Shanghai',
     enable_utc=True,
+    # 周期性任务 (需要启动 Celery Beat)
+    beat_schedule={
+        # 每天凌晨维护动态表的分区：提前创建分区并删除过期分区
+        "maintain-partitions": {
+            "task": "orchestrator.maintain_partitions",
+            "schedule": crontab(hour=3, minute=0),
+        },
+    },
 )
 
 # 这是一个好习惯，定义一个可以被其他模块导入的 app 变量
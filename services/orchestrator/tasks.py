@@ -1,19 +1,34 @@
 import json
 import logging
+import time
 import pika
 import requests
 from celery.exceptions import MaxRetriesExceededError
 
 # 导入共享模块和Celery应用实例
 from shared.config import settings
-from shared.db.session import SessionLocal
-from shared.models.core_models import CrawlTask, CrawlConfig
+from shared.dataset_versions import bump_table_version
+from shared.db.partitions import drop_expired_partitions, ensure_partitions, is_partitioned
+from shared.db.session import SessionLocal, engine
+from shared.metrics import QUEUE_WAIT_SECONDS
+from shared.tracing import TRACEPARENT_HEADER, tracer
+from shared.models.core_models import CrawlTask, CrawlConfig, StandardDataset
 from .celery_app import app
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+tracer.set_service("orchestrator")
+
+def _start_task_trace(task, queue_name: str = "celery"):
+    """取出 task_publisher 附加在消息头中的追踪上下文，记录任务在 Celery 队列中的等待时间，返回 traceparent。"""
+    traceparent = getattr(task.request, TRACEPARENT_HEADER, None)
+    wait_seconds = tracer.record_queue_wait(f"{queue_name}.queue_wait", getattr(task.request, "sent_at", None), parent=traceparent, task=task.name)
+    if wait_seconds is not None:
+        QUEUE_WAIT_SECONDS.labels(queue=queue_name).observe(wait_seconds)
+    return traceparent
+
 
 @app.task(bind=True, name="orchestrator.trigger_site_analysis", max_retries=3, default_retry_delay=60)
 def trigger_site_analysis(self, data_source_id: int, theme_name: str):
@@ -27,7 +42,9 @@ def trigger_site_analysis(self, data_source_id: int, theme_name: str):
     payload = {"data_source_id": data_source_id, "theme_name": theme_name}
 
     try:
-        response = requests.post(discovery_url, json=payload, timeout=10)
+        with tracer.span(self.name, parent=_start_task_trace(self), data_source_id=data_source_id):
+            # 追踪上下文随请求头传给 Discovery Service
+            response = requests.post(discovery_url, json=payload, headers=tracer.inject(), timeout=10)
         response.raise_for_status()  # 如果响应状态码不是2xx，则抛出HTTPError
         logger.info(f"成功调用Discovery Service: {response.json()}")
         return response.json()
@@ -40,12 +57,18 @@ def trigger_site_analysis(self, data_source_id: int, theme_name: str):
             logger.critical(f"已达到最大重试次数，放弃对 data_source_id: {data_source_id} 的分析任务。")
 
 
-@app.task(name="orchestrator.execute_crawl_task")
-def execute_crawl_task(crawl_task_id: int):
+@app.task(bind=True, name="orchestrator.execute_crawl_task")
+def execute_crawl_task(self, crawl_task_id: int, from_archive: bool = False):
     """
     一个Celery任务，用于执行一个抓取任务(Crawl Task)。
     它会为任务中定义的每个数据源查找有效的抓取配置，并将子任务分发到RabbitMQ队列。
+    from_archive 为真时，提取器优先在页面存档上重新提取，而不是重新访问站点。
     """
+    with tracer.span(self.name, parent=_start_task_trace(self), crawl_task_id=crawl_task_id):
+        dispatch_crawl_task(crawl_task_id, from_archive)
+
+def dispatch_crawl_task(crawl_task_id: int, from_archive: bool = False):
+    """把抓取任务中每个数据源的有效抓取配置作为子任务发布到 extraction_queue。"""
     logger.info(f"开始执行抓取任务，ID: {crawl_task_id}")
     db = SessionLocal()
     try:
@@ -74,7 +97,11 @@ def execute_crawl_task(crawl_task_id: int):
 
             if crawl_config:
                 # 4. 如果找到有效配置，将包含config_id的消息发布到队列
-                message_body = json.dumps({"crawl_config_id": crawl_config.id})
+                # crawl_task_id 用于提取器发布的进度事件
+                message = {"crawl_config_id": crawl_config.id, "crawl_task_id": crawl_task.id}
+                if from_archive:
+                    message["from_archive"] = True
+                message_body = json.dumps(message)
 
                 channel.basic_publish(
                     exchange='',
@@ -82,6 +109,9 @@ def execute_crawl_task(crawl_task_id: int):
                     body=message_body,
                     properties=pika.BasicProperties(
                         delivery_mode=2,  # 使消息持久化
+                        timestamp=int(time.time()),
+                        # 追踪上下文和精确到微秒的发布时间，提取器据此关联 trace 并计算排队等待时间
+                        headers={**tracer.inject(), "published_at": time.time()},
                     )
                 )
                 logger.info(f"已将 crawl_config_id: {crawl_config.id} 的抓取子任务发送到队列 '{extraction_queue}'。")
@@ -96,3 +126,39 @@ def execute_crawl_task(crawl_task_id: int):
     finally:
         # 确保数据库会话被关闭
         db.close()
+
+
+@app.task(name="orchestrator.maintain_partitions")
+def maintain_partitions():
+    """
+    一个周期性的Celery任务，维护所有动态表的月度分区：
+    提前创建未来几个月的分区，并按数据集的 retention_days 删除过期的分区。
+    每张表在各自的事务中处理，一张表失败不影响其他表。
+    """
+    db = SessionLocal()
+    try:
+        datasets = db.query(StandardDataset.table_name, StandardDataset.retention_days).all()
+    finally:
+        db.close()
+
+    summary = {}
+    for table_name, retention_days in datasets:
+        try:
+            with engine.begin() as conn:
+                if not is_partitioned(conn, table_name):
+                    continue
+                created = ensure_partitions(conn, table_name)
+                dropped = []
+                if retention_days is not None and retention_days < 1:
+                    # 无效的保留天数会删除当前的数据，只新建分区，不做清理
+                    logger.error(f"表 '{table_name}' 的 retention_days={retention_days} 无效，跳过过期分区的清理。")
+                elif retention_days:
+                    dropped = drop_expired_partitions(conn, table_name, retention_days)
+            if dropped:
+                # 数据被删除后，使分析服务中该表的缓存结果失效
+                bump_table_version(table_name)
+            summary[table_name] = {"created": created, "dropped": dropped}
+        except Exception as e:
+            logger.error(f"维护表 '{table_name}' 的分区时失败: {e}")
+    logger.info(f"分区维护完成: {summary}")
+    return summary
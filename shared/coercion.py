@@ -0,0 +1,268 @@
+"""
+将网页中提取到的原始文本解析为标准字段声明的数据类型。
+
+网页上的数字和日期通常带有千分位、货币符号、中文单位或本地化的日期格式，
+例如 "1,234"、"¥1.2万"、"2024年5月1日"、"3小时前"。
+这些值如果原样以字符串存储，范围过滤和索引都会失效或给出错误的结果。
+"""
+import json
+import re
+import unicodedata
+from datetime import date, datetime, timedelta
+from decimal import Decimal, InvalidOperation
+from typing import Any, Callable, Dict, Optional
+from zoneinfo import ZoneInfo
+
+# 导入共享配置
+from shared.config import settings
+
+
+class CoercionError(ValueError):
+    """原始文本无法解析为目标类型。"""
+
+
+# --- 数字 ---
+# 各语言区域的 (千分位分隔符, 小数点)。未列出的区域按英文习惯处理。
+_NUMBER_SEPARATORS = {
+    "en": (",", "."),
+    "zh": (",", "."),
+    "ja": (",", "."),
+    "ko": (",", "."),
+    "de": (".", ","),
+    "es": (".", ","),
+    "it": (".", ","),
+    "nl": (".", ","),
+    "pt": (".", ","),
+    "id": (".", ","),
+    "tr": (".", ","),
+    "fr": (" ", ","),
+    "ru": (" ", ","),
+    "pl": (" ", ","),
+    "sv": (" ", ","),
+    "cs": (" ", ","),
+    "de_CH": ("'", "."),
+}
+
+# 常见的数量单位
+_NUMBER_UNITS = {
+    "万": Decimal(10_000),
+    "萬": Decimal(10_000),
+    "亿": Decimal(100_000_000),
+    "億": Decimal(100_000_000),
+    "千": Decimal(1_000),
+    "k": Decimal(1_000),
+    "K": Decimal(1_000),
+    "m": Decimal(1_000_000),
+    "M": Decimal(1_000_000),
+    "b": Decimal(1_000_000_000),
+    "B": Decimal(1_000_000_000),
+}
+
+# 百分号和千分号，值按比例换算 ("12%" -> 0.12)
+_PERCENT_SIGNS = {
+    "%": Decimal(100),
+    "‰": Decimal(1_000),
+}
+
+_NUMBER_PATTERN = re.compile(r"[-+]?(?:\d[\d.,' ]*|[.,]\d+)")
+
+def _separators_for(locale: str):
+    if locale in _NUMBER_SEPARATORS:
+        return _NUMBER_SEPARATORS[locale]
+    return _NUMBER_SEPARATORS.get(locale.split("_")[0].split("-")[0].lower(), _NUMBER_SEPARATORS["en"])
+
+def _number_format(thousands: str, decimal_point: str):
+    """
+    该区域下合法数字的正则：不分组的整数，或首组 1-3 位、之后每组恰好 3 位的分组整数，
+    最多一个位于所有分组之后的小数点。除区域的千分位分隔符外也接受空格分组，但同一个数字只能使用一种分隔符。
+    """
+    decimal_part = rf"(?:{re.escape(decimal_point)}\d+)?"
+    grouped = "|".join(rf"\d{{1,3}}(?:{re.escape(separator)}\d{{3}})+" for separator in {thousands, " "})
+    return re.compile(rf"(?:\d+|{grouped}){decimal_part}|{re.escape(decimal_point)}\d+")
+
+def _normalize(raw: str) -> str:
+    # NFKC 会把全角数字和符号（如 "１２３"、"，"）转换为半角，并把不换行空格等转换为普通空格
+    return unicodedata.normalize("NFKC", raw).strip()
+
+def parse_numeric(raw: str, locale: Optional[str] = None) -> Decimal:
+    """
+    按语言区域解析数字，支持千分位、货币符号、百分号、括号表示的负数以及 "万/亿/K/M" 等单位。
+    例如 "1,234.5"、"1.234,5"（de）、"¥1.2万"、"(300)"、"12%"（0.12）。
+    分组不符合该区域格式的值（如 en 下的 "1,5"、"1.234,5"）无法确定含义，抛出 CoercionError 而不是猜测。
+    """
+    locale = locale or settings.EXTRACTOR_DEFAULT_LOCALE
+    text = _normalize(raw)
+    if not text:
+        raise CoercionError("empty value")
+
+    negative = text.startswith("(") and text.endswith(")")
+    match = _NUMBER_PATTERN.search(text)
+    if not match:
+        raise CoercionError(f"no number found in {raw!r}")
+
+    # 数字后紧跟的标点 (如 "共 12 件。"、"1,234, 另加") 不属于数字
+    number = match.group().rstrip(".,' ")
+    suffix = text[match.start() + len(number):].strip()
+    sign = ""
+    if number[0] in "+-":
+        sign, number = number[0], number[1:]
+
+    thousands, decimal_point = _separators_for(locale)
+    if not _number_format(thousands, decimal_point).fullmatch(number):
+        raise CoercionError(f"{raw!r} does not match the number format of locale '{locale}'")
+    number = number.replace(thousands, "").replace(" ", "").replace(decimal_point, ".")
+
+    try:
+        value = Decimal(sign + number)
+    except InvalidOperation:
+        raise CoercionError(f"invalid number {raw!r}")
+
+    # 中文单位可以后接量词（如 "1.2万元"），字母单位必须单独出现（避免把 "5 m²" 当成百万）
+    unit = suffix[:1]
+    if unit in _PERCENT_SIGNS:
+        value /= _PERCENT_SIGNS[unit]
+    elif unit in _NUMBER_UNITS and (not unit.isascii() or len(suffix) == 1):
+        value *= _NUMBER_UNITS[unit]
+    return -value if negative else value
+
+def parse_integer(raw: str, locale: Optional[str] = None) -> int:
+    """解析整数。带单位的值（如 "1.5万"）换算后必须是整数。"""
+    value = parse_numeric(raw, locale)
+    if value != value.to_integral_value():
+        raise CoercionError(f"{raw!r} is not an integer")
+    return int(value)
+
+# --- 布尔 ---
+_TRUE_VALUES = {"true", "yes", "y", "1", "on", "是", "有", "对", "✓", "✔"}
+_FALSE_VALUES = {"false", "no", "n", "0", "off", "否", "无", "沒有", "没有", "不", "✗", "✘"}
+
+def parse_boolean(raw: str, locale: Optional[str] = None) -> bool:
+    text = _normalize(raw).lower()
+    if text in _TRUE_VALUES:
+        return True
+    if text in _FALSE_VALUES:
+        return False
+    raise CoercionError(f"invalid boolean {raw!r}")
+
+# --- 日期与时间 ---
+_CJK_DATE_PATTERN = re.compile(
+    r"(?:(\d{2,4})\s*[年])?\s*(\d{1,2})\s*[月]\s*(\d{1,2})\s*[日号]?"
+    r"(?:\s*(\d{1,2})\s*[:时點点]\s*(\d{1,2})?\s*分?(?:\s*:?\s*(\d{1,2})\s*秒?)?)?"
+)
+_ISO_DATE_PATTERN = re.compile(
+    r"(\d{4})[-/.](\d{1,2})[-/.](\d{1,2})"
+    r"(?:[T\s]+(\d{1,2}):(\d{2})(?::(\d{2})(?:\.\d+)?)?\s*(Z|[+-]\d{2}:?\d{2})?)?"
+)
+_NUMERIC_DATE_PATTERN = re.compile(
+    r"(\d{1,2})[-/.](\d{1,2})[-/.](\d{2,4})(?:[T\s]+(\d{1,2}):(\d{2})(?::(\d{2}))?)?"
+)
+_RELATIVE_PATTERN = re.compile(r"(\d+)\s*(秒|分钟|分鐘|小时|小時|天|周|週|个月|個月|年)前")
+_RELATIVE_UNITS = {
+    "秒": timedelta(seconds=1),
+    "分钟": timedelta(minutes=1),
+    "分鐘": timedelta(minutes=1),
+    "小时": timedelta(hours=1),
+    "小時": timedelta(hours=1),
+    "天": timedelta(days=1),
+    "周": timedelta(weeks=1),
+    "週": timedelta(weeks=1),
+    "个月": timedelta(days=30),
+    "個月": timedelta(days=30),
+    "年": timedelta(days=365),
+}
+_RELATIVE_DAYS = {"今天": 0, "今日": 0, "昨天": 1, "昨日": 1, "前天": 2, "today": 0, "yesterday": 1}
+_ENGLISH_FORMATS = ("%B %d, %Y", "%b %d, %Y", "%d %B %Y", "%d %b %Y", "%B %d %Y", "%b %d %Y")
+
+def _timezone() -> ZoneInfo:
+    return ZoneInfo(settings.EXTRACTOR_DEFAULT_TIMEZONE)
+
+def _full_year(year: int) -> int:
+    return year + 2000 if year < 100 else year
+
+def parse_datetime(raw: str, locale: Optional[str] = None, now: Optional[datetime] = None) -> datetime:
+    """
+    解析日期时间，返回带时区的 datetime。
+    支持 ISO 格式、"2024年5月1日 10:30"、按区域解析的 "05/01/2024"、英文月份名称，
+    以及 "今天 08:00"、"昨天"、"3小时前" 等相对时间。不带时区的值按 EXTRACTOR_DEFAULT_TIMEZONE 处理。
+    """
+    locale = locale or settings.EXTRACTOR_DEFAULT_LOCALE
+    tz = _timezone()
+    now = now or datetime.now(tz)
+    text = _normalize(raw)
+    if not text:
+        raise CoercionError("empty value")
+
+    relative = _RELATIVE_PATTERN.search(text)
+    if relative:
+        return now - int(relative.group(1)) * _RELATIVE_UNITS[relative.group(2)]
+
+    for word, days_ago in _RELATIVE_DAYS.items():
+        if text.lower().startswith(word):
+            day = (now - timedelta(days=days_ago)).date()
+            time_match = re.search(r"(\d{1,2}):(\d{2})", text)
+            hour, minute = (int(time_match.group(1)), int(time_match.group(2))) if time_match else (0, 0)
+            return datetime(day.year, day.month, day.day, hour, minute, tzinfo=tz)
+
+    try:
+        match = _ISO_DATE_PATTERN.search(text)
+        if match:
+            year, month, day, hour, minute, second, offset = match.groups()
+            value = datetime(int(year), int(month), int(day), int(hour or 0), int(minute or 0), int(second or 0))
+            if offset:
+                return datetime.fromisoformat(value.isoformat() + offset)
+            return value.replace(tzinfo=tz)
+
+        match = _CJK_DATE_PATTERN.search(text)
+        if match:
+            year, month, day, hour, minute, second = match.groups()
+            year = _full_year(int(year)) if year else now.year
+            return datetime(year, int(month), int(day), int(hour or 0), int(minute or 0), int(second or 0), tzinfo=tz)
+
+        match = _NUMERIC_DATE_PATTERN.search(text)
+        if match:
+            first, second_part, year, hour, minute, second = match.groups()
+            # 美式区域为 月/日/年，其余区域为 日/月/年
+            if locale.replace("-", "_") in ("en_US", "en_PH"):
+                month, day = first, second_part
+            else:
+                day, month = first, second_part
+            return datetime(_full_year(int(year)), int(month), int(day), int(hour or 0), int(minute or 0), int(second or 0), tzinfo=tz)
+    except ValueError as e:
+        raise CoercionError(f"invalid date {raw!r}: {e}")
+
+    for fmt in _ENGLISH_FORMATS:
+        try:
+            return datetime.strptime(text, fmt).replace(tzinfo=tz)
+        except ValueError:
+            continue
+    raise CoercionError(f"unrecognized date {raw!r}")
+
+def parse_date(raw: str, locale: Optional[str] = None) -> date:
+    return parse_datetime(raw, locale).date()
+
+# --- JSON ---
+def parse_json(raw: str, locale: Optional[str] = None) -> Any:
+    try:
+        return json.loads(raw)
+    except json.JSONDecodeError as e:
+        raise CoercionError(f"invalid JSON: {e}")
+
+# --- 入口 ---
+COERCERS: Dict[str, Callable[..., Any]] = {
+    "Integer": parse_integer,
+    "Numeric": parse_numeric,
+    "Boolean": parse_boolean,
+    "Date": parse_date,
+    "DateTime": parse_datetime,
+    "JSON": parse_json,
+}
+
+def coerce_value(raw: Any, data_type: str, locale: Optional[str] = None) -> Any:
+    """
+    将原始值转换为 data_type 对应的Python类型。
+    String/Text 及未知类型原样返回；非字符串的值（例如已经是数字）视为已转换。
+    """
+    coercer = COERCERS.get(data_type)
+    if coercer is None or raw is None or not isinstance(raw, str):
+        return raw
+    return coercer(raw, locale)
@@ -0,0 +1,34 @@
+"""
+动态表的数据版本号。
+
+每次向动态表写入数据后，写入方把该表的版本号加一；读取方把版本号作为缓存键的一部分，
+这样表没有变化时可以一直复用缓存结果，表一旦变化，旧版本的缓存自然不再被命中。
+"""
+import logging
+from typing import Optional
+
+import redis
+
+from shared.redis_client import get_async_redis, get_redis
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+def table_version_key(table_name: str) -> str:
+    return f"intelliscrape:table_version:{table_name}"
+
+def bump_table_version(table_name: str) -> Optional[int]:
+    """
+    （同步）递增表的版本号，在写入事务提交之后调用。
+    Redis 不可用时只记录日志：读取方在这种情况下本来就无法获取版本号，会退化为短时间的本地缓存。
+    """
+    try:
+        return get_redis().incr(table_version_key(table_name))
+    except redis.RedisError as e:
+        logger.warning(f"递增表 '{table_name}' 的版本号失败: {e}")
+        return None
+
+async def get_table_version(table_name: str) -> int:
+    """（异步）读取表的版本号，从未写入过的表版本号为 0。Redis 出错时抛出 redis.RedisError。"""
+    value = await get_async_redis().get(table_version_key(table_name))
+    return int(value) if value is not None else 0
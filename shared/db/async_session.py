@@ -0,0 +1,39 @@
+# 导入SQLAlchemy的异步组件
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+# 从我们共享的配置模块中导入全局的settings实例
+from shared.config import settings
+
+# 创建异步数据库引擎
+# FastAPI服务的请求处理函数都是 async def，如果在其中使用同步的Session，
+# 每一次查询都会阻塞事件循环，一个慢查询就会拖慢该进程上的所有请求。
+# 异步引擎基于 asyncpg 驱动，查询等待期间事件循环可以继续处理其他请求。
+# 连接池大小需要显式配置：每个服务进程最多持有 pool_size + max_overflow 个连接，
+# 部署时应确保 (进程数 x 该值) 不超过PostgreSQL的 max_connections。
+async_engine = create_async_engine(
+    settings.ASYNC_DATABASE_URL,
+    pool_size=settings.DB_POOL_SIZE,
+    max_overflow=settings.DB_MAX_OVERFLOW,
+    pool_timeout=settings.DB_POOL_TIMEOUT,
+    pool_recycle=settings.DB_POOL_RECYCLE,
+    pool_pre_ping=True,
+)
+
+# 创建异步会话工厂
+# expire_on_commit=False 表示提交后不让ORM对象过期，
+# 否则在提交后访问对象属性会触发隐式的懒加载IO，这在异步环境中是不允许的。
+AsyncSessionLocal = async_sessionmaker(
+    bind=async_engine,
+    class_=AsyncSession,
+    autoflush=False,
+    expire_on_commit=False,
+)
+
+async def get_async_db():
+    """
+    一个FastAPI依赖项，用于为每个请求提供一个异步数据库会话。
+    会话在请求结束后自动关闭，因此不能被传递给在响应之后才运行的后台任务；
+    后台任务应使用 AsyncSessionLocal 自行创建并管理会话。
+    """
+    async with AsyncSessionLocal() as db:
+        yield db
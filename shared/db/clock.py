@@ -0,0 +1,24 @@
+"""
+按数据库方言取“当前时间”：PostgreSQL 上为 clock_timestamp()，其他数据库上为 CURRENT_TIMESTAMP。
+
+PostgreSQL 的 now() / CURRENT_TIMESTAMP 是事务开始的时间，同一事务中的所有写入都得到相同的值；
+作为增量轮询游标的 updated_at 需要的是实际写入的时间，否则在长事务中更新的记录会带着很早的时间戳出现，
+被已经越过该时间的轮询方漏掉。
+"""
+from sqlalchemy import DateTime
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.functions import FunctionElement
+
+
+class clock_now(FunctionElement):
+    type = DateTime(timezone=True)
+    inherit_cache = True
+    name = "clock_now"
+
+@compiles(clock_now)
+def _compile_clock_now(element, compiler, **kw):
+    return "CURRENT_TIMESTAMP"
+
+@compiles(clock_now, "postgresql")
+def _compile_clock_now_postgresql(element, compiler, **kw):
+    return "clock_timestamp()"
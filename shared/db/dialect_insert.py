@@ -0,0 +1,18 @@
+"""
+按数据库方言选择支持 ON CONFLICT 的 INSERT 构造函数。
+
+PostgreSQL 和 SQLite 的 insert() 都提供 on_conflict_do_update / on_conflict_do_nothing，
+生产环境使用 PostgreSQL，SQLite 用于本地开发和基准测试。
+"""
+from sqlalchemy.dialects import postgresql, sqlite
+
+_INSERT_BUILDERS = {
+    "postgresql": postgresql.insert,
+    "sqlite": sqlite.insert,
+}
+
+def dialect_insert(dialect_name: str):
+    insert_builder = _INSERT_BUILDERS.get(dialect_name)
+    if insert_builder is None:
+        raise NotImplementedError(f"INSERT ... ON CONFLICT is not supported on dialect '{dialect_name}'.")
+    return insert_builder
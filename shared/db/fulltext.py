@@ -0,0 +1,64 @@
+"""
+动态表的全文检索与子串匹配索引。
+
+Text 类型的标准字段在建表时会额外生成一个 tsvector 生成列（"<列名>_tsv"）并建立 GIN 索引，
+报告接口的 search 操作符基于它执行全文检索；同时为 Text 字段建立 pg_trgm 的 GIN 索引，
+使 like 操作符的 '%value%' 子串匹配也能走索引，而不必扫描整列大文本。
+这些对象只在 PostgreSQL 上创建。
+"""
+import hashlib
+import re
+from typing import List
+
+from sqlalchemy import Column, Computed, Index, Table
+from sqlalchemy.dialects.postgresql import TSVECTOR
+
+# 导入共享配置
+from shared.config import settings
+
+SEARCH_VECTOR_SUFFIX = "_tsv"
+# PostgreSQL 标识符的最大长度
+MAX_IDENTIFIER_LENGTH = 63
+
+_CONFIG_PATTERN = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+def search_text_config() -> str:
+    """全文检索配置名会被写入生成列的DDL，因此只接受合法的标识符。"""
+    config = settings.SEARCH_TEXT_CONFIG
+    if not _CONFIG_PATTERN.match(config):
+        raise ValueError(f"Invalid SEARCH_TEXT_CONFIG: {config!r}")
+    return config
+
+def search_vector_column_name(column_name: str) -> str:
+    return f"{column_name}{SEARCH_VECTOR_SUFFIX}"
+
+def truncate_identifier(name: str) -> str:
+    """超出PostgreSQL标识符长度的名称截断并附加哈希，保证结果确定且唯一。"""
+    if len(name) <= MAX_IDENTIFIER_LENGTH:
+        return name
+    digest = hashlib.md5(name.encode()).hexdigest()[:8]
+    return f"{name[:MAX_IDENTIFIER_LENGTH - 9]}_{digest}"
+
+def index_name(table_name: str, column_name: str, suffix: str = "") -> str:
+    """生成确定性的索引名。"""
+    return truncate_identifier(f"ix_{table_name}_{column_name}{suffix}")
+
+def _quote(identifier: str) -> str:
+    return '"' + identifier.replace('"', '""') + '"'
+
+def search_vector_column(column_name: str) -> Column:
+    """基于 Text 列生成的 tsvector 列。to_tsvector 显式指定配置，生成表达式是 IMMUTABLE 的。"""
+    expression = f"to_tsvector('{search_text_config()}'::regconfig, coalesce({_quote(column_name)}, ''))"
+    return Column(search_vector_column_name(column_name), TSVECTOR, Computed(expression, persisted=True))
+
+def add_search_indexes(table: Table, text_column_names: List[str]):
+    """为 Text 列添加 tsvector 列上的 GIN 索引和 pg_trgm 子串匹配索引（需要 pg_trgm 扩展）。"""
+    for column_name in text_column_names:
+        vector_name = search_vector_column_name(column_name)
+        Index(index_name(table.name, vector_name), table.c[vector_name], postgresql_using="gin")
+        Index(
+            index_name(table.name, column_name, "_trgm"),
+            table.c[column_name],
+            postgresql_using="gin",
+            postgresql_ops={column_name: "gin_trgm_ops"},
+        )
@@ -0,0 +1,204 @@
+"""
+动态表按采集时间 (extracted_at) 的月度分区管理。
+
+周期性抓取会不断向同一张 data_* 表追加数据，随着时间推移，VACUUM、建索引和按时间范围的报告都会越来越慢。
+PostgreSQL 上新建的动态表是按 extracted_at 进行 RANGE 分区的声明式分区表：
+- 每个月一个分区，提前创建未来 PARTITION_MONTHS_AHEAD 个月的分区，另有一个默认分区兜底；
+- 带时间范围的查询只会扫描相关的分区（分区裁剪）；
+- 数据集设置了 retention_days 时，整月过期的分区直接 DROP，代价远小于 DELETE。
+同步函数接收 SQLAlchemy 的 Connection，供提取器和 Celery 维护任务在事务中调用；
+create_index_concurrently / drop_index 是供 Analysis Service 使用的异步函数。
+"""
+import logging
+import re
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+# 导入共享模块
+from shared.config import settings
+from shared.db.fulltext import truncate_identifier
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+PARTITION_KEY = "extracted_at"
+DEFAULT_PARTITION_SUFFIX = "_default"
+
+_BOUND_PATTERN = re.compile(r"FROM \('([^']+)'\) TO \('([^']+)'\)")
+
+_IS_PARTITIONED_SQL = text("""
+    SELECT c.relkind = 'p' FROM pg_class c
+    WHERE c.relname = :table_name AND pg_table_is_visible(c.oid)
+""")
+
+_PARTITIONS_SQL = text("""
+    SELECT child.relname AS name, pg_get_expr(child.relpartbound, child.oid) AS bound
+    FROM pg_inherits i
+    JOIN pg_class parent ON parent.oid = i.inhparent
+    JOIN pg_class child ON child.oid = i.inhrelid
+    WHERE parent.relname = :table_name AND pg_table_is_visible(parent.oid)
+    ORDER BY child.relname
+""")
+
+# 父表中可以写入的列（排除生成列），用于在分区之间搬移数据
+_INSERTABLE_COLUMNS_SQL = text("""
+    SELECT a.attname FROM pg_attribute a
+    JOIN pg_class c ON c.oid = a.attrelid
+    WHERE c.relname = :table_name AND pg_table_is_visible(c.oid)
+      AND a.attnum > 0 AND NOT a.attisdropped AND a.attgenerated = ''
+    ORDER BY a.attnum
+""")
+
+def month_start(value: date) -> date:
+    return date(value.year, value.month, 1)
+
+def add_months(value: date, months: int) -> date:
+    month_index = value.year * 12 + value.month - 1 + months
+    return date(month_index // 12, month_index % 12 + 1, 1)
+
+def partition_name(table_name: str, month: date) -> str:
+    return truncate_identifier(f"{table_name}_p{month:%Y%m}")
+
+def default_partition_name(table_name: str) -> str:
+    return truncate_identifier(f"{table_name}{DEFAULT_PARTITION_SUFFIX}")
+
+def _bound_literal(month: date) -> str:
+    # 分区边界统一使用UTC的月初
+    return f"{month:%Y-%m-%d} 00:00:00+00"
+
+def _parse_timestamp(value: str) -> datetime:
+    # pg_get_expr 输出的时间戳形如 "2024-05-01 08:00:00+08"
+    if re.search(r"[+-]\d{2}$", value):
+        value += ":00"
+    return datetime.fromisoformat(value)
+
+def is_partitioned(conn: Connection, table_name: str) -> bool:
+    if conn.dialect.name != "postgresql":
+        return False
+    return bool(conn.execute(_IS_PARTITIONED_SQL, {"table_name": table_name}).scalar())
+
+def list_partitions(conn: Connection, table_name: str) -> List[Dict[str, Any]]:
+    """列出分区及其时间范围，默认分区的 lower/upper 为 None。"""
+    partitions = []
+    for row in conn.execute(_PARTITIONS_SQL, {"table_name": table_name}).mappings():
+        match = _BOUND_PATTERN.search(row["bound"])
+        partitions.append({
+            "name": row["name"],
+            "is_default": row["bound"] == "DEFAULT",
+            "lower": _parse_timestamp(match.group(1)) if match else None,
+            "upper": _parse_timestamp(match.group(2)) if match else None,
+        })
+    return partitions
+
+def ensure_partitions(conn: Connection, table_name: str, months_ahead: Optional[int] = None, now: Optional[datetime] = None) -> List[str]:
+    """
+    确保当前月及之后 months_ahead 个月的分区和默认分区存在，返回新建的分区名。
+    如果默认分区中已经有落在新分区范围内的数据（例如维护任务停止运行了一段时间），
+    会先把默认分区分离，建好新分区后把这些数据搬入新分区，再重新挂载默认分区。
+    """
+    months_ahead = settings.PARTITION_MONTHS_AHEAD if months_ahead is None else months_ahead
+    now = now or datetime.now(timezone.utc)
+    quote = conn.dialect.identifier_preparer.quote
+    parent = quote(table_name)
+
+    partitions = list_partitions(conn, table_name)
+    covered = {p["lower"].astimezone(timezone.utc).date() for p in partitions if p["lower"]}
+    has_default = any(p["is_default"] for p in partitions)
+    default_name = default_partition_name(table_name)
+
+    created = []
+    first_month = month_start(now.astimezone(timezone.utc).date())
+    for offset in range(months_ahead + 1):
+        month = add_months(first_month, offset)
+        if month in covered:
+            continue
+        name = partition_name(table_name, month)
+        lower, upper = _bound_literal(month), _bound_literal(add_months(month, 1))
+        range_params = {"lower": lower, "upper": upper}
+
+        rows_in_default = has_default and conn.execute(
+            text(f"SELECT 1 FROM {quote(default_name)} WHERE {PARTITION_KEY} >= :lower AND {PARTITION_KEY} < :upper LIMIT 1"),
+            range_params,
+        ).first() is not None
+        if rows_in_default:
+            conn.execute(text(f"ALTER TABLE {parent} DETACH PARTITION {quote(default_name)}"))
+
+        conn.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {quote(name)} PARTITION OF {parent} "
+            f"FOR VALUES FROM ('{lower}') TO ('{upper}')"
+        ))
+
+        if rows_in_default:
+            columns = ", ".join(quote(c) for c in conn.execute(_INSERTABLE_COLUMNS_SQL, {"table_name": table_name}).scalars())
+            range_condition = f"{PARTITION_KEY} >= :lower AND {PARTITION_KEY} < :upper"
+            conn.execute(
+                text(f"INSERT INTO {quote(name)} ({columns}) SELECT {columns} FROM {quote(default_name)} WHERE {range_condition}"),
+                range_params,
+            )
+            conn.execute(text(f"DELETE FROM {quote(default_name)} WHERE {range_condition}"), range_params)
+            conn.execute(text(f"ALTER TABLE {parent} ATTACH PARTITION {quote(default_name)} DEFAULT"))
+            logger.info(f"已将默认分区中 {month:%Y-%m} 的数据移入分区 '{name}'。")
+        created.append(name)
+
+    if not has_default:
+        conn.execute(text(f"CREATE TABLE IF NOT EXISTS {quote(default_name)} PARTITION OF {parent} DEFAULT"))
+        created.append(default_name)
+
+    if created:
+        logger.info(f"表 '{table_name}' 新建分区: {', '.join(created)}")
+    return created
+
+def drop_expired_partitions(conn: Connection, table_name: str, retention_days: int, now: Optional[datetime] = None) -> List[str]:
+    """
+    删除整体早于保留期限的分区，返回被删除的分区名。
+    默认分区中过期的数据通过 DELETE 清理（默认分区正常情况下很小）。
+    retention_days 小于 1 时截止时间会落在当前或未来，删除正在写入的数据，因此直接抛出 ValueError。
+    """
+    if retention_days < 1:
+        raise ValueError(f"retention_days must be at least 1, got {retention_days}")
+    now = now or datetime.now(timezone.utc)
+    cutoff = now - timedelta(days=retention_days)
+    quote = conn.dialect.identifier_preparer.quote
+
+    dropped = []
+    for partition in list_partitions(conn, table_name):
+        if partition["is_default"]:
+            conn.execute(text(f"DELETE FROM {quote(partition['name'])} WHERE {PARTITION_KEY} < :cutoff"), {"cutoff": cutoff})
+        elif partition["upper"] is not None and partition["upper"] <= cutoff:
+            conn.execute(text(f"DROP TABLE IF EXISTS {quote(partition['name'])}"))
+            dropped.append(partition["name"])
+
+    if dropped:
+        logger.info(f"表 '{table_name}' 已删除过期分区 (保留 {retention_days} 天): {', '.join(dropped)}")
+    return dropped
+
+
+# --- 分区表上的索引 ---
+async def create_index_concurrently(conn: AsyncConnection, table_name: str, name: str, index_spec: str):
+    """
+    在不阻塞写入的情况下创建索引，conn 必须处于自动提交模式。index_spec 形如 'USING btree ("col")'。
+    分区表不支持 CREATE INDEX CONCURRENTLY：先在父表上创建 ONLY 索引（此时无效），
+    再在每个分区上并发创建索引并挂载到父索引，全部挂载后父索引自动变为有效。
+    """
+    quote = conn.dialect.identifier_preparer.quote
+    if not await conn.run_sync(is_partitioned, table_name):
+        await conn.execute(text(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {quote(name)} ON {quote(table_name)} {index_spec}"))
+        return
+
+    await conn.execute(text(f"CREATE INDEX IF NOT EXISTS {quote(name)} ON ONLY {quote(table_name)} {index_spec}"))
+    for partition in await conn.run_sync(list_partitions, table_name):
+        partition_index = truncate_identifier(f"{partition['name']}_{name}")
+        await conn.execute(text(
+            f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {quote(partition_index)} ON {quote(partition['name'])} {index_spec}"
+        ))
+        await conn.execute(text(f"ALTER INDEX {quote(name)} ATTACH PARTITION {quote(partition_index)}"))
+
+async def drop_index(conn: AsyncConnection, table_name: str, name: str):
+    """删除索引；分区表上的索引不支持 CONCURRENTLY，直接删除（会同时删除各分区上的索引）。"""
+    quote = conn.dialect.identifier_preparer.quote
+    concurrently = "" if await conn.run_sync(is_partitioned, table_name) else "CONCURRENTLY "
+    await conn.execute(text(f"DROP INDEX {concurrently}IF EXISTS {quote(name)}"))
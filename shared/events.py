@@ -0,0 +1,138 @@
+"""
+基于 Redis pub/sub 的轻量级状态事件。
+
+Discovery Service、Orchestrator 和提取器在分析任务、抓取任务的状态变化时发布一条JSON事件，
+BFF 订阅后通过 SSE 推送给前端，前端不必再轮询数据库。
+事件只是通知，发布失败只记录日志，不影响业务流程；数据库仍然是状态的唯一来源。
+
+每个 BFF 进程只建立一个 Redis 订阅连接 (EventBroker)，在进程内把事件分发给所有已连接的客户端，
+客户端空闲时既不占用数据库连接也不执行查询。
+"""
+import asyncio
+import json
+import logging
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional, Set
+
+import redis
+import redis.asyncio as aioredis
+
+# 导入共享模块
+from shared.config import settings
+from shared.redis_client import REDIS_SOCKET_TIMEOUT, get_async_redis, get_redis
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+EVENTS_CHANNEL = "intelliscrape:events"
+
+# 事件类型
+ANALYSIS_STATUS = "analysis_status"
+CRAWL_TASK_STATUS = "crawl_task_status"
+EXTRACTION_STATUS = "extraction_status"
+# 订阅中断后重新连上时发给客户端，提示其重新拉取一次完整状态（中断期间的事件已经丢失）
+RESYNC = "resync"
+
+# 每个客户端最多积压的事件数，超过后丢弃该客户端的积压并发送 resync
+CLIENT_QUEUE_SIZE = 100
+# 订阅连接断开后的重连间隔（秒）
+RECONNECT_INTERVAL = 5
+
+def build_event(event_type: str, **payload: Any) -> Dict[str, Any]:
+    return {"type": event_type, "emitted_at": datetime.now(timezone.utc).isoformat(), **payload}
+
+def _encode(event: Dict[str, Any]) -> str:
+    return json.dumps(event, ensure_ascii=False, default=str)
+
+def publish_event(event_type: str, **payload: Any):
+    """（同步）发布一条事件，供提取器和 Celery 任务使用。"""
+    try:
+        get_redis().publish(EVENTS_CHANNEL, _encode(build_event(event_type, **payload)))
+    except redis.RedisError as e:
+        logger.warning(f"发布 {event_type} 事件失败: {e}")
+
+async def publish_event_async(event_type: str, **payload: Any):
+    """（异步）发布一条事件，供 FastAPI 服务使用。"""
+    try:
+        await get_async_redis().publish(EVENTS_CHANNEL, _encode(build_event(event_type, **payload)))
+    except redis.RedisError as e:
+        logger.warning(f"发布 {event_type} 事件失败: {e}")
+
+
+class EventBroker:
+    """
+    进程内的事件分发器。
+
+    第一个客户端订阅时启动后台任务，在一个专用的 Redis 连接上订阅 EVENTS_CHANNEL，
+    收到的每条事件放入所有客户端的队列。订阅连接需要长时间阻塞读取，
+    因此不使用带读超时的共享客户端，而是单独创建一个没有读超时的连接。
+    """
+
+    def __init__(self):
+        self._queues: Set[asyncio.Queue] = set()
+        self._task: Optional[asyncio.Task] = None
+
+    def subscribe(self) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=CLIENT_QUEUE_SIZE)
+        self._queues.add(queue)
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._listen())
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self._queues.discard(queue)
+
+    @property
+    def client_count(self) -> int:
+        return len(self._queues)
+
+    def _dispatch(self, event: Dict[str, Any]):
+        for queue in list(self._queues):
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # 客户端消费太慢：清空积压，让它重新拉取一次完整状态
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(build_event(RESYNC))
+
+    async def _listen(self):
+        connected_before = False
+        while True:
+            client = aioredis.Redis.from_url(settings.REDIS_URL, socket_connect_timeout=REDIS_SOCKET_TIMEOUT)
+            pubsub = client.pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.subscribe(EVENTS_CHANNEL)
+                logger.info(f"已订阅事件频道 '{EVENTS_CHANNEL}'。")
+                if connected_before:
+                    self._dispatch(build_event(RESYNC))
+                connected_before = True
+                async for message in pubsub.listen():
+                    try:
+                        self._dispatch(json.loads(message["data"]))
+                    except (TypeError, ValueError) as e:
+                        logger.warning(f"忽略无法解析的事件: {e}")
+            except asyncio.CancelledError:
+                raise
+            except (redis.RedisError, OSError) as e:
+                logger.warning(f"事件订阅中断，{RECONNECT_INTERVAL} 秒后重连: {e}")
+            finally:
+                try:
+                    await pubsub.aclose()
+                    await client.aclose()
+                except (redis.RedisError, OSError):
+                    pass
+            await asyncio.sleep(RECONNECT_INTERVAL)
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+# 进程级的共享实例
+event_broker = EventBroker()
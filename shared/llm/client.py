@@ -0,0 +1,263 @@
+import asyncio
+import json
+import logging
+import random
+import re
+import time
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+# 导入共享配置
+from shared.config import settings
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+
+class LLMError(Exception):
+    """LLM调用在重试耗尽后仍然失败，或返回了无法解析的内容。"""
+
+
+# --- 页面大纲 ---
+_STRIP_BLOCK_PATTERN = re.compile(r"<(script|style|noscript|svg|iframe)\b[^>]*>.*?</\1\s*>", re.IGNORECASE | re.DOTALL)
+_COMMENT_PATTERN = re.compile(r"<!--.*?-->", re.DOTALL)
+_WHITESPACE_PATTERN = re.compile(r"\s+")
+
+def build_page_outline(html_content: str, max_chars: Optional[int] = None) -> str:
+    """
+    将完整的HTML精简为发送给LLM的页面大纲。
+    去掉脚本、样式、注释等与字段定位无关的内容并压缩空白，
+    再截断到最大长度，以控制每次调用消耗的token数。
+    """
+    max_chars = max_chars or settings.LLM_MAX_OUTLINE_CHARS
+    outline = _STRIP_BLOCK_PATTERN.sub("", html_content)
+    outline = _COMMENT_PATTERN.sub("", outline)
+    outline = _WHITESPACE_PATTERN.sub(" ", outline).strip()
+    return outline[:max_chars]
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算文本的token数。中文内容约每个字符一个token，这里取偏保守的估计。"""
+    return max(1, len(text) // 2)
+
+
+# --- 限流 ---
+class RateLimiter:
+    """
+    同时限制每分钟请求数 (RPM) 和每分钟token数 (TPM) 的令牌桶。
+    两个桶都以“每分钟配额”的速率持续回填，请求需要同时从两个桶中取得配额后才能发出。
+    """
+
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._request_allowance = float(requests_per_minute)
+        self._token_allowance = float(tokens_per_minute)
+        self._updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._updated_at
+        self._updated_at = now
+        self._request_allowance = min(
+            self.requests_per_minute, self._request_allowance + elapsed * self.requests_per_minute / 60
+        )
+        self._token_allowance = min(
+            self.tokens_per_minute, self._token_allowance + elapsed * self.tokens_per_minute / 60
+        )
+
+    async def acquire(self, tokens: int):
+        """等待直到可以发出一个消耗 tokens 个token的请求。"""
+        # 单个请求超过整分钟配额时按整分钟配额计，避免永远等待
+        tokens = min(tokens, self.tokens_per_minute)
+        async with self._lock:
+            while True:
+                self._refill()
+                if self._request_allowance >= 1 and self._token_allowance >= tokens:
+                    self._request_allowance -= 1
+                    self._token_allowance -= tokens
+                    return
+                request_wait = (1 - self._request_allowance) * 60 / self.requests_per_minute
+                token_wait = (tokens - self._token_allowance) * 60 / self.tokens_per_minute
+                await asyncio.sleep(max(request_wait, token_wait, 0.01))
+
+    def record_usage(self, estimated_tokens: int, actual_tokens: int):
+        """用LLM返回的实际用量修正预估值，预估偏低时从桶中补扣差额。"""
+        if actual_tokens > estimated_tokens:
+            self._token_allowance -= actual_tokens - estimated_tokens
+
+
+# --- 客户端 ---
+SYSTEM_PROMPT = (
+    "作为一名专业的数据抓取工程师，你的任务是分析给定的HTML内容，并找出所有与主题相关的可抓取字段。"
+    "请只返回JSON，不要包含任何解释。"
+)
+
+FIELDS_INSTRUCTION = (
+    '返回JSON的根节点应该是一个名为 "fields" 的数组。数组中的每个对象都应包含以下三个键：'
+    '"field_name"（英文snake_case的字段名）、"description"（字段的简短描述）、'
+    '"selector"（用于定位该字段数据的CSS选择器）。'
+    '如果找不到任何相关字段，请返回一个空的 "fields" 数组。'
+)
+
+class LLMClient:
+    """
+    面向 OpenAI 兼容 /chat/completions 接口的异步LLM客户端。
+
+    - 复用一个 httpx.AsyncClient 连接池，避免每次调用都重新建立TCP/TLS连接。
+    - 通过 RateLimiter 遵守进程级的RPM/TPM配额，通过信号量限制并发请求数。
+    - 对429、5xx和网络错误进行带抖动的指数退避重试，并优先遵循 Retry-After 响应头。
+    - 可以把多个页面大纲合并到一次调用中（analyze_pages）。
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        api_key: str,
+        model: str = settings.LLM_MODEL,
+        max_concurrency: int = settings.LLM_MAX_CONCURRENCY,
+        requests_per_minute: int = settings.LLM_REQUESTS_PER_MINUTE,
+        tokens_per_minute: int = settings.LLM_TOKENS_PER_MINUTE,
+        max_retries: int = settings.LLM_MAX_RETRIES,
+        timeout: float = settings.LLM_TIMEOUT,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        self.model = model
+        self.max_retries = max_retries
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+        self._client = httpx.AsyncClient(
+            base_url=base_url,
+            headers={"Authorization": f"Bearer {api_key}"},
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=max_concurrency, max_keepalive_connections=max_concurrency),
+            transport=transport,
+        )
+        # 运行统计，便于压测和排查
+        self.stats = {"requests": 0, "retries": 0, "rate_limited": 0, "failures": 0}
+
+    async def aclose(self):
+        await self._client.aclose()
+
+    async def complete_json(self, messages: List[Dict[str, str]], max_tokens: int = settings.LLM_MAX_OUTPUT_TOKENS) -> Dict[str, Any]:
+        """发送一次对话补全请求，并将模型返回的内容解析为JSON对象。"""
+        payload = {
+            "model": self.model,
+            "messages": messages,
+            "max_tokens": max_tokens,
+            "temperature": 0,
+            "response_format": {"type": "json_object"},
+        }
+        estimated_tokens = sum(estimate_tokens(m["content"]) for m in messages) + max_tokens
+        body = await self._post_with_retry(payload, estimated_tokens)
+
+        try:
+            content = body["choices"][0]["message"]["content"]
+            return json.loads(content)
+        except (KeyError, IndexError, TypeError, json.JSONDecodeError) as e:
+            raise LLMError(f"LLM返回的内容无法解析为JSON: {e}") from e
+
+    async def _post_with_retry(self, payload: Dict[str, Any], estimated_tokens: int) -> Dict[str, Any]:
+        last_error: Exception | None = None
+        for attempt in range(self.max_retries + 1):
+            await self._limiter.acquire(estimated_tokens)
+            retry_after = None
+            async with self._semaphore:
+                self.stats["requests"] += 1
+                try:
+                    response = await self._client.post("/chat/completions", json=payload)
+                except httpx.TransportError as e:
+                    last_error = e
+                else:
+                    if response.status_code == 429 or response.status_code >= 500:
+                        if response.status_code == 429:
+                            self.stats["rate_limited"] += 1
+                        last_error = httpx.HTTPStatusError(
+                            f"LLM服务返回状态码 {response.status_code}", request=response.request, response=response
+                        )
+                        retry_after = _parse_retry_after(response.headers.get("Retry-After"))
+                    else:
+                        response.raise_for_status()
+                        body = response.json()
+                        actual_tokens = (body.get("usage") or {}).get("total_tokens")
+                        if actual_tokens:
+                            self._limiter.record_usage(estimated_tokens, actual_tokens)
+                        return body
+
+            if attempt == self.max_retries:
+                break
+            self.stats["retries"] += 1
+            # 全抖动 (full jitter) 的指数退避，避免大量客户端在同一时刻集中重试
+            backoff = random.uniform(0, min(settings.LLM_RETRY_MAX_DELAY, settings.LLM_RETRY_BASE_DELAY * 2 ** attempt))
+            delay = max(backoff, retry_after or 0)
+            logger.warning(f"LLM调用失败 ({last_error})，{delay:.2f} 秒后进行第 {attempt + 1} 次重试。")
+            await asyncio.sleep(delay)
+
+        self.stats["failures"] += 1
+        raise LLMError(f"LLM调用在 {self.max_retries} 次重试后仍然失败: {last_error}")
+
+    async def analyze_page(self, theme_name: str, outline: str) -> Dict[str, Any]:
+        """分析单个页面大纲，返回包含 "fields" 数组的结果。"""
+        messages = [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": f"分析主题: {theme_name}\n\n{FIELDS_INSTRUCTION}\n\nHTML内容如下:\n{outline}"},
+        ]
+        result = await self.complete_json(messages)
+        result.setdefault("fields", [])
+        return result
+
+    async def analyze_pages(self, theme_name: str, outlines: List[str], batch_size: int = settings.LLM_BATCH_SIZE) -> List[Dict[str, Any]]:
+        """
+        分析多个页面大纲，返回与输入顺序一致的结果列表。
+        batch_size 大于1时，每 batch_size 个页面合并为一次调用，以减少请求数和重复的提示词开销；
+        各批次之间并发执行，并发度和速率由客户端统一控制。
+        """
+        if batch_size <= 1:
+            return list(await asyncio.gather(*(self.analyze_page(theme_name, o) for o in outlines)))
+
+        batches = [outlines[i:i + batch_size] for i in range(0, len(outlines), batch_size)]
+        batch_results = await asyncio.gather(*(self._analyze_batch(theme_name, batch) for batch in batches))
+        return [result for batch in batch_results for result in batch]
+
+    async def _analyze_batch(self, theme_name: str, outlines: List[str]) -> List[Dict[str, Any]]:
+        pages = "\n\n".join(f"### PAGE {i}\n{outline}" for i, outline in enumerate(outlines))
+        messages = [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": (
+                f"分析主题: {theme_name}\n\n"
+                f"下面包含 {len(outlines)} 个页面，每个页面以 \"### PAGE <序号>\" 开头。"
+                f'请返回一个JSON对象，其 "pages" 数组按序号给出每个页面的结果，'
+                f'每个元素形如 {{"index": <序号>, "fields": [...]}}。\n'
+                f"{FIELDS_INSTRUCTION}\n\n{pages}"
+            )},
+        ]
+        result = await self.complete_json(messages, max_tokens=settings.LLM_MAX_OUTPUT_TOKENS * len(outlines))
+
+        by_index = {}
+        for page in result.get("pages") or []:
+            if isinstance(page, dict) and isinstance(page.get("index"), int):
+                by_index[page["index"]] = {"fields": page.get("fields") or []}
+        return [by_index.get(i, {"fields": []}) for i in range(len(outlines))]
+
+
+def _parse_retry_after(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+# 进程级共享的客户端实例，保证连接池和限流配额在整个进程内统一
+_client: Optional[LLMClient] = None
+
+def get_llm_client() -> LLMClient:
+    """获取进程内共享的LLM客户端。需要先配置 LLM_BASE_URL。"""
+    global _client
+    if _client is None:
+        if not settings.LLM_BASE_URL:
+            raise LLMError("未配置 LLM_BASE_URL，无法创建LLM客户端。")
+        _client = LLMClient(settings.LLM_BASE_URL, settings.LLM_API_KEY)
+    return _client
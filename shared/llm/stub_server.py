@@ -0,0 +1,164 @@
+"""
+一个模拟 OpenAI 兼容 /chat/completions 接口的本地LLM桩服务。
+
+它可以模拟响应延迟、随机的429限流响应以及服务端自身的RPM上限，
+用于在不访问真实LLM的情况下测试 LLMClient 的吞吐量、限流和重试行为。
+
+既可以作为独立服务启动：
+    uvicorn shared.llm.stub_server:app --port 9000
+也可以通过 httpx.ASGITransport 在进程内直接使用，并运行离线吞吐量测试：
+    python -m shared.llm.stub_server --pages 200 --batch-size 4 --concurrency 8
+"""
+import argparse
+import asyncio
+import json
+import random
+import re
+import time
+from collections import deque
+
+import httpx
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+from shared.llm.client import LLMClient, build_page_outline, estimate_tokens
+
+_PAGE_MARKER = re.compile(r"^### PAGE (\d+)$", re.MULTILINE)
+
+def _mock_fields():
+    return [
+        {"field_name": "title", "selector": "h1.article-title", "description": "文章主标题"},
+        {"field_name": "author", "selector": ".author-name", "description": "文章作者"},
+        {"field_name": "publish_date", "selector": "span.publish-date", "description": "发布日期"},
+        {"field_name": "content", "selector": "div.article-content", "description": "正文内容"},
+    ]
+
+def create_stub_app(
+    latency_ms: float = 800,
+    jitter_ms: float = 400,
+    rate_limit_probability: float = 0.05,
+    requests_per_minute: int = 0,
+) -> FastAPI:
+    """
+    创建LLM桩服务应用。
+
+    - latency_ms / jitter_ms: 每次调用的模拟延迟（均值与随机抖动幅度）。
+    - rate_limit_probability: 以该概率随机返回429。
+    - requests_per_minute: 大于0时，桩服务按滑动窗口执行自身的RPM上限，超出即返回429。
+    """
+    stub = FastAPI(title="IntelliScrape LLM Stub")
+    recent_requests: deque = deque()
+    stub.state.stats = {"requests": 0, "rate_limited": 0}
+
+    @stub.post("/chat/completions")
+    async def chat_completions(request: Request):
+        payload = await request.json()
+        stub.state.stats["requests"] += 1
+
+        now = time.monotonic()
+        while recent_requests and now - recent_requests[0] > 60:
+            recent_requests.popleft()
+        over_limit = requests_per_minute > 0 and len(recent_requests) >= requests_per_minute
+        if over_limit or random.random() < rate_limit_probability:
+            stub.state.stats["rate_limited"] += 1
+            return JSONResponse(
+                status_code=429,
+                content={"error": {"message": "Rate limit exceeded (stub)."}},
+                headers={"Retry-After": "1"},
+            )
+        recent_requests.append(now)
+
+        await asyncio.sleep(max(0.0, latency_ms + random.uniform(-jitter_ms, jitter_ms)) / 1000)
+
+        prompt = payload["messages"][-1]["content"]
+        page_indexes = [int(i) for i in _PAGE_MARKER.findall(prompt)]
+        if page_indexes:
+            content = {"pages": [{"index": i, "fields": _mock_fields()} for i in page_indexes]}
+        else:
+            content = {"fields": _mock_fields(), "confidence_score": 0.95}
+
+        prompt_tokens = sum(estimate_tokens(m["content"]) for m in payload["messages"])
+        completion_text = json.dumps(content, ensure_ascii=False)
+        completion_tokens = estimate_tokens(completion_text)
+        return {
+            "id": f"stub-{stub.state.stats['requests']}",
+            "object": "chat.completion",
+            "model": payload.get("model"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": completion_text}, "finish_reason": "stop"}],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        }
+
+    return stub
+
+# 供 uvicorn 直接启动的默认实例
+app = create_stub_app()
+
+
+async def run_throughput_test(
+    pages: int,
+    batch_size: int,
+    concurrency: int,
+    requests_per_minute: int,
+    tokens_per_minute: int,
+    latency_ms: float,
+    rate_limit_probability: float,
+) -> dict:
+    """在进程内对桩服务运行一次吞吐量测试，返回统计结果。"""
+    stub = create_stub_app(latency_ms=latency_ms, jitter_ms=latency_ms / 2, rate_limit_probability=rate_limit_probability)
+    client = LLMClient(
+        base_url="http://llm-stub",
+        api_key="stub",
+        max_concurrency=concurrency,
+        requests_per_minute=requests_per_minute,
+        tokens_per_minute=tokens_per_minute,
+        transport=httpx.ASGITransport(app=stub),
+    )
+    sample_html = "<html><body>" + "<div class='item'><h1 class='article-title'>标题</h1><p>正文内容</p></div>" * 50 + "</body></html>"
+    outlines = [build_page_outline(sample_html)] * pages
+
+    started = time.perf_counter()
+    try:
+        results = await client.analyze_pages("基准测试", outlines, batch_size=batch_size)
+    finally:
+        await client.aclose()
+    elapsed = time.perf_counter() - started
+
+    return {
+        "pages": pages,
+        "batch_size": batch_size,
+        "concurrency": concurrency,
+        "elapsed_seconds": round(elapsed, 3),
+        "pages_per_second": round(len(results) / elapsed, 2),
+        "client_stats": client.stats,
+        "stub_stats": stub.state.stats,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="对本地LLM桩服务运行离线吞吐量测试。")
+    parser.add_argument("--pages", type=int, default=100)
+    parser.add_argument("--batch-size", type=int, default=1)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--rpm", type=int, default=600)
+    parser.add_argument("--tpm", type=int, default=2_000_000)
+    parser.add_argument("--latency-ms", type=float, default=200)
+    parser.add_argument("--rate-limit-probability", type=float, default=0.05)
+    args = parser.parse_args()
+
+    report = asyncio.run(run_throughput_test(
+        pages=args.pages,
+        batch_size=args.batch_size,
+        concurrency=args.concurrency,
+        requests_per_minute=args.rpm,
+        tokens_per_minute=args.tpm,
+        latency_ms=args.latency_ms,
+        rate_limit_probability=args.rate_limit_probability,
+    ))
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
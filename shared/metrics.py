@@ -0,0 +1,186 @@
+"""
+各服务共用的 Prometheus 指标。
+
+FastAPI 服务通过挂载 metrics_router 暴露 /metrics；提取器不是HTTP服务，调用 start_metrics_server
+在 EXTRACTOR_METRICS_PORT 上单独暴露。所有指标在这里集中定义，名称和标签在各服务之间保持一致。
+
+prometheus_client 是可选依赖：未安装时所有指标都是空操作，/metrics 返回 503，业务逻辑不受影响。
+
+data_source_id 等标签的取值来自数据库，数量没有上限。每个标签的不同取值经过 LabelGuard 限制，
+超过 METRICS_MAX_LABEL_VALUES 后新的取值都记为 "other"，避免时间序列数量随数据源的增加而失控。
+"""
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+from fastapi import APIRouter, HTTPException, Response
+
+# 导入共享配置
+from shared.config import settings
+
+# prometheus_client 只在采集指标时需要，缺失时指标退化为空操作
+try:
+    import prometheus_client
+    from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram
+except ImportError:  # pragma: no cover
+    prometheus_client = None
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+OTHER_LABEL_VALUE = "other"
+UNKNOWN_LABEL_VALUE = "unknown"
+
+# 浏览器操作的耗时分布从几十毫秒到数十秒，数据库写入和查询则集中在毫秒级
+BROWSER_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+DB_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# --- 标签基数限制 ---
+class LabelGuard:
+    """记录每个标签已出现的取值，超出上限后的新取值映射为 "other"。线程安全。"""
+
+    def __init__(self, max_values: int):
+        self.max_values = max_values
+        self._seen: Dict[str, set] = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, label: str, value) -> str:
+        if value is None:
+            return UNKNOWN_LABEL_VALUE
+        value = str(value)
+        with self._lock:
+            seen = self._seen.setdefault(label, set())
+            if value in seen:
+                return value
+            if len(seen) < self.max_values:
+                seen.add(value)
+                return value
+            if OTHER_LABEL_VALUE not in seen:
+                # 只在第一次溢出时记录，之后的溢出不再刷日志
+                seen.add(OTHER_LABEL_VALUE)
+                logger.warning(f"指标标签 '{label}' 的取值超过 {self.max_values} 个，之后的新取值记为 '{OTHER_LABEL_VALUE}'。")
+            return OTHER_LABEL_VALUE
+
+# 进程级的共享实例
+guard_label = LabelGuard(settings.METRICS_MAX_LABEL_VALUES)
+
+def source_labels(data_source_id: Optional[int], standard_dataset_id: Optional[int]) -> Dict[str, str]:
+    """经过基数限制的 data_source_id / standard_dataset_id 标签。"""
+    return {
+        "data_source_id": guard_label("data_source_id", data_source_id),
+        "standard_dataset_id": guard_label("standard_dataset_id", standard_dataset_id),
+    }
+
+# --- 指标定义 ---
+class _NoopMetric:
+    """prometheus_client 未安装时使用的空指标，接口与 Counter/Gauge/Histogram 的常用部分一致。"""
+
+    def labels(self, *args, **kwargs):
+        return self
+
+    def inc(self, amount=1):
+        pass
+
+    def dec(self, amount=1):
+        pass
+
+    def set(self, value):
+        pass
+
+    def observe(self, value):
+        pass
+
+def _metric(metric_type: str, name: str, documentation: str, labelnames=(), **kwargs):
+    if prometheus_client is None:
+        return _NoopMetric()
+    metric_class = {"counter": Counter, "gauge": Gauge, "histogram": Histogram}[metric_type]
+    return metric_class(name, documentation, labelnames, **kwargs)
+
+SOURCE_LABELS = ("data_source_id", "standard_dataset_id")
+
+# 提取器
+PAGE_NAVIGATION_SECONDS = _metric(
+    "histogram", "intelliscrape_page_navigation_seconds",
+    "Time to load a page until the network is idle.", SOURCE_LABELS, buckets=BROWSER_BUCKETS,
+)
+SELECTOR_EVALUATION_SECONDS = _metric(
+    "histogram", "intelliscrape_selector_evaluation_seconds",
+    "Time to evaluate all selectors of a crawl config on a loaded page.", SOURCE_LABELS, buckets=BROWSER_BUCKETS,
+)
+INSERT_SECONDS = _metric(
+    "histogram", "intelliscrape_insert_seconds",
+    "Time to insert an extracted record into its dynamic table.", SOURCE_LABELS, buckets=DB_BUCKETS,
+)
+# outcome: acked / nacked (重新入队) / dead_lettered (requeue=False，被丢弃或进入死信交换机)
+EXTRACTION_MESSAGES_TOTAL = _metric(
+    "counter", "intelliscrape_extraction_messages_total",
+    "Extraction queue messages by outcome.", ("outcome",) + SOURCE_LABELS,
+)
+# 无法转换为声明类型的字段值 (原始文本保存在 extra_data._coercion_errors 中)
+COERCION_FAILURES_TOTAL = _metric(
+    "counter", "intelliscrape_coercion_failures_total",
+    "Extracted field values that could not be coerced to their declared data type.", SOURCE_LABELS,
+)
+# 由发布方写入消息的时间戳计算 (见 shared/tracing.py)
+QUEUE_WAIT_SECONDS = _metric(
+    "histogram", "intelliscrape_queue_wait_seconds",
+    "Time a message spent in a queue before a consumer picked it up.", ("queue",), buckets=BROWSER_BUCKETS,
+)
+BROWSER_POOL_SIZE = _metric("gauge", "intelliscrape_browser_pool_size", "Browser instances currently open.")
+IN_FLIGHT_PAGES = _metric("gauge", "intelliscrape_in_flight_pages", "Pages currently open in a browser.")
+
+# 分析服务
+REPORT_QUERY_SECONDS = _metric(
+    "histogram", "intelliscrape_report_query_seconds",
+    "Time to run an analysis query, including result cache lookups.", ("endpoint", "standard_dataset_id"),
+    buckets=DB_BUCKETS,
+)
+
+@contextmanager
+def observe_seconds(histogram, **labels):
+    """记录代码块的耗时（无论是否抛出异常）。"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.labels(**labels).observe(time.perf_counter() - started)
+
+@contextmanager
+def track_in_progress(gauge):
+    gauge.inc()
+    try:
+        yield
+    finally:
+        gauge.dec()
+
+# --- 指标暴露 ---
+def _collect() -> bytes:
+    registry = prometheus_client.REGISTRY
+    # 以多进程模式运行 (如 uvicorn --workers / gunicorn) 时，汇总所有 worker 进程写入的指标文件
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import CollectorRegistry, multiprocess
+
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return prometheus_client.generate_latest(registry)
+
+metrics_router = APIRouter()
+
+@metrics_router.get("/metrics", summary="Prometheus 指标", tags=["Monitoring"], include_in_schema=False)
+def metrics():
+    if prometheus_client is None:
+        raise HTTPException(status_code=503, detail="prometheus_client is not installed.")
+    return Response(content=_collect(), media_type=CONTENT_TYPE_LATEST)
+
+def start_metrics_server(port: int):
+    """在后台线程中以独立端口暴露指标，供没有HTTP服务的进程 (提取器) 使用。port 为 0 时不启动。"""
+    if not port:
+        return
+    if prometheus_client is None:
+        logger.warning("未安装 prometheus_client，不暴露监控指标。")
+        return
+    prometheus_client.start_http_server(port)
+    logger.info(f"监控指标已在端口 {port} 上暴露 (/metrics)。")
@@ -8,6 +8,8 @@ from sqlalchemy import (
     JSON,
     ForeignKey,
     Boolean,
+    Index,
+    UniqueConstraint,
 )
 from sqlalchemy.dialects.postgresql import ARRAY
 from sqlalchemy.orm import relationship
@@ -15,6 +17,7 @@ from sqlalchemy.sql import func
 
 # 从我们定义的base模块中导入Base类
 from .base import Base
+from shared.db.clock import clock_now
 
 class StandardDataset(Base):
     """
@@ -28,8 +31,9 @@ class StandardDataset(Base):
     name = Column(String(255), unique=True, nullable=False, comment="数据集的可读名称")
     description = Column(Text, comment="数据集的详细描述")
     table_name = Column(String(255), unique=True, nullable=False, comment="对应的物理数据表名")
+    retention_days = Column(Integer, nullable=True, comment="数据保留天数，超期的分区会被删除；为空表示永久保留")
     created_at = Column(DateTime(timezone=True), server_default=func.now(), comment="创建时间")
-    updated_at = Column(DateTime(timezone=True), onupdate=func.now(), comment="最后更新时间")
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), index=True, comment="最后更新时间")
 
     # 定义关系：一个数据集可以有多个标准字段
     # lazy="selectin" 告诉SQLAlchemy在加载StandardDataset时，
@@ -71,10 +75,12 @@ class DataSource(Base):
     __tablename__ = "data_sources"
 
     id = Column(Integer, primary_key=True, index=True)
+    site_key = Column(String(255), unique=True, nullable=False, comment="站点的唯一标识，通常为去掉 www. 的主机名")
     name = Column(String(255), nullable=False, comment="数据源的可读名称")
     url = Column(Text, nullable=False, comment="数据源的根URL")
     description = Column(Text, comment="关于该数据源的详细备注")
     created_at = Column(DateTime(timezone=True), server_default=func.now(), comment="创建时间")
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), index=True, comment="最后更新时间")
 
 class RawAnalysisResult(Base):
     """
@@ -91,6 +97,34 @@ class RawAnalysisResult(Base):
     raw_fields_json = Column(JSON, comment="从LLM返回的原始JSON结果")
     error_message = Column(Text, comment="如果分析失败，记录错误信息")
     created_at = Column(DateTime(timezone=True), server_default=func.now(), comment="创建时间")
+    # 使用实际写入时间而不是事务开始时间，作为 /themes/analysis_status 增量轮询的游标
+    updated_at = Column(DateTime(timezone=True), server_default=clock_now(), onupdate=clock_now(), index=True, comment="最后更新时间，状态变化时刷新")
+
+    __table_args__ = (
+        # 支持按主题查询每个数据源最新的一条分析记录（见 BFF 的 /themes/analysis_status）
+        Index("ix_raw_analysis_results_theme_source_created", "theme_name", "data_source_id", "created_at"),
+    )
+
+class WorkbenchStat(Base):
+    """
+    标准化工作台的物化聚合统计。
+    每当一条原始分析结果完成时，按 (主题, 字段名, 选择器) 增量累加计数，
+    工作台接口只需按主键前缀 theme_name 读取一次，而不必每次都加载并重新聚合所有原始分析结果。
+
+    行的含义由 field_name / selector 是否为空决定：
+    - field_name 与 selector 都为空：主题级汇总，count 为已完成的分析结果数；
+    - 仅 selector 为空：字段级汇总，count 为包含该字段的分析结果数；
+    - 两者都不为空：选择器级统计，count 为LLM给出该选择器的次数。
+    """
+    __tablename__ = "workbench_stats"
+
+    theme_name = Column(String(255), primary_key=True, comment="主题名称")
+    field_name = Column(String(255), primary_key=True, default="", comment="字段名称，主题级汇总行为空字符串")
+    selector = Column(Text, primary_key=True, default="", comment="CSS选择器，主题级和字段级汇总行为空字符串")
+    count = Column(Integer, nullable=False, default=0, comment="计数，含义见类说明")
+    validated_count = Column(Integer, nullable=False, default=0, comment="经过页面校验的次数")
+    hit_count = Column(Integer, nullable=False, default=0, comment="校验时在页面中实际命中元素的次数")
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), comment="最后更新时间")
 
 class CrawlConfig(Base):
     """
@@ -109,6 +143,15 @@ class CrawlConfig(Base):
     field_selectors_json = Column(JSON, nullable=False, comment="包含详情页字段映射和选择器的JSON")
     created_at = Column(DateTime(timezone=True), server_default=func.now(), comment="创建时间")
 
+    # 定义关系：提取器处理抓取子任务时需要配置所属的数据源和标准数据集（由调用方按需预加载）
+    data_source = relationship("DataSource")
+    standard_dataset = relationship("StandardDataset")
+
+    __table_args__ = (
+        # 同一数据源在同一数据集下的版本号唯一，防止并发的标准化请求写入重复版本
+        UniqueConstraint("data_source_id", "standard_dataset_id", "version", name="uq_crawl_configs_source_dataset_version"),
+    )
+
 class CrawlTask(Base):
     """
     数据抓取任务模型。
@@ -119,7 +162,9 @@ class CrawlTask(Base):
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String(255), nullable=False, comment="任务的可读名称")
     standard_dataset_id = Column(Integer, ForeignKey("standard_datasets.id"), nullable=False, index=True, comment="关联的标准数据集ID")
-    data_source_ids = Column(ARRAY(Integer), nullable=False, comment="本次任务要抓取的数据源ID数组")
+    # SQLite（本地开发和基准测试）没有数组类型，以JSON数组存储
+    data_source_ids = Column(ARRAY(Integer).with_variant(JSON(), "sqlite"), nullable=False, comment="本次任务要抓取的数据源ID数组")
     schedule_cron = Column(String(100), comment="(可选) CRON表达式，定义周期性执行计划")
     status = Column(String(50), nullable=False, index=True, comment="任务状态")
     created_at = Column(DateTime(timezone=True), server_default=func.now(), comment="创建时间")
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), index=True, comment="最后更新时间")
@@ -0,0 +1,350 @@
+"""
+渲染后页面的本地存档，按内容寻址。
+
+提取器和模式发现服务在浏览器渲染页面之后把HTML写入存档。选择器变化（重新标准化）后可以直接从存档重新提取，
+不需要重新抓取每个站点。抓取记录同时保存主文档响应的 ETag 和 Last-Modified，模式发现在 PAGE_ARCHIVE_REUSE_SECONDS
+内重复分析同一页面时，只有条件请求确认页面未变化才直接读取存档，不启动浏览器。
+
+存档默认关闭，需要设置 PAGE_ARCHIVE_ENABLED=true 并通过 PAGE_ARCHIVE_DIR 指定各服务共享的目录。
+
+存储结构（都在 PAGE_ARCHIVE_DIR 下）：
+- 段文件 (*.seg)：页面内容按 SHA-256 去重后逐条压缩 (zstd，未安装 zstandard 时退化为 zlib) 追加写入。
+  每个进程只追加自己的段文件，写满 PAGE_ARCHIVE_SEGMENT_BYTES 后换新文件，多个进程之间不需要文件锁；
+- 索引 (index.sqlite3)：内容哈希 -> (段文件, 偏移, 长度)，以及按 (URL, 抓取时间) 索引的抓取记录，
+  另外缓存模式发现在某份页面内容上的选择器校验结果。
+
+淘汰以段文件为单位：总大小超过 PAGE_ARCHIVE_MAX_BYTES，或段文件最近一次写入（包括去重命中）早于
+PAGE_ARCHIVE_MAX_AGE_DAYS 时，从最久未写入的段开始删除，同时删除引用其中内容的索引记录。淘汰在换段时进行。
+按大小淘汰只删除已经写满、不再追加的段 (sealed)；仍在被某个进程追加的段只会因超过保留天数被淘汰。
+写入在持有索引写锁 (BEGIN IMMEDIATE) 的事务中先确认段文件仍然登记在索引中再追加，
+淘汰只在段的最近写入时间与检查时一致时才删除，因此追加与淘汰不会交错：段被淘汰后，写入方换新的段文件。
+
+存档只是加速手段：读写失败只记录日志，调用方退回到正常的抓取流程。
+"""
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Any, Dict, List, Optional
+
+# 导入共享配置
+from shared.config import settings
+
+# zstandard 只用于压缩页面，缺失时使用标准库的 zlib（段文件记录各自的压缩格式，两种可以混存）
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+INDEX_FILENAME = "index.sqlite3"
+ZSTD_LEVEL = 3
+ZLIB_LEVEL = 6
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS segments (
+    name TEXT PRIMARY KEY,
+    codec TEXT NOT NULL,
+    size INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    last_write_at REAL NOT NULL,
+    sealed INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS blobs (
+    content_hash TEXT PRIMARY KEY,
+    segment TEXT NOT NULL,
+    offset INTEGER NOT NULL,
+    length INTEGER NOT NULL,
+    raw_size INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_blobs_segment ON blobs (segment);
+CREATE TABLE IF NOT EXISTS fetches (
+    id INTEGER PRIMARY KEY,
+    url TEXT NOT NULL,
+    content_hash TEXT NOT NULL,
+    fetched_at REAL NOT NULL,
+    source TEXT,
+    etag TEXT,
+    last_modified TEXT
+);
+CREATE INDEX IF NOT EXISTS ix_fetches_url_fetched_at ON fetches (url, fetched_at);
+CREATE INDEX IF NOT EXISTS ix_fetches_content_hash ON fetches (content_hash);
+CREATE TABLE IF NOT EXISTS selector_evaluations (
+    content_hash TEXT NOT NULL,
+    params TEXT NOT NULL,
+    selector TEXT NOT NULL,
+    result TEXT NOT NULL,
+    PRIMARY KEY (content_hash, params, selector)
+);
+"""
+# 索引创建之后新增的列，打开旧的索引时补上
+_ADDED_COLUMNS = {
+    "segments": {"sealed": "INTEGER NOT NULL DEFAULT 0"},
+    "fetches": {"etag": "TEXT", "last_modified": "TEXT"},
+}
+
+
+class PageArchive:
+    """页面存档的读写入口。索引连接在首次使用时打开，一个进程内的多个线程共用并串行访问。"""
+
+    def __init__(self, directory: Optional[str] = None, enabled: Optional[bool] = None):
+        self.directory = directory or settings.PAGE_ARCHIVE_DIR
+        self.enabled = settings.PAGE_ARCHIVE_ENABLED if enabled is None else enabled
+        if self.enabled and not self.directory:
+            logger.warning("已开启页面存档但没有设置 PAGE_ARCHIVE_DIR，页面存档不生效。")
+            self.enabled = False
+        self.codec = "zstd" if zstandard is not None else "zlib"
+        self._db: Optional[sqlite3.Connection] = None
+        self._segment: Optional[str] = None
+        self._segment_size = 0
+        self._lock = threading.RLock()
+
+    # --- 内部工具 ---
+    def _connect(self) -> sqlite3.Connection:
+        if self._db is None:
+            os.makedirs(self.directory, exist_ok=True)
+            # 多个进程共用同一个索引：WAL 模式下读写互不阻塞，写入冲突时最多等待 timeout 秒
+            db = sqlite3.connect(os.path.join(self.directory, INDEX_FILENAME), timeout=30, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.executescript(_SCHEMA)
+            for table, columns in _ADDED_COLUMNS.items():
+                existing = {row[1] for row in db.execute(f"PRAGMA table_info({table})")}
+                for column, definition in columns.items():
+                    if column not in existing:
+                        db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+            # 写事务在第一条写语句之前以 BEGIN IMMEDIATE 开始，立即取得写锁，先检查后写入的操作不会与其他进程交错
+            db.isolation_level = "IMMEDIATE"
+            self._db = db
+        return self._db
+
+    def _compress(self, data: bytes) -> bytes:
+        if self.codec == "zstd":
+            return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+        return zlib.compress(data, ZLIB_LEVEL)
+
+    @staticmethod
+    def _decompress(codec: str, data: bytes) -> bytes:
+        if codec == "zstd":
+            if zstandard is None:
+                raise RuntimeError("zstandard is required to read zstd-compressed archive segments")
+            return zstandard.ZstdDecompressor().decompress(data)
+        return zlib.decompress(data)
+
+    def _current_segment(self, db: sqlite3.Connection) -> str:
+        """本进程正在追加的段文件；写满时换新文件并执行淘汰。"""
+        if self._segment is None or self._segment_size >= settings.PAGE_ARCHIVE_SEGMENT_BYTES:
+            if self._segment is not None:
+                with db:
+                    db.execute("UPDATE segments SET sealed = 1 WHERE name = ?", (self._segment,))
+                self._segment = None
+                self.evict()
+            now = time.time()
+            # 文件名以创建时间开头，包含进程ID，保证每个进程写自己的段文件
+            self._segment = f"{int(now * 1000)}-{os.getpid()}-{os.urandom(4).hex()}.seg"
+            self._segment_size = 0
+            with db:
+                db.execute(
+                    "INSERT INTO segments (name, codec, size, created_at, last_write_at) VALUES (?, ?, 0, ?, ?)",
+                    (self._segment, self.codec, now, now),
+                )
+        return self._segment
+
+    # --- 写入 ---
+    def put(self, url: str, html: str, source: str, headers: Optional[Dict[str, str]] = None) -> Optional[str]:
+        """
+        存档一次抓取，返回内容哈希。内容已存在时只追加抓取记录（并刷新其所在段的最近写入时间）。
+        headers 为主文档的响应头（键为小写），其中的 ETag 和 Last-Modified 用于之后确认页面是否变化。
+        存档未开启或写入失败时返回 None。
+        """
+        if not self.enabled:
+            return None
+        data = html.encode("utf-8")
+        content_hash = hashlib.sha256(data).hexdigest()
+        now = time.time()
+        fetch = (url, content_hash, now, source, (headers or {}).get("etag"), (headers or {}).get("last-modified"))
+        try:
+            with self._lock:
+                db = self._connect()
+                existing = db.execute(
+                    "SELECT b.segment FROM blobs b JOIN segments s ON s.name = b.segment WHERE b.content_hash = ?",
+                    (content_hash,),
+                ).fetchone()
+                if existing:
+                    with db:
+                        # 段文件在查询之后被淘汰时按新内容重新写入
+                        if db.execute("UPDATE segments SET last_write_at = ? WHERE name = ?", (now, existing[0])).rowcount:
+                            db.execute(
+                                "INSERT INTO fetches (url, content_hash, fetched_at, source, etag, last_modified) "
+                                "VALUES (?, ?, ?, ?, ?, ?)",
+                                fetch,
+                            )
+                            return content_hash
+
+                compressed = self._compress(data)
+                # 最多重试一次：本进程的段文件已被淘汰（如长时间没有写入而超过保留天数）时换新的段文件
+                for _ in range(2):
+                    segment = self._current_segment(db)
+                    with db:
+                        # 先确认段文件仍然登记在索引中；该语句取得写锁，追加完成并提交之前其他进程无法淘汰它
+                        if not db.execute("UPDATE segments SET last_write_at = ? WHERE name = ?", (now, segment)).rowcount:
+                            self._segment = None
+                            continue
+                        with open(os.path.join(self.directory, segment), "ab") as f:
+                            offset = f.tell()
+                            f.write(compressed)
+                        self._segment_size = offset + len(compressed)
+                        # 并发写入同一内容时以先提交的为准，后写入的字节成为段文件中的无用数据；
+                        # 已有记录指向的段文件已被淘汰时改为指向新写入的位置
+                        db.execute(
+                            "INSERT INTO blobs (content_hash, segment, offset, length, raw_size) VALUES (?, ?, ?, ?, ?) "
+                            "ON CONFLICT (content_hash) DO UPDATE SET segment = excluded.segment, offset = excluded.offset, "
+                            "length = excluded.length, raw_size = excluded.raw_size "
+                            "WHERE blobs.segment NOT IN (SELECT name FROM segments)",
+                            (content_hash, segment, offset, len(compressed), len(data)),
+                        )
+                        db.execute("UPDATE segments SET size = ? WHERE name = ?", (self._segment_size, segment))
+                        db.execute(
+                            "INSERT INTO fetches (url, content_hash, fetched_at, source, etag, last_modified) "
+                            "VALUES (?, ?, ?, ?, ?, ?)",
+                            fetch,
+                        )
+                        return content_hash
+            logger.warning(f"存档页面 '{url}' 失败: 段文件被反复淘汰。")
+            return None
+        except (OSError, sqlite3.Error) as e:
+            logger.warning(f"存档页面 '{url}' 失败: {e}")
+            return None
+
+    # --- 读取 ---
+    def get(self, content_hash: str) -> Optional[str]:
+        """按内容哈希读取页面，不存在（或已被淘汰）时返回 None。"""
+        if not self.enabled:
+            return None
+        try:
+            with self._lock:
+                row = self._connect().execute(
+                    "SELECT b.segment, b.offset, b.length, s.codec FROM blobs b JOIN segments s ON s.name = b.segment "
+                    "WHERE b.content_hash = ?",
+                    (content_hash,),
+                ).fetchone()
+            if row is None:
+                return None
+            segment, offset, length, codec = row
+            with open(os.path.join(self.directory, segment), "rb") as f:
+                f.seek(offset)
+                return self._decompress(codec, f.read(length)).decode("utf-8")
+        except (OSError, sqlite3.Error, RuntimeError, zlib.error) as e:
+            logger.warning(f"读取页面存档 {content_hash} 失败: {e}")
+            return None
+
+    def latest(self, url: str, max_age_seconds: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """
+        取某个URL最近一次存档的页面，返回 {"html", "content_hash", "fetched_at", "etag", "last_modified"}。
+        指定 max_age_seconds 时只接受该时间内的存档；没有符合条件的存档时返回 None。
+        """
+        if not self.enabled:
+            return None
+        min_fetched_at = time.time() - max_age_seconds if max_age_seconds else 0
+        try:
+            with self._lock:
+                row = self._connect().execute(
+                    "SELECT f.content_hash, f.fetched_at, f.etag, f.last_modified FROM fetches f JOIN blobs b ON b.content_hash = f.content_hash "
+                    "WHERE f.url = ? AND f.fetched_at >= ? ORDER BY f.fetched_at DESC LIMIT 1",
+                    (url, min_fetched_at),
+                ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"查询页面存档 '{url}' 失败: {e}")
+            return None
+        if row is None:
+            return None
+        html = self.get(row[0])
+        if html is None:
+            return None
+        return {"html": html, "content_hash": row[0], "fetched_at": row[1], "etag": row[2], "last_modified": row[3]}
+
+    # --- 选择器校验结果缓存 ---
+    def get_selector_evaluations(self, content_hash: str, params: str, selectors: List[str]) -> Dict[str, Any]:
+        """取同一份页面内容上已缓存的选择器校验结果，params 描述影响结果的校验参数。"""
+        if not self.enabled or not selectors:
+            return {}
+        placeholders = ",".join("?" for _ in selectors)
+        try:
+            with self._lock:
+                rows = self._connect().execute(
+                    f"SELECT selector, result FROM selector_evaluations "
+                    f"WHERE content_hash = ? AND params = ? AND selector IN ({placeholders})",
+                    (content_hash, params, *selectors),
+                ).fetchall()
+        except sqlite3.Error as e:
+            logger.warning(f"读取选择器校验缓存失败: {e}")
+            return {}
+        return {selector: json.loads(result) for selector, result in rows}
+
+    def save_selector_evaluations(self, content_hash: str, params: str, evaluations: Dict[str, Any]):
+        if not self.enabled or not evaluations:
+            return
+        try:
+            with self._lock:
+                db = self._connect()
+                with db:
+                    db.executemany(
+                        "INSERT OR REPLACE INTO selector_evaluations (content_hash, params, selector, result) VALUES (?, ?, ?, ?)",
+                        [(content_hash, params, selector, json.dumps(result, ensure_ascii=False)) for selector, result in evaluations.items()],
+                    )
+        except sqlite3.Error as e:
+            logger.warning(f"保存选择器校验缓存失败: {e}")
+
+    # --- 淘汰 ---
+    def evict(self) -> List[str]:
+        """按大小和保留时间淘汰段文件（不包括本进程正在写入的段），返回被删除的段文件名。"""
+        if not self.enabled:
+            return []
+        cutoff = time.time() - settings.PAGE_ARCHIVE_MAX_AGE_DAYS * 86400
+        try:
+            with self._lock:
+                db = self._connect()
+                segments = db.execute(
+                    "SELECT name, size, last_write_at, sealed FROM segments ORDER BY last_write_at"
+                ).fetchall()
+                total = sum(size for _, size, _, _ in segments)
+                candidates = []
+                for name, size, last_write_at, sealed in segments:
+                    if name == self._segment:
+                        continue
+                    # 仍在被追加的段只按保留天数淘汰，不因总大小被淘汰
+                    if last_write_at < cutoff or (sealed and total > settings.PAGE_ARCHIVE_MAX_BYTES):
+                        candidates.append((name, last_write_at))
+                        total -= size
+                victims = []
+                for name, last_write_at in candidates:
+                    with db:
+                        # 检查之后又有写入（去重命中或追加）的段不再淘汰
+                        if not db.execute(
+                            "DELETE FROM segments WHERE name = ? AND last_write_at = ?", (name, last_write_at)
+                        ).rowcount:
+                            continue
+                        hashes = "SELECT content_hash FROM blobs WHERE segment = ?"
+                        db.execute(f"DELETE FROM fetches WHERE content_hash IN ({hashes})", (name,))
+                        db.execute(f"DELETE FROM selector_evaluations WHERE content_hash IN ({hashes})", (name,))
+                        db.execute("DELETE FROM blobs WHERE segment = ?", (name,))
+                    victims.append(name)
+                    try:
+                        os.remove(os.path.join(self.directory, name))
+                    except FileNotFoundError:
+                        pass
+            if victims:
+                logger.info(f"页面存档淘汰了 {len(victims)} 个段文件。")
+            return victims
+        except (OSError, sqlite3.Error) as e:
+            logger.warning(f"淘汰页面存档失败: {e}")
+            return []
+
+
+# 进程级的共享实例
+page_archive = PageArchive()
@@ -0,0 +1,374 @@
+"""
+按需开启的采样性能剖析。
+
+开启后，提取器每 N 条消息、FastAPI 服务每 N 个请求在剖析下运行一次：后台线程每隔 PROFILING_INTERVAL_MS
+采集一次处理线程的调用栈，结束时把折叠后的调用栈计数连同元数据（消息的抓取配置ID和URL，或请求的路径）
+保存为 PROFILING_DIR 中的一个JSON文件。未被选中的消息和请求只多一次计数器递增，没有其他开销。
+
+开关和采样间隔保存在 Redis 中，通过任意 FastAPI 服务的 PUT /admin/profiling 修改后，
+所有服务（包括没有HTTP接口的提取器）在 STATE_REFRESH_INTERVAL 秒内生效；Redis 不可用时沿用本地的设置。
+GET /admin/profiling/stacks 把本机保存的剖析结果汇总为折叠调用栈格式（每行 "帧1;帧2;... 次数"），
+可以直接交给 flamegraph.pl、speedscope 等工具生成火焰图。
+
+异步服务的请求与其他请求共享事件循环线程，而采样只能按线程进行（3.11 无法从其他线程判断正在运行的是哪个任务），
+因此 "request" 剖析是请求期间（从进入中间件到响应体发送完毕）整个事件循环的样本：其中包括同时在处理的其他请求
+和事件循环空闲时的等待 (selectors.py:select)，元数据中的 scope 为 "event_loop"，
+concurrent_requests 记录期间同时在处理的最大请求数，为 1 时样本才可以完全归于该请求。
+提取器逐条同步处理消息，"message" 剖析的 scope 为 "thread"，样本只属于该消息。
+剖析结果的写入和旧文件的清理在线程池中进行，不阻塞事件循环。
+"""
+import asyncio
+import itertools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Optional, Set
+
+import redis
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import PlainTextResponse
+from starlette.background import BackgroundTask
+from pydantic import BaseModel
+
+# 导入共享模块
+from shared.config import settings
+from shared.redis_client import get_async_redis, get_redis
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+PROFILING_STATE_KEY = "intelliscrape:profiling"
+# 从 Redis 重新读取开关的间隔 (秒)
+STATE_REFRESH_INTERVAL = 5
+# 单个调用栈保留的最大帧数，过深的递归截断在最外层
+MAX_STACK_DEPTH = 128
+# 单次剖析最长的采样时间 (秒)，防止没有正常结束的剖析（如响应发送中断）一直采样
+MAX_PROFILE_SECONDS = 300
+
+_PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 当前正在剖析的元数据，供处理过程中补充 (annotate)
+_active_profile: ContextVar[Optional[Dict[str, Any]]] = ContextVar("active_profile", default=None)
+
+def _frame_name(code) -> str:
+    filename = code.co_filename
+    if filename.startswith(_PROJECT_ROOT):
+        filename = os.path.relpath(filename, _PROJECT_ROOT)
+    else:
+        filename = os.path.basename(filename)
+    return f"{filename}:{code.co_name}"
+
+
+class StackSampler:
+    """在后台线程中定时采集目标线程的调用栈，按折叠格式 ("外层;...;内层") 计数。"""
+
+    def __init__(self, thread_id: int, interval: float):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profiling-sampler", daemon=True)
+
+    def _run(self):
+        deadline = time.monotonic() + MAX_PROFILE_SECONDS
+        while not self._stop.wait(self.interval) and time.monotonic() < deadline:
+            frame = sys._current_frames().get(self.thread_id)
+            names = []
+            while frame is not None and len(names) < MAX_STACK_DEPTH:
+                names.append(_frame_name(frame.f_code))
+                frame = frame.f_back
+            if names:
+                self.stacks[";".join(reversed(names))] += 1
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+class ActiveProfile:
+    """一次进行中的剖析：创建时在当前线程上开始采样，stop 后由 Profiler 保存。可以重复调用 stop。"""
+
+    def __init__(self, kind: str, interval: float, metadata: Dict[str, Any]):
+        self.metadata = {"kind": kind, "pid": os.getpid(), **metadata}
+        self.metadata["started_at"] = time.time()
+        self.interval = interval
+        self._started_perf = time.perf_counter()
+        self._sampler = StackSampler(threading.get_ident(), interval).__enter__()
+        self.stopped = False
+
+    def stop(self) -> Counter:
+        if self.stopped:
+            return self._sampler.stacks
+        self.stopped = True
+        self._sampler.__exit__(None, None, None)
+        self.metadata.update(
+            duration_ms=round((time.perf_counter() - self._started_perf) * 1000, 3),
+            interval_ms=round(self.interval * 1000, 3),
+        )
+        return self._sampler.stacks
+
+
+class Profiler:
+    """每 N 次调用选中一次进行剖析，开关通过 Redis 在所有进程之间同步。线程安全。"""
+
+    def __init__(self, directory: Optional[str] = None):
+        self.directory = directory or settings.PROFILING_DIR
+        self.enabled = settings.PROFILING_ENABLED
+        self.sample_every = max(1, settings.PROFILING_SAMPLE_EVERY)
+        self.interval = settings.PROFILING_INTERVAL_MS / 1000
+        self._counter = itertools.count(1)
+        self._refreshed_at = 0.0
+        self._refresh_task = None
+        self._lock = threading.Lock()
+
+    # --- 开关 ---
+    def state(self) -> Dict[str, Any]:
+        return {"enabled": self.enabled, "sample_every": self.sample_every, "interval_ms": round(self.interval * 1000)}
+
+    def _apply(self, raw) -> None:
+        if raw:
+            state = json.loads(raw)
+            self.enabled = bool(state.get("enabled", self.enabled))
+            self.sample_every = max(1, int(state.get("sample_every", self.sample_every)))
+
+    def _refresh_due(self) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            if now - self._refreshed_at < STATE_REFRESH_INTERVAL:
+                return False
+            self._refreshed_at = now
+            return True
+
+    def refresh(self):
+        """（同步）按需从 Redis 读取开关。"""
+        if not self._refresh_due():
+            return
+        try:
+            self._apply(get_redis().get(PROFILING_STATE_KEY))
+        except (redis.RedisError, ValueError) as e:
+            logger.warning(f"读取性能剖析开关失败，沿用本地设置: {e}")
+
+    async def refresh_async(self):
+        """（异步）按需从 Redis 读取开关。"""
+        if self._refresh_due():
+            await self._refresh_now_async()
+
+    def schedule_refresh(self):
+        """需要时在后台读取开关，不阻塞当前请求（Redis 不可用时请求不必等待连接超时）。"""
+        if self._refresh_due():
+            self._refresh_task = asyncio.get_running_loop().create_task(self._refresh_now_async())
+
+    async def _refresh_now_async(self):
+        try:
+            self._apply(await get_async_redis().get(PROFILING_STATE_KEY))
+        except (redis.RedisError, ValueError) as e:
+            logger.warning(f"读取性能剖析开关失败，沿用本地设置: {e}")
+
+    async def set_state_async(self, enabled: bool, sample_every: Optional[int] = None) -> Dict[str, Any]:
+        """修改开关并写入 Redis；Redis 写入失败时抛出 redis.RedisError，本进程的设置仍然生效。"""
+        self.enabled = enabled
+        if sample_every:
+            self.sample_every = max(1, sample_every)
+        await get_async_redis().set(PROFILING_STATE_KEY, json.dumps({"enabled": self.enabled, "sample_every": self.sample_every}))
+        return self.state()
+
+    def should_sample(self) -> bool:
+        if not self.enabled:
+            return False
+        return next(self._counter) % self.sample_every == 0
+
+    # --- 剖析 ---
+    def start(self, kind: str, **metadata: Any) -> ActiveProfile:
+        """在当前线程上开始剖析，结束时调用 finish / finish_async 保存结果。"""
+        return ActiveProfile(kind, self.interval, metadata)
+
+    def finish(self, active: ActiveProfile):
+        self._save(active.metadata, active.stop())
+
+    async def finish_async(self, active: ActiveProfile):
+        """停止采样，并在线程池中保存结果，不阻塞事件循环。已经结束的剖析不再重复保存。"""
+        if active.stopped:
+            return
+        stacks = active.stop()
+        await asyncio.to_thread(self._save, active.metadata, stacks)
+
+    @contextmanager
+    def profile(self, kind: str, **metadata: Any):
+        """（同步）在剖析下运行代码块，结束时保存结果。代码块中可以调用 annotate 补充元数据。"""
+        active = self.start(kind, scope="thread", **metadata)
+        token = _active_profile.set(active.metadata)
+        try:
+            yield active.metadata
+        finally:
+            _active_profile.reset(token)
+            self.finish(active)
+
+    @staticmethod
+    def annotate(**metadata: Any):
+        """为当前正在进行的剖析补充元数据；没有在剖析时什么也不做。"""
+        active = _active_profile.get()
+        if active is not None:
+            active.update(metadata)
+
+    def _save(self, metadata: Dict[str, Any], stacks: Counter):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            # 文件名以开始时间开头，按名称排序即按时间排序
+            filename = f"{int(metadata['started_at'] * 1000)}-{metadata['kind']}-{os.getpid()}-{os.urandom(4).hex()}.json"
+            with open(os.path.join(self.directory, filename), "w", encoding="utf-8") as f:
+                json.dump({**metadata, "stacks": dict(stacks)}, f, ensure_ascii=False, default=str)
+            self._evict()
+        except OSError as e:
+            logger.warning(f"保存性能剖析结果失败: {e}")
+
+    def _evict(self):
+        files = sorted(name for name in os.listdir(self.directory) if name.endswith(".json"))
+        for name in files[:max(0, len(files) - settings.PROFILING_MAX_FILES)]:
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+
+    # --- 汇总 ---
+    def aggregate(self, kind: Optional[str] = None, since: Optional[float] = None) -> Dict[str, Any]:
+        """汇总本机保存的剖析结果，返回 {"profiles": 参与汇总的文件数, "stacks": 折叠调用栈 -> 样本数}。"""
+        totals: Counter = Counter()
+        profiles = 0
+        if not os.path.isdir(self.directory):
+            return {"profiles": 0, "stacks": {}}
+        for name in sorted(os.listdir(self.directory)):
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.directory, name), encoding="utf-8") as f:
+                    profile = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if kind and profile.get("kind") != kind:
+                continue
+            if since and profile.get("started_at", 0) < since:
+                continue
+            totals.update(profile.get("stacks") or {})
+            profiles += 1
+        return {"profiles": profiles, "stacks": dict(totals)}
+
+
+# 进程级的共享实例
+profiler = Profiler()
+
+# 本进程正在处理的请求数，以及正在剖析的请求；用于判断 "request" 剖析的样本能否归于单个请求
+_requests_in_flight = 0
+_request_profiles: Set[ActiveProfile] = set()
+
+def _enter_request():
+    global _requests_in_flight
+    _requests_in_flight += 1
+    for active in _request_profiles:
+        active.metadata["concurrent_requests"] = max(active.metadata["concurrent_requests"], _requests_in_flight)
+
+def _exit_request():
+    global _requests_in_flight
+    _requests_in_flight -= 1
+
+async def profile_requests(request, call_next):
+    """
+    FastAPI 的 HTTP 中间件：开启剖析时每 N 个请求剖析一次，元数据中记录请求方法和路径。
+    剖析在响应体发送完毕后结束（流式响应也包括在内），样本是这段时间内整个事件循环的调用栈。
+    用法：app.middleware("http")(profile_requests)
+    """
+    profiler.schedule_refresh()
+    _enter_request()
+    if not profiler.should_sample():
+        try:
+            return await call_next(request)
+        finally:
+            _exit_request()
+
+    active = profiler.start(
+        "request", scope="event_loop", method=request.method, path=request.url.path,
+        concurrent_requests=_requests_in_flight,
+    )
+    _request_profiles.add(active)
+
+    async def finish():
+        if not active.stopped:
+            _request_profiles.discard(active)
+            _exit_request()
+            await profiler.finish_async(active)
+
+    token = _active_profile.set(active.metadata)
+    try:
+        response = await call_next(request)
+    except BaseException:
+        await finish()
+        raise
+    finally:
+        _active_profile.reset(token)
+    active.metadata["status_code"] = response.status_code
+
+    # 响应体发送完毕（或发送中断、生成器被关闭）时结束剖析；响应体没有被读取时由后台任务结束
+    body_iterator = response.body_iterator
+
+    async def profiled_body():
+        try:
+            async for chunk in body_iterator:
+                yield chunk
+        finally:
+            await finish()
+
+    original_background = response.background
+
+    async def run_background():
+        try:
+            if original_background is not None:
+                await original_background()
+        finally:
+            await finish()
+
+    response.body_iterator = profiled_body()
+    response.background = BackgroundTask(run_background)
+    return response
+
+# --- 管理端点 ---
+class ProfilingState(BaseModel):
+    enabled: bool
+    sample_every: Optional[int] = None
+
+profiling_router = APIRouter(prefix="/admin/profiling", tags=["Maintenance"])
+
+@profiling_router.get("", summary="查看性能剖析的开关")
+async def get_profiling_state():
+    await profiler.refresh_async()
+    return profiler.state()
+
+@profiling_router.put("", summary="开启或关闭性能剖析（对所有服务生效）")
+async def set_profiling_state(state: ProfilingState):
+    if state.sample_every is not None and state.sample_every < 1:
+        raise HTTPException(status_code=422, detail="sample_every must be at least 1.")
+    try:
+        return await profiler.set_state_async(state.enabled, state.sample_every)
+    except redis.RedisError as e:
+        raise HTTPException(status_code=503, detail=f"Profiling state changed for this process only, Redis is unavailable: {e}")
+
+@profiling_router.get("/stacks", summary="下载汇总的折叠调用栈 (火焰图格式)", response_class=PlainTextResponse)
+def download_stacks(
+    kind: Optional[str] = Query(None, regex="^(message|request)$"),
+    since: Optional[float] = Query(None, description="只汇总该 Unix 时间之后开始的剖析"),
+):
+    """
+    返回本机保存的剖析结果汇总后的折叠调用栈，每行 "帧1;帧2;... 样本数"，可直接用于生成火焰图。
+    request 剖析是整个事件循环的样本（见模块说明），需要单个请求的归因时按 kind=message 或低并发时段的结果分析。
+    """
+    result = profiler.aggregate(kind, since)
+    body = "".join(f"{stack} {count}\n" for stack, count in sorted(result["stacks"].items()))
+    return PlainTextResponse(body, headers={"X-Profile-Count": str(result["profiles"])})
@@ -0,0 +1,45 @@
+"""
+Redis 客户端的进程级单例。
+
+同步客户端供提取器 (pika 消费者) 和 Celery 任务使用，异步客户端供 FastAPI 服务使用。
+客户端在首次使用时才创建，未使用 Redis 的服务不会建立连接。
+"""
+from typing import Optional
+
+import redis
+import redis.asyncio as aioredis
+
+# 导入共享配置
+from shared.config import settings
+
+# 连接和读写超时（秒）。Redis 只用于缓存和通知，宁可快速失败走降级路径，也不要拖慢请求
+REDIS_SOCKET_TIMEOUT = 0.5
+
+_sync_client: Optional[redis.Redis] = None
+_async_client: Optional[aioredis.Redis] = None
+
+def get_redis() -> redis.Redis:
+    global _sync_client
+    if _sync_client is None:
+        _sync_client = redis.Redis.from_url(
+            settings.REDIS_URL,
+            socket_timeout=REDIS_SOCKET_TIMEOUT,
+            socket_connect_timeout=REDIS_SOCKET_TIMEOUT,
+        )
+    return _sync_client
+
+def get_async_redis() -> aioredis.Redis:
+    global _async_client
+    if _async_client is None:
+        _async_client = aioredis.Redis.from_url(
+            settings.REDIS_URL,
+            socket_timeout=REDIS_SOCKET_TIMEOUT,
+            socket_connect_timeout=REDIS_SOCKET_TIMEOUT,
+        )
+    return _async_client
+
+async def close_async_redis():
+    global _async_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
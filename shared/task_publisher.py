@@ -0,0 +1,114 @@
+"""
+向 Celery Broker 发送任务的轻量级客户端。
+
+BFF 等服务只需要按名称投递任务（相当于 celery_app.send_task），不需要执行任务。
+导入 services.orchestrator.celery_app 会加载完整的 Celery 应用、结果后端和所有任务模块
+（连带 SQLAlchemy 同步引擎、pika、requests 等），拖慢每个 worker 的冷启动并增加内存占用。
+这里直接用 kombu（Celery 自身使用的消息库）按 Celery 任务消息协议 v2 发布消息，
+由 Orchestrator 的 Celery worker 照常消费。连接在第一次发送任务时才建立，之后从连接池复用。
+"""
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from typing import Any, Dict, Optional, Sequence
+
+# 导入共享配置
+from shared.config import settings
+from shared.tracing import tracer
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 与 Celery 默认配置一致的交换机、队列和路由键
+DEFAULT_QUEUE = "celery"
+
+# 连接 Broker 失败时的重试策略：快速失败，由调用方决定如何处理
+_RETRY_POLICY = {"max_retries": 2, "interval_start": 0, "interval_step": 0.5, "interval_max": 1}
+
+
+class TaskPublisher:
+    """按任务名称向 Broker 发布 Celery 任务消息，接口与 Celery.send_task 的常用部分一致。"""
+
+    def __init__(self, broker_url: Optional[str] = None, queue_name: str = DEFAULT_QUEUE):
+        self.broker_url = broker_url or settings.CELERY_BROKER_URL
+        self.queue_name = queue_name
+        self._connection = None
+        self._queue = None
+        self._lock = threading.Lock()
+        self._origin = f"{os.getpid()}@{socket.gethostname()}"
+
+    def _ensure_connection(self):
+        # kombu 在第一次发送时才导入，未发送任务的进程不承担导入开销
+        if self._connection is None:
+            with self._lock:
+                if self._connection is None:
+                    from kombu import Connection, Exchange, Queue
+
+                    exchange = Exchange(self.queue_name, type="direct")
+                    self._queue = Queue(self.queue_name, exchange, routing_key=self.queue_name)
+                    self._connection = Connection(self.broker_url)
+        return self._connection
+
+    def send_task(
+        self,
+        name: str,
+        args: Sequence[Any] = (),
+        kwargs: Optional[Dict[str, Any]] = None,
+        headers: Optional[Dict[str, Any]] = None,
+    ) -> str:
+        """
+        发布一个任务并返回任务ID。Broker 不可用时抛出异常（与 celery_app.send_task 相同）。
+        headers 中的键会合并到消息头中。当前的追踪上下文 (traceparent) 和发送时间 (sent_at) 会自动附加，
+        Celery worker 据此把任务关联到同一个 trace 并计算排队等待时间。
+        """
+        connection = self._ensure_connection()
+        task_id = str(uuid.uuid4())
+        kwargs = kwargs or {}
+        with tracer.span(f"send_task {name}", task_id=task_id):
+            self._publish(connection, name, task_id, args, kwargs, {**tracer.inject(), "sent_at": time.time(), **(headers or {})})
+        logger.info(f"已发送任务 '{name}'，ID: {task_id}")
+        return task_id
+
+    def _publish(self, connection, name: str, task_id: str, args: Sequence[Any], kwargs: Dict[str, Any], headers: Dict[str, Any]):
+        from kombu.pools import producers
+
+        message_headers = {
+            "lang": "py",
+            "task": name,
+            "id": task_id,
+            "shadow": None,
+            "eta": None,
+            "expires": None,
+            "group": None,
+            "group_index": None,
+            "retries": 0,
+            "timelimit": [None, None],
+            "root_id": task_id,
+            "parent_id": None,
+            "argsrepr": repr(tuple(args)),
+            "kwargsrepr": repr(kwargs),
+            "origin": self._origin,
+            "ignore_result": False,
+            **headers,
+        }
+        body = (list(args), kwargs, {"callbacks": None, "errbacks": None, "chain": None, "chord": None})
+
+        with producers[connection].acquire(block=True) as producer:
+            producer.publish(
+                body,
+                exchange=self._queue.exchange,
+                routing_key=self.queue_name,
+                serializer="json",
+                headers=message_headers,
+                correlation_id=task_id,
+                declare=[self._queue],
+                retry=True,
+                retry_policy=_RETRY_POLICY,
+            )
+
+
+# 进程级的共享实例
+task_publisher = TaskPublisher()
@@ -0,0 +1,161 @@
+"""
+跨服务的链路追踪：一次抓取从 BFF 经过 Celery (execute_crawl_task)、RabbitMQ (extraction_queue) 到提取器，
+各段耗时记录在同一个 trace 下，可以看出时间花在了哪一跳、排队等待还是浏览器上。
+
+追踪上下文使用 W3C Trace Context 的 traceparent 格式 ("00-<trace_id>-<span_id>-01")，
+与 OpenTelemetry 的传播格式一致：
+- HTTP 请求：请求头 traceparent（BFF 没有收到时新建 trace，并在响应头 X-Trace-Id 中返回 trace ID）；
+- Celery 任务：消息头 traceparent，另有 sent_at 记录发送时间；
+- RabbitMQ 消息：AMQP 属性的 headers 中的 traceparent 和 published_at。
+
+每个 span 结束时导出为一行JSON（trace_id、span_id、parent_span_id、服务名、开始时间、耗时和属性），
+TRACING_EXPORTER 为 console 时写入日志，为 file 时追加到 TRACING_FILE，便于离线分析；默认 none 只传播不导出。
+排队等待时间由发布方写入的时间戳与消费方取到消息的时间之差得到，记录为名为 "*.queue_wait" 的 span。
+"""
+import json
+import logging
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Optional
+
+# 导入共享配置
+from shared.config import settings
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+TRACEPARENT_HEADER = "traceparent"
+TRACE_ID_RESPONSE_HEADER = "X-Trace-Id"
+
+_TRACEPARENT_PATTERN = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$")
+
+# 当前协程或线程中正在进行的 span，值为 (trace_id, span_id)
+_current_span: ContextVar[Optional[tuple]] = ContextVar("current_span", default=None)
+
+def parse_traceparent(value: Optional[str]) -> Optional[tuple]:
+    """解析 traceparent，返回 (trace_id, span_id)；格式不合法时返回 None。"""
+    match = _TRACEPARENT_PATTERN.match((value or "").strip().lower())
+    return (match.group(1), match.group(2)) if match else None
+
+
+class Tracer:
+    """创建 span、在线程/协程间维护当前 span，并按 TRACING_EXPORTER 导出结束的 span。"""
+
+    def __init__(self, exporter: Optional[str] = None, file_path: Optional[str] = None):
+        self.exporter = (exporter or settings.TRACING_EXPORTER).lower()
+        self.file_path = file_path or settings.TRACING_FILE
+        self.service_name = "unknown"
+        self._file = None
+        self._lock = threading.Lock()
+
+    def set_service(self, service_name: str):
+        """设置导出的 span 中的服务名，各服务在入口模块中调用一次。"""
+        self.service_name = service_name
+
+    def current_trace_id(self) -> Optional[str]:
+        current = _current_span.get()
+        return current[0] if current else None
+
+    def traceparent(self) -> Optional[str]:
+        """当前 span 的 traceparent，用于传给下游；没有进行中的 span 时返回 None。"""
+        current = _current_span.get()
+        return f"00-{current[0]}-{current[1]}-01" if current else None
+
+    def inject(self) -> Dict[str, str]:
+        """需要附加到下游请求或消息头中的追踪字段。"""
+        traceparent = self.traceparent()
+        return {TRACEPARENT_HEADER: traceparent} if traceparent else {}
+
+    @contextmanager
+    def span(self, name: str, parent: Optional[str] = None, **attributes: Any):
+        """
+        记录一个 span，代码块内新建的 span 以它为父节点。
+        parent 为上游传来的 traceparent；不指定时使用当前的 span，两者都没有时新建 trace。
+        代码块抛出的异常会记录在 span 中并继续向上抛出。
+        """
+        parent_context = parse_traceparent(parent) if parent else _current_span.get()
+        trace_id = parent_context[0] if parent_context else os.urandom(16).hex()
+        span_id = os.urandom(8).hex()
+        token = _current_span.set((trace_id, span_id))
+        start = time.time()
+        started = time.perf_counter()
+        status = "ok"
+        try:
+            yield attributes
+        except BaseException as e:
+            status = "error"
+            attributes["error"] = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            _current_span.reset(token)
+            self._export({
+                "trace_id": trace_id,
+                "span_id": span_id,
+                "parent_span_id": parent_context[1] if parent_context else None,
+                "name": name,
+                "service": self.service_name,
+                "start": start,
+                "duration_ms": round((time.perf_counter() - started) * 1000, 3),
+                "status": status,
+                "attributes": attributes,
+            })
+
+    def record_queue_wait(self, name: str, published_at: Any, parent: Optional[str] = None, **attributes: Any) -> Optional[float]:
+        """
+        根据发布方写入的时间戳 (Unix 秒) 记录排队等待的 span，返回等待时间 (秒)。
+        时间戳缺失或无法解析时不记录。不同主机之间的时钟偏差会直接反映在结果中。
+        """
+        try:
+            published_at = float(published_at)
+        except (TypeError, ValueError):
+            return None
+        wait_seconds = max(0.0, time.time() - published_at)
+        parent_context = parse_traceparent(parent) if parent else _current_span.get()
+        if parent_context:
+            self._export({
+                "trace_id": parent_context[0],
+                "span_id": os.urandom(8).hex(),
+                "parent_span_id": parent_context[1],
+                "name": name,
+                "service": self.service_name,
+                "start": published_at,
+                "duration_ms": round(wait_seconds * 1000, 3),
+                "status": "ok",
+                "attributes": attributes,
+            })
+        return wait_seconds
+
+    def _export(self, record: Dict[str, Any]):
+        if self.exporter == "none":
+            return
+        line = json.dumps(record, ensure_ascii=False, default=str)
+        if self.exporter == "console":
+            logger.info(f"span {line}")
+            return
+        try:
+            with self._lock:
+                if self._file is None:
+                    self._file = open(self.file_path, "a", buffering=1, encoding="utf-8")
+                self._file.write(line + "\n")
+        except OSError as e:
+            logger.warning(f"写入追踪文件 '{self.file_path}' 失败: {e}")
+
+
+# 进程级的共享实例
+tracer = Tracer()
+
+async def trace_requests(request, call_next):
+    """
+    FastAPI 的 HTTP 中间件：每个请求记录一个 span，沿用请求头中的 traceparent（没有时新建 trace），
+    并在响应头 X-Trace-Id 中返回 trace ID，便于把前端看到的请求与后端的日志和 span 对应起来。
+    用法：app.middleware("http")(trace_requests)
+    """
+    with tracer.span(f"{request.method} {request.url.path}", parent=request.headers.get(TRACEPARENT_HEADER)) as attributes:
+        response = await call_next(request)
+        attributes["http.status_code"] = response.status_code
+        response.headers[TRACE_ID_RESPONSE_HEADER] = tracer.current_trace_id()
+        return response
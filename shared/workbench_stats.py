@@ -0,0 +1,134 @@
+"""
+标准化工作台的增量聚合统计 (workbench_stats)。
+
+工作台需要按 (字段名, 选择器) 汇总某个主题下所有已完成的原始分析结果。
+如果每次打开工作台都加载全部 raw_fields_json 并在Python中重新聚合，耗时会随分析次数线性增长。
+这里在每条分析结果完成时，把它对各个计数的贡献以 UPSERT (count = count + excluded.count) 的方式
+累加到 workbench_stats 表中，与更新分析状态在同一个事务里提交；工作台只需读取该主题的统计行。
+计数规则与原先在工作台接口中的聚合完全一致，统计出现偏差时可以调用 rebuild_workbench_stats 重新计算。
+
+统计表上线前完成的分析结果不会自动计入，部署后需要调用一次 POST /themes/workbench/rebuild 回填所有主题。
+在 PostgreSQL 上，重建持有该主题的排他 advisory 锁，增量累加持有共享锁：重建与正在提交的分析结果
+互相等待，不会重复计数或遗漏；不同分析结果的增量之间互不阻塞。
+"""
+import logging
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import delete, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+# 导入共享模块
+from shared.db.dialect_insert import dialect_insert
+from shared.models.core_models import RawAnalysisResult, WorkbenchStat
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 主题级和字段级汇总行在 field_name / selector 中使用的占位值
+SUMMARY_KEY = ""
+
+def build_workbench_increments(theme_name: str, raw_fields_json: Optional[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    计算一条已完成的分析结果对工作台统计的贡献，返回待累加的统计行（按主键排序）。
+    - 主题级汇总行：分析结果数 +1（即使LLM没有给出任何字段）；
+    - 字段级汇总行：同一条结果中的字段名只计一次；
+    - 选择器行：每次出现都计数，带有校验信息 ("valid") 时同时累加校验次数和命中次数。
+    """
+    counters: Dict[tuple, Dict[str, int]] = defaultdict(lambda: {"count": 0, "validated_count": 0, "hit_count": 0})
+    counters[(SUMMARY_KEY, SUMMARY_KEY)]["count"] += 1
+
+    fields = (raw_fields_json or {}).get("fields") or []
+    seen_fields_in_source = set()
+    for field in fields:
+        field_name = field.get("field_name")
+        selector = field.get("selector")
+        if not field_name or not selector:
+            continue
+
+        stat = counters[(field_name, selector)]
+        stat["count"] += 1
+        if "valid" in field:
+            stat["validated_count"] += 1
+            if field["valid"]:
+                stat["hit_count"] += 1
+
+        if field_name not in seen_fields_in_source:
+            counters[(field_name, SUMMARY_KEY)]["count"] += 1
+            seen_fields_in_source.add(field_name)
+
+    # 按主键顺序写入，使并发的UPSERT以相同的顺序加锁，避免死锁
+    return [
+        {"theme_name": theme_name, "field_name": field_name, "selector": selector, **values}
+        for (field_name, selector), values in sorted(counters.items())
+    ]
+
+async def _lock_theme(db: AsyncSession, theme_name: str, shared: bool):
+    """在 PostgreSQL 上获取该主题的事务级 advisory 锁，事务结束时自动释放；其他数据库上不做任何事。"""
+    if db.get_bind().dialect.name != "postgresql":
+        return
+    lock_function = func.pg_advisory_xact_lock_shared if shared else func.pg_advisory_xact_lock
+    await db.execute(select(lock_function(func.hashtext(f"workbench_stats:{theme_name}"))))
+
+async def _upsert_stats(db: AsyncSession, rows: List[Dict[str, Any]]):
+    statement = dialect_insert(db.get_bind().dialect.name)(WorkbenchStat).values(rows)
+    table = WorkbenchStat.__table__
+    statement = statement.on_conflict_do_update(
+        index_elements=[table.c.theme_name, table.c.field_name, table.c.selector],
+        set_={
+            "count": table.c.count + statement.excluded.count,
+            "validated_count": table.c.validated_count + statement.excluded.validated_count,
+            "hit_count": table.c.hit_count + statement.excluded.hit_count,
+        },
+    )
+    await db.execute(statement)
+
+async def apply_workbench_increments(db: AsyncSession, rows: List[Dict[str, Any]]):
+    """
+    把统计增量累加到 workbench_stats 中。不提交事务，由调用方与分析状态的更新一起提交。
+    仅支持 PostgreSQL 和 SQLite（两者都支持 ON CONFLICT DO UPDATE）。
+    """
+    if not rows:
+        return
+    await _lock_theme(db, rows[0]["theme_name"], shared=True)
+    await _upsert_stats(db, rows)
+
+async def rebuild_workbench_stats(db: AsyncSession, theme_name: str) -> int:
+    """
+    根据该主题所有已完成的原始分析结果重新计算统计，返回参与计算的分析结果数。
+    在同一个事务中先删除旧统计再写入，读取方不会看到中间状态。不提交事务，
+    该主题的锁持有到事务结束，调用方应尽快提交。
+    """
+    await _lock_theme(db, theme_name, shared=False)
+    await db.execute(delete(WorkbenchStat).where(WorkbenchStat.theme_name == theme_name))
+
+    results = (await db.execute(
+        select(RawAnalysisResult.raw_fields_json).where(
+            RawAnalysisResult.theme_name == theme_name,
+            RawAnalysisResult.status == "completed",
+        )
+    )).scalars().all()
+
+    totals: Dict[tuple, Dict[str, Any]] = {}
+    for raw_fields_json in results:
+        for row in build_workbench_increments(theme_name, raw_fields_json):
+            key = (row["field_name"], row["selector"])
+            if key not in totals:
+                totals[key] = row
+            else:
+                for column in ("count", "validated_count", "hit_count"):
+                    totals[key][column] += row[column]
+
+    if totals:
+        await _upsert_stats(db, [totals[key] for key in sorted(totals)])
+    logger.info(f"已根据 {len(results)} 条分析结果重建主题 '{theme_name}' 的工作台统计。")
+    return len(results)
+
+async def list_analyzed_themes(db: AsyncSession) -> List[str]:
+    """有已完成的原始分析结果的所有主题，用于全量回填。"""
+    return (await db.execute(
+        select(RawAnalysisResult.theme_name)
+        .where(RawAnalysisResult.status == "completed")
+        .distinct()
+        .order_by(RawAnalysisResult.theme_name)
+    )).scalars().all()
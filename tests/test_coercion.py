@@ -0,0 +1,61 @@
+from decimal import Decimal
+
+import pytest
+
+from shared.coercion import CoercionError, parse_integer, parse_numeric
+
+
+@pytest.mark.parametrize("raw, locale, expected", [
+    ("1,234.5", "en", Decimal("1234.5")),
+    ("1 234", "en", Decimal("1234")),
+    ("1234567.89", "en", Decimal("1234567.89")),
+    ("-1,234", "en", Decimal("-1234")),
+    ("(300)", "en", Decimal("-300")),
+    (".5", "en", Decimal("0.5")),
+    ("3K", "en", Decimal("3000")),
+    ("5 m²", "en", Decimal("5")),
+    ("1,234, 另加运费", "en", Decimal("1234")),
+    ("1.234,5", "de", Decimal("1234.5")),
+    (",5", "de", Decimal("0.5")),
+    ("1 234,5", "fr", Decimal("1234.5")),
+    ("1 234,5", "fr", Decimal("1234.5")),
+    ("1'234.5", "de_CH", Decimal("1234.5")),
+    ("¥1.2万", "zh", Decimal("12000")),
+    ("共 12 件。", "zh", Decimal("12")),
+])
+def test_parse_numeric(raw, locale, expected):
+    assert parse_numeric(raw, locale) == expected
+
+
+@pytest.mark.parametrize("raw, locale, expected", [
+    ("12%", "en", Decimal("0.12")),
+    ("12.5 %", "en", Decimal("0.125")),
+    ("５０％", "zh", Decimal("0.5")),
+    ("3‰", "en", Decimal("0.003")),
+])
+def test_parse_numeric_percent(raw, locale, expected):
+    assert parse_numeric(raw, locale) == expected
+
+
+@pytest.mark.parametrize("raw, locale", [
+    # 分组或小数点不符合区域格式的值必须报错，而不是被解析成另一个数
+    ("1.234,5", "en"),
+    ("1,5", "en"),
+    ("1,23", "en"),
+    ("1 234,5", "en"),
+    ("1,23,456", "en"),
+    ("1.2.3", "en"),
+    ("1.5", "de"),
+    ("1,234.5", "de"),
+    ("", "en"),
+    ("n/a", "en"),
+])
+def test_parse_numeric_rejects_ambiguous_values(raw, locale):
+    with pytest.raises(CoercionError):
+        parse_numeric(raw, locale)
+
+
+def test_parse_integer_rejects_fractions():
+    assert parse_integer("1.5万", "zh") == 15000
+    with pytest.raises(CoercionError):
+        parse_integer("1.5", "en")